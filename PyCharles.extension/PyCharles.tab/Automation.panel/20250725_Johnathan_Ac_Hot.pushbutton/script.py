@@ -4,12 +4,14 @@ def export_parts_and_references_to_excel_xml(doc, view, out_xml_path):
     all_part_param_names = set()
     all_ref_param_names = set()
     part_data = []
+    readers = ParameterReaderCache(DISPLAY_READERS)
+    names = ElementNameCache()
     for part in parts:
         part_id = part.Id.IntegerValue
-        part_fam, part_type, part_cat, part_params = get_element_info(part)
+        part_fam, part_type, part_cat, part_params = get_element_info(part, readers, names)
         ref_elem = get_reference_element(doc, part)
         ref_elem_id = ref_elem.Id.IntegerValue if ref_elem else ''
-        ref_fam, ref_type, ref_cat, ref_params = get_element_info(ref_elem)
+        ref_fam, ref_type, ref_cat, ref_params = get_element_info(ref_elem, readers, names)
         all_part_param_names.update(part_params.keys())
         all_ref_param_names.update(ref_params.keys())
         part_data.append({
@@ -86,6 +88,8 @@ from pyrevit import revit, script
 from Autodesk.Revit.DB import FilteredElementCollector, BuiltInCategory, ElementId, Part, View, Element
 import csv
 import os
+from param_readers import ParameterReaderCache, DISPLAY_READERS
+from element_names import ElementNameCache
 
 def get_all_parts_in_current_view(doc, view):
     # Get all Part elements visible in the current view
@@ -112,8 +116,9 @@ def get_reference_element(doc, part):
         else:
             return None
 
-def get_element_info(elem):
+def get_element_info(elem, readers, names):
     # Get family name, type name, category, and all parameters as dict
+    # (names once per type and category from the ElementNameCache, parameters through the ParameterReaderCache)
     fam_name = ''
     type_name = ''
     cat_name = ''
@@ -121,22 +126,9 @@ def get_element_info(elem):
     if elem is None:
         return fam_name, type_name, cat_name, param_dict
     try:
-        if hasattr(elem, 'Symbol') and elem.Symbol:
-            fam_name = elem.Symbol.Family.Name
-            type_name = elem.Symbol.Name
-        elif hasattr(elem, 'FamilyName'):
-            fam_name = elem.FamilyName
-        if hasattr(elem, 'Name'):
-            type_name = elem.Name
-        if elem.Category:
-            cat_name = elem.Category.Name
-        for param in elem.Parameters:
-            try:
-                pname = param.Definition.Name
-                pval = param.AsValueString() if param.StorageType != 4 else str(param.AsElementId().IntegerValue)
-                param_dict[pname] = pval
-            except Exception:
-                pass
+        fam_name, type_name = names.get_family_and_type_names(elem)
+        cat_name = names.get_category_name(elem)
+        param_dict = readers.read(elem)
     except Exception:
         pass
     return fam_name, type_name, cat_name, param_dict
@@ -147,12 +139,14 @@ def export_parts_and_references_to_csv(doc, view, out_csv_path):
     all_part_param_names = set()
     all_ref_param_names = set()
     part_data = []
+    readers = ParameterReaderCache(DISPLAY_READERS)
+    names = ElementNameCache()
     for part in parts:
         part_id = part.Id.IntegerValue
-        part_fam, part_type, part_cat, part_params = get_element_info(part)
+        part_fam, part_type, part_cat, part_params = get_element_info(part, readers, names)
         ref_elem = get_reference_element(doc, part)
         ref_elem_id = ref_elem.Id.IntegerValue if ref_elem else ''
-        ref_fam, ref_type, ref_cat, ref_params = get_element_info(ref_elem)
+        ref_fam, ref_type, ref_cat, ref_params = get_element_info(ref_elem, readers, names)
         all_part_param_names.update(part_params.keys())
         all_ref_param_names.update(ref_params.keys())
         part_data.append({
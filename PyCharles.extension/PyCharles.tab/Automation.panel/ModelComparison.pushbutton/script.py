@@ -1,19 +1,36 @@
 # -*- coding: utf-8 -*-
 from pyrevit import revit, script
 from Autodesk.Revit.DB import BuiltInCategory, ElementTransformUtils, CopyPasteOptions, Transaction, RevitLinkInstance, ElementId
-from Autodesk.Revit.UI import TaskDialog, Selection
+from Autodesk.Revit.UI import TaskDialog, TaskDialogCommonButtons, TaskDialogResult, TaskDialogCommandLinkId, Selection
 from System.Collections.Generic import List
-import csv
 import os
+import re
+import json
 from Autodesk.Revit.DB import FamilyInstance
 import clr
 clr.AddReference('System.Windows.Forms')
-from System.Windows.Forms import FolderBrowserDialog, OpenFileDialog, Form, Label, Button, DialogResult, CheckedListBox, ColorDialog, ComboBox, Panel
+from System.Windows.Forms import FolderBrowserDialog, OpenFileDialog, Form, Label, Button, DialogResult, CheckedListBox, ColorDialog, ComboBox, Panel, ListBox
 from Autodesk.Revit.DB import FilteredElementCollector, ParameterFilterElement, FilterRule, FilterStringRule, FilterStringEquals, OverrideGraphicSettings, Color, View
 import datetime
 import time
 from Autodesk.Revit.DB import BuiltInParameterGroup, ViewType
-from System.Windows.Forms import SelectionMode
+from System.Windows.Forms import SelectionMode, ComboBoxStyle
+from param_readers import ParameterReaderCache, VALUE_READERS
+from element_names import ElementNameCache, get_type_id
+from model_versions import find_native_changes, get_file_version_guid
+from change_tracker import get_change_tracker
+from model_open import OpenProfile, get_document_pool, DETACH_PRESERVE, WORKSETS_ALL
+from model_compare_core import (
+    ANALYSIS_XYZ, ANALYSIS_PARAMS, ANALYSIS_ELEMENTS, ANALYSIS_ESTIMATE, MATCH_RECREATED_ELEMENTS,
+    SNAPSHOT_FORMAT_VERSION, SKETCH_SIZE, CompactParamStore, ContentHasher, ModelHashes, ModelSketch,
+    STAGE_EXTRACT_PREVIOUS, STAGE_EXTRACT_LATEST, STAGE_EXPORT, STAGE_WRITE_BACK, ComparisonPipeline,
+    add_compare_stages, add_stream_stages, new_xyz_store, load_snapshot_file, save_snapshot_file, get_compare_date,
+    estimate_changes, print_estimate, write_estimate_csv, spill_element_data, remove_spill_file, SPILL_CHUNK_SIZE,
+    load_parameter_profiles, save_parameter_profiles
+)
+
+# Session change tracking (see change_tracker) handles DocumentChanged events after the script has finished
+__persistentengine__ = True
 
 # --- Helper Functions ---
 def select_folder():
@@ -34,16 +51,20 @@ def select_model(title, initial_dir=None):
         return dialog.FileName
     return None
 
-def show_analysis_item_selection():
+def show_analysis_item_selection(profile_names, selected_profile):
+    """
+    Returns (analysis items, parameter profile name).
+    """
     items = [
-        "XYZ deviation",
-        "Parameter value change",
-        "Newly/deleted elements"
+        ANALYSIS_XYZ,
+        ANALYSIS_PARAMS,
+        ANALYSIS_ELEMENTS,
+        ANALYSIS_ESTIMATE
     ]
     form = Form()
     form.Text = "Select Analysis Items"
     form.Width = 400
-    form.Height = 300
+    form.Height = 360
     label = Label()
     label.Text = "Check analysis items to include:"
     label.Top = 10
@@ -59,17 +80,101 @@ def show_analysis_item_selection():
     for item in items:
         clb.Items.Add(item)
     form.Controls.Add(clb)
+    profile_label = Label()
+    profile_label.Text = "Parameter profile:"
+    profile_label.Top = 175
+    profile_label.Left = 10
+    profile_label.Width = 350
+    form.Controls.Add(profile_label)
+    profile_combo = ComboBox()
+    profile_combo.Width = 350
+    profile_combo.Top = 200
+    profile_combo.Left = 10
+    profile_combo.DropDownStyle = ComboBoxStyle.DropDownList
+    for name in profile_names:
+        profile_combo.Items.Add(name)
+    if selected_profile in profile_names:
+        profile_combo.SelectedIndex = profile_names.index(selected_profile)
+    elif profile_names:
+        profile_combo.SelectedIndex = 0
+    form.Controls.Add(profile_combo)
     ok_button = Button()
     ok_button.Text = "OK"
-    ok_button.Top = 180
+    ok_button.Top = 240
     ok_button.Left = 200
     ok_button.Width = 80
     ok_button.DialogResult = DialogResult.OK
     form.Controls.Add(ok_button)
     form.AcceptButton = ok_button
     if form.ShowDialog() == DialogResult.OK:
-        return [str(clb.Items[i]) for i in range(clb.Items.Count) if clb.GetItemChecked(i)]
-    return []
+        items = [str(clb.Items[i]) for i in range(clb.Items.Count) if clb.GetItemChecked(i)]
+        return items, str(profile_combo.SelectedItem) if profile_combo.SelectedItem is not None else None
+    return [], None
+
+def show_scope_selection(doc, selected_ids=None):
+    """
+    Returns (scope kind, value) or None if cancelled. The names of the active model are offered as values,
+    and its selected element ids (selected_ids) for an element id scope.
+    """
+    form = Form()
+    form.Text = "Select Comparison Scope"
+    form.Width = 400
+    form.Height = 240
+    label = Label()
+    label.Text = "Compare only:"
+    label.Top = 10
+    label.Left = 10
+    label.Width = 350
+    form.Controls.Add(label)
+    kind_combo = ComboBox()
+    kind_combo.Width = 350
+    kind_combo.Top = 35
+    kind_combo.Left = 10
+    kind_combo.DropDownStyle = ComboBoxStyle.DropDownList
+    for kind in SCOPE_KINDS:
+        kind_combo.Items.Add(kind)
+    form.Controls.Add(kind_combo)
+    value_label = Label()
+    value_label.Top = 70
+    value_label.Left = 10
+    value_label.Width = 350
+    form.Controls.Add(value_label)
+    value_combo = ComboBox()
+    value_combo.Width = 350
+    value_combo.Top = 95
+    value_combo.Left = 10
+    form.Controls.Add(value_combo)
+
+    def on_kind_changed(sender, args):
+        kind = str(kind_combo.SelectedItem)
+        value_combo.Items.Clear()
+        value_combo.Text = ''
+        value_combo.Enabled = kind != SCOPE_ALL
+        if kind == SCOPE_REGION:
+            value_label.Text = "Region x1,y1,z1,x2,y2,z2 (feet, compared coordinates):"
+        elif kind == SCOPE_ELEMENTS:
+            value_label.Text = "Element ids (the current selection, or paste a list):"
+            value_combo.Text = ', '.join(str(eid) for eid in selected_ids or [])
+        else:
+            value_label.Text = "Name:" if kind != SCOPE_ALL else ""
+            try:
+                for name in get_scope_names(doc, kind):
+                    value_combo.Items.Add(name)
+            except Exception as e:
+                print("Could not list {} names: {}".format(kind, e))
+    kind_combo.SelectedIndexChanged += on_kind_changed
+    kind_combo.SelectedIndex = 0
+    ok_button = Button()
+    ok_button.Text = "OK"
+    ok_button.Top = 140
+    ok_button.Left = 200
+    ok_button.Width = 80
+    ok_button.DialogResult = DialogResult.OK
+    form.Controls.Add(ok_button)
+    form.AcceptButton = ok_button
+    if form.ShowDialog() == DialogResult.OK:
+        return str(kind_combo.SelectedItem), str(value_combo.Text)
+    return None
 
 def show_category_selection(categories):
     form = Form()
@@ -103,412 +208,654 @@ def show_category_selection(categories):
         return [str(clb.Items[i]) for i in range(clb.Items.Count) if clb.GetItemChecked(i)]
     return []
 
+# Display name -> BuiltInCategory member name. Elements are matched by category id, so the
+# selection works the same whatever the Revit UI language is.
+MODEL_CATEGORIES = [
+    ("Walls", "OST_Walls"),
+    ("Floors", "OST_Floors"),
+    ("Roofs", "OST_Roofs"),
+    ("Doors", "OST_Doors"),
+    ("Windows", "OST_Windows"),
+    ("Columns", "OST_Columns"),  # Architectural Columns
+    ("Structural Framing", "OST_StructuralFraming"),  # Includes beams
+    ("Curtain Walls", None),  # Curtain walls are Walls; no separate built-in category
+    ("Curtain Panels", "OST_CurtainWallPanels"),
+    ("Curtain Wall Mullions", "OST_CurtainWallMullions"),
+    ("Stairs", "OST_Stairs"),
+    ("Railings", "OST_StairsRailing"),
+    ("Ceilings", "OST_Ceilings"),
+    ("Rooms", "OST_Rooms"),
+    ("Spaces", "OST_MEPSpaces"),
+    ("Furniture", "OST_Furniture"),
+    ("Casework", "OST_Casework"),
+    ("Specialty Equipment", "OST_SpecialityEquipment"),
+    ("Mass", "OST_Mass"),
+    ("Topography", "OST_Topography"),
+    ("Site", "OST_Site"),
+    ("Structural Foundations", "OST_StructuralFoundation"),
+    ("Structural Beam Systems", "OST_StructuralFramingSystem"),
+    ("Structural Columns", "OST_StructuralColumns"),
+    ("Structural Trusses", "OST_StructuralTruss"),
+    ("Structural Stiffeners", "OST_StructuralStiffener"),
+    ("Generic Models", "OST_GenericModel"),
+    ("Detail Items", "OST_DetailComponents")
+]
+
 def get_all_model_categories():
-    return [
-        "Walls",
-        "Floors",
-        "Roofs",
-        "Doors",
-        "Windows",
-        "Columns",  # Architectural Columns
-        "Structural Framing",  # Includes beams
-        "Curtain Walls",
-        "Curtain Panels",
-        "Curtain Wall Mullions",
-        "Stairs",
-        "Railings",
-        "Ceilings",
-        "Rooms",
-        "Spaces",
-        "Furniture",
-        "Casework",
-        "Specialty Equipment",
-        "Mass",
-        "Topography",
-        "Site",
-        "Structural Foundations",
-        "Structural Beam Systems",
-        "Structural Columns",
-        "Structural Trusses",
-        "Structural Stiffeners",
-        "Generic Models",
-        "Detail Items"
-    ]
+    return [name for name, _ in MODEL_CATEGORIES]
 
-def extract_xyz_by_category(doc, categories):
+def get_builtin_category_ids(categories):
+    """Returns {category_id (int): category_name} of the selected categories that have a BuiltInCategory."""
+    bic_names = dict(MODEL_CATEGORIES)
+    category_ids = {}
+    for name in categories:
+        bic = getattr(BuiltInCategory, bic_names.get(name) or '', None)
+        if bic is not None:
+            category_ids[int(bic)] = name
+    return category_ids
+
+def resolve_category_ids(doc, categories):
     """
-    Extracts the XYZ location (in world coordinates), family and type, and category of elements in the given categories from the current opened model.
-    Returns a dict: {element_id: (family_and_type, category, (x, y, z))}
+    Resolves the selected category names to category ids once per document.
+    Names without a known BuiltInCategory fall back to a lookup in doc.Settings.Categories.
+    Returns a dict: {category_id (int): category_name}
+    """
+    category_ids = get_builtin_category_ids(categories)
+    unresolved = [name for name in categories if name not in category_ids.values()]
+    if unresolved:
+        for cat in doc.Settings.Categories:
+            if cat.Name in unresolved:
+                category_ids[cat.Id.IntegerValue] = cat.Name
+    return category_ids
+
+# --- Comparison scope ---
+# A scope limits the comparison to part of each model, e.g. one level of a tower. Worksets, levels,
+# phases, design options and views are given by name, so the scope resolves the same way in the PREVIOUS
+# and the LATEST model. A region is an axis-aligned box in the compared coordinates (feet, the
+# coordinates of the XYZ results). Scopes are applied as collector filters, so elements out of scope are
+# never returned from Revit. An element id scope (e.g. the current selection; element ids are kept across
+# versions of a model) looks up each element with doc.GetElement, so its cost follows the number of ids.
+SCOPE_ALL = "Whole model"
+SCOPE_WORKSET = "Workset"
+SCOPE_LEVEL = "Level"
+SCOPE_PHASE = "Phase"
+SCOPE_DESIGN_OPTION = "Design option"
+SCOPE_VIEW = "Elements visible in view"
+SCOPE_REGION = "Region"
+SCOPE_ELEMENTS = "Element ids"
+SCOPE_KINDS = [SCOPE_ALL, SCOPE_WORKSET, SCOPE_LEVEL, SCOPE_PHASE, SCOPE_DESIGN_OPTION, SCOPE_VIEW, SCOPE_REGION, SCOPE_ELEMENTS]
+COMPARISON_SCOPE = None  # ComparisonScope; None compares the whole model
+
+class ComparisonScope(object):
+    """
+    kind: one of SCOPE_KINDS; value: the name, region or element id list as entered.
+    element_ids: the ids of an element id scope that is not entered (value is then only a description).
+    """
+
+    def __init__(self, kind, value, element_ids=None):
+        self.kind = kind
+        self.value = value.strip()
+        if kind == SCOPE_REGION:
+            self.region = parse_region(self.value)
+        if kind == SCOPE_ELEMENTS:
+            self.element_ids = sorted(element_ids) if element_ids is not None else parse_element_ids(self.value)
+
+    def key(self):
+        if self.kind == SCOPE_ELEMENTS:
+            return [self.kind, self.element_ids]
+        return [self.kind, self.value]
+
+    def describe(self):
+        if self.kind == SCOPE_ELEMENTS:
+            return "{} ({} elements)".format(self.kind, len(self.element_ids))
+        return "{} '{}'".format(self.kind, self.value)
+
+def parse_region(text):
+    """
+    Parses 'x1,y1,z1,x2,y2,z2' to ((min x, min y, min z), (max x, max y, max z)). Raises ValueError.
+    """
+    values = [float(v) for v in text.replace(';', ',').split(',') if v.strip()]
+    if len(values) != 6:
+        raise ValueError("A region needs six numbers: x1,y1,z1,x2,y2,z2")
+    return (tuple(min(values[i], values[i + 3]) for i in range(3)),
+            tuple(max(values[i], values[i + 3]) for i in range(3)))
+
+def parse_element_ids(text):
+    """
+    Parses element ids separated by commas, semicolons or white space to a sorted list. Raises ValueError.
+    """
+    element_ids = sorted(set(int(v) for v in re.split(r'[\s,;]+', text) if v))
+    if not element_ids:
+        raise ValueError("No element ids given")
+    return element_ids
+
+def iter_elements_by_id(doc, element_ids):
+    """Yields the elements (not element types) with the given ids that exist in the document."""
+    from Autodesk.Revit.DB import ElementType
+    for eid in element_ids:
+        elem = doc.GetElement(ElementId(eid))
+        if elem is not None and not isinstance(elem, ElementType):
+            yield elem
+
+def get_scope_elements(doc, kind):
+    """
+    Returns [(name, id)] of the worksets, levels, phases, design options or views of the document.
+    """
+    from Autodesk.Revit.DB import FilteredWorksetCollector, WorksetKind, Level, DesignOption
+    if kind == SCOPE_WORKSET:
+        if not doc.IsWorkshared:
+            return []
+        return [(ws.Name, ws.Id) for ws in FilteredWorksetCollector(doc).OfKind(WorksetKind.UserWorkset)]
+    if kind == SCOPE_LEVEL:
+        return [(e.Name, e.Id) for e in FilteredElementCollector(doc).OfClass(Level)]
+    if kind == SCOPE_PHASE:
+        return [(e.Name, e.Id) for e in doc.Phases]
+    if kind == SCOPE_DESIGN_OPTION:
+        return [(e.Name, e.Id) for e in FilteredElementCollector(doc).OfClass(DesignOption)]
+    if kind == SCOPE_VIEW:
+        return [(e.Name, e.Id) for e in FilteredElementCollector(doc).OfClass(View) if not e.IsTemplate]
+    return []
+
+def get_scope_names(doc, kind):
+    return sorted(set(name for name, _ in get_scope_elements(doc, kind)))
+
+def find_scope_ids(doc, scope):
+    """Returns the ids of the scope's named elements in the document. Raises ValueError if there are none."""
+    ids = [eid for name, eid in get_scope_elements(doc, scope.kind) if name == scope.value]
+    if not ids:
+        raise ValueError("Scope {} not found in {}".format(scope.describe(), doc.Title))
+    return ids
+
+def get_scope_filter(doc, scope, transform=None):
+    """
+    Returns the ElementFilter of a scope (None for views, which scope the collector itself).
+    transform maps the document to the compared coordinates (default: get_model_transform(doc)).
+    """
+    from Autodesk.Revit.DB import (ElementWorksetFilter, ElementLevelFilter, ElementPhaseStatusFilter, ElementOnPhaseStatus,
+                                   ElementDesignOptionFilter, BoundingBoxIntersectsFilter, LogicalOrFilter, ElementFilter,
+                                   Outline, XYZ)
+    if scope.kind == SCOPE_REGION:
+        if transform is None:
+            transform = get_model_transform(doc)
+        # Box around the region corners in the document's own coordinates
+        inverse = transform.Inverse
+        low, high = scope.region
+        corners = [inverse.OfPoint(XYZ(x, y, z)) for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])]
+        return BoundingBoxIntersectsFilter(Outline(
+            XYZ(min(p.X for p in corners), min(p.Y for p in corners), min(p.Z for p in corners)),
+            XYZ(max(p.X for p in corners), max(p.Y for p in corners), max(p.Z for p in corners))))
+    if scope.kind == SCOPE_VIEW:
+        return None
+    ids = find_scope_ids(doc, scope)
+    if scope.kind == SCOPE_WORKSET:
+        filters = [ElementWorksetFilter(i) for i in ids]
+    elif scope.kind == SCOPE_LEVEL:
+        filters = [ElementLevelFilter(i) for i in ids]
+    elif scope.kind == SCOPE_PHASE:
+        # Elements that exist in the phase: created in it or earlier and not demolished
+        statuses = List[ElementOnPhaseStatus]([ElementOnPhaseStatus.New, ElementOnPhaseStatus.Existing])
+        filters = [ElementPhaseStatusFilter(i, statuses) for i in ids]
+    else:
+        filters = [ElementDesignOptionFilter(i) for i in ids]
+    if len(filters) == 1:
+        return filters[0]
+    return LogicalOrFilter(List[ElementFilter](filters))
+
+def get_category_collector(doc, category_ids, transform=None):
+    """
+    Returns a non-type element collector pre-filtered to the given category ids with an
+    ElementMulticategoryFilter, so only matching elements are returned from Revit.
+    The COMPARISON_SCOPE is applied the same way (transform: see get_scope_filter).
+    """
+    from Autodesk.Revit.DB import FilteredElementCollector, ElementMulticategoryFilter
+    id_list = List[ElementId]([ElementId(cid) for cid in category_ids])
+    scope = COMPARISON_SCOPE
+    if scope is not None and scope.kind == SCOPE_VIEW:
+        collector = FilteredElementCollector(doc, find_scope_ids(doc, scope)[0]).WhereElementIsNotElementType()
+    else:
+        collector = FilteredElementCollector(doc).WhereElementIsNotElementType()
+    collector = collector.WherePasses(ElementMulticategoryFilter(id_list))
+    scope_filter = get_scope_filter(doc, scope, transform) if scope is not None else None
+    if scope_filter is not None:
+        collector = collector.WherePasses(scope_filter)
+    return collector
+
+def get_scoped_elements(doc, category_ids, transform=None):
+    """
+    Returns the elements to extract: looked up one by one for an element id scope, else get_category_collector.
+    Elements of an element id scope are not filtered by category here.
+    """
+    scope = COMPARISON_SCOPE
+    if scope is not None and scope.kind == SCOPE_ELEMENTS:
+        return iter_elements_by_id(doc, scope.element_ids)
+    return get_category_collector(doc, category_ids, transform)
+
+# --- Native change detection ---
+# When the PREVIOUS model is an earlier version of the LATEST model, Revit reports the changed element ids
+# (see model_versions); the comparison is then scoped to those ids. The LATEST model is opened first for it.
+NATIVE_CHANGE_DETECTION = True
+NATIVE_CHANGES_MAX_TYPES = 500  # More modified types: their instances are not looked up, the full comparison runs
+
+def get_type_instance_ids(doc, modified_ids):
+    """
+    Returns the ids of the instances of the element types among modified_ids (their type parameters or names
+    changed), or None if there are more than NATIVE_CHANGES_MAX_TYPES types.
     """
-    from Autodesk.Revit.DB import FilteredElementCollector, Transform
-    xyz_data = {}
-    collector = FilteredElementCollector(doc).WhereElementIsNotElementType()
+    from Autodesk.Revit.DB import (ElementType, ElementParameterFilter, ParameterFilterRuleFactory, BuiltInParameter,
+                                   LogicalOrFilter, ElementFilter)
+    type_ids = []
+    for eid in modified_ids:
+        if isinstance(doc.GetElement(ElementId(eid)), ElementType):
+            type_ids.append(eid)
+    if not type_ids:
+        return []
+    if len(type_ids) > NATIVE_CHANGES_MAX_TYPES:
+        return None
+    type_param = ElementId(BuiltInParameter.ELEM_TYPE_PARAM)
+    filters = [ElementParameterFilter(ParameterFilterRuleFactory.CreateEqualsRule(type_param, ElementId(type_id)))
+               for type_id in type_ids]
+    type_filter = filters[0] if len(filters) == 1 else LogicalOrFilter(List[ElementFilter](filters))
+    collector = FilteredElementCollector(doc).WhereElementIsNotElementType().WherePasses(type_filter)
+    return [eid.IntegerValue for eid in collector.ToElementIds()]
+
+def find_native_change_scope(doc_latest, previous_version):
+    """
+    Returns an element id ComparisonScope of the elements changed since previous_version, or None
+    when the full comparison has to run.
+    """
+    changes = find_native_changes(doc_latest, previous_version, get_type_instance_ids)
+    if changes is None:
+        print("Running the full comparison.")
+        return None
+    return ComparisonScope(SCOPE_ELEMENTS, "changed since the previous version", changes.element_ids())
+
+def get_scope_key():
+    return COMPARISON_SCOPE.key() if COMPARISON_SCOPE is not None else None
+
+# --- Parameter profiles ---
+# The selected profile (see model_compare_core.ParameterProfile) is applied while parameters are read,
+# so excluded parameters are never read. None reads all parameters.
+PARAMETER_PROFILE = None
+
+def get_parameter_profiles_path():
+    import tempfile
+    base = os.environ.get('APPDATA') or tempfile.gettempdir()
+    folder = os.path.join(base, 'PyCharles')
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    return os.path.join(folder, 'parameter_profiles.json')
+
+def get_parameter_profile_key():
+    return PARAMETER_PROFILE.key() if PARAMETER_PROFILE is not None else None
+
+def get_parameter_readers():
+    """
+    Returns a ParameterReaderCache for one document that only reads the parameters the parameter profile allows.
+    """
+    allows = PARAMETER_PROFILE.allows if PARAMETER_PROFILE is not None else None
+    return ParameterReaderCache(VALUE_READERS, allows)
+
+def get_element_xyz(elem, transform):
+    """
+    Returns the world XYZ of the element location point (or curve mid point), or None.
+    """
+    loc = elem.Location
+    if loc is None:
+        return None
+    if hasattr(loc, 'Point') and loc.Point:
+        world_pt = transform.OfPoint(loc.Point)
+    elif hasattr(loc, 'Curve') and loc.Curve:
+        world_pt = transform.OfPoint(loc.Curve.Evaluate(0.5, True))
+    else:
+        return None
+    return (round(world_pt.X, 6), round(world_pt.Y, 6), round(world_pt.Z, 6))
+
+def get_model_transform(doc):
     # Get the model transform (identity for main model, or use GetTotalTransform for links)
+    from Autodesk.Revit.DB import Transform
     transform = Transform.Identity
     if hasattr(doc, 'ActiveProjectLocation') and doc.ActiveProjectLocation:
         try:
             transform = doc.ActiveProjectLocation.GetTotalTransform()
         except Exception:
             pass
+    return transform
+
+def iter_element_data(doc, categories, analysis_items, type_params, transform=None):
+    """
+    Visits each element of the selected categories once and yields
+    (element_id, family_and_type, category, xyz, parameters, type_key) for the chosen analysis items.
+    xyz is None when neither XYZ deviation nor Newly/deleted elements (for matching re-created elements) is chosen,
+    or when the element has no location point/curve;
+    parameters and type_key are None when Parameter value change is not chosen.
+    Type parameters are read once per type and stored in type_params: {type_key: {param_name: param_value}}.
+    transform maps element locations to the compared coordinates (default: get_model_transform(doc)).
+    """
+    want_xyz = ANALYSIS_XYZ in analysis_items or (ANALYSIS_ELEMENTS in analysis_items and MATCH_RECREATED_ELEMENTS)
+    want_params = ANALYSIS_PARAMS in analysis_items
+    if want_xyz and transform is None:
+        transform = get_model_transform(doc)
+    category_ids = resolve_category_ids(doc, categories)
+    if not category_ids:
+        return
+    collector = get_scoped_elements(doc, category_ids, transform)
+    readers = get_parameter_readers() if want_params else None
+    names = ElementNameCache()
     for elem in collector:
         try:
-            if elem.Category and elem.Category.Name in categories:
-                loc = elem.Location
-                if loc is None:
-                    continue
-                if hasattr(loc, 'Point') and loc.Point:
-                    pt = loc.Point
-                    world_pt = transform.OfPoint(pt)
-                    xyz = (round(world_pt.X, 6), round(world_pt.Y, 6), round(world_pt.Z, 6))
-                elif hasattr(loc, 'Curve') and loc.Curve:
-                    curve = loc.Curve
-                    mid_pt = curve.Evaluate(0.5, True)
-                    world_pt = transform.OfPoint(mid_pt)
-                    xyz = (round(world_pt.X, 6), round(world_pt.Y, 6), round(world_pt.Z, 6))
-                else:
-                    continue
-                fam_type = ''
-                try:
-                    param = elem.LookupParameter('Family and Type')
-                    if param:
-                        fam_type = param.AsValueString()
-                except Exception:
-                    pass
-                xyz_data[elem.Id.IntegerValue] = (fam_type, elem.Category.Name, xyz)
+            category_id = elem.Category.Id.IntegerValue
+            category = category_ids.get(category_id)
+            if category is None:
+                continue
+            eid = elem.Id.IntegerValue
+            type_id = get_type_id(elem)  # -1 for untyped elements
+            fam_type = names.get_family_and_type(elem, type_id)
+            xyz = get_element_xyz(elem, transform) if want_xyz else None
+            params = None
+            type_key = None
+            if want_params:
+                type_key = type_id  # Untyped elements share an empty type parameter dict
+                params = readers.read(elem, category_id, type_key)
+                # Extract type parameters with caching
+                if type_key not in type_params:
+                    type_elem = doc.GetElement(ElementId(type_key)) if type_key != -1 else None
+                    type_params[type_key] = readers.read(type_elem) if type_elem else {}
         except Exception:
-            pass
-    return xyz_data
+            continue
+        yield eid, fam_type, category, xyz, params, type_key
+    if readers is not None:
+        print("Parameter readers: {}".format(readers.describe()))
+
+def extract_model_data(doc, categories, analysis_items, transform=None):
+    """
+    Extracts the data needed by the chosen analysis items in a single pass over the model.
+    Each element is visited once and 'Family and Type' is looked up once per type.
+    Returns a tuple (xyz_data, param_data, elements_data, hashes); entries for analysis items that are not chosen are None.
+      xyz_data: {element_id: (family_and_type, category, (x, y, z))} (a CompactXyzStore when numpy is available)
+      param_data: CompactParamStore, used like {element_id: {family_and_type, category, parameters, type_parameters, type_id}}
+      elements_data: [(element_id, family_and_type, category, xyz), ...]
+      hashes: ModelHashes of all extracted elements
+    """
+    want_xyz = ANALYSIS_XYZ in analysis_items
+    want_params = ANALYSIS_PARAMS in analysis_items
+    want_elements = ANALYSIS_ELEMENTS in analysis_items
+    xyz_data = new_xyz_store() if want_xyz else None
+    param_data = CompactParamStore() if want_params else None
+    elements_data = [] if want_elements else None
+    type_params = {}
+    hasher = ContentHasher(type_params)
+    hashes = ModelHashes()
+    for eid, fam_type, category, xyz, params, type_key in iter_element_data(doc, categories, analysis_items, type_params, transform):
+        hashes.add(eid, category, hasher.element_hash(fam_type, category, xyz, params, type_key))
+        if want_xyz and xyz is not None:
+            xyz_data[eid] = (fam_type, category, xyz)
+        if want_params:
+            param_data.add(eid, fam_type, category, params, param_data.add_type(type_key, type_params[type_key]), type_key)
+        if want_elements:
+            elements_data.append((eid, fam_type, category, xyz))
+    return xyz_data, param_data, elements_data, hashes
+
+def extract_xyz_by_category(doc, categories):
+    """
+    Extracts the XYZ location (in world coordinates), family and type, and category of elements in the given categories from the current opened model.
+    Returns a dict: {element_id: (family_and_type, category, (x, y, z))}
+    """
+    return extract_model_data(doc, categories, [ANALYSIS_XYZ])[0]
 
 def extract_parameters_by_category(doc, categories):
     """
     Extracts all instance and type parameters and their values for elements in the given categories from the current opened model.
     Returns a dict: {element_id: {family_and_type: str, category: str, parameters: {param_name: param_value, ...}, type_parameters: {param_name: param_value, ...}}}
     """
-    from Autodesk.Revit.DB import FilteredElementCollector
-    param_data = {}
-    type_param_cache = {}  # Cache type parameters by type id
-    collector = FilteredElementCollector(doc).WhereElementIsNotElementType()
-    for elem in collector:
-        try:
-            if elem.Category and elem.Category.Name in categories:
-                param_dict = {}
-                for param in elem.Parameters:
-                    try:
-                        param_name = param.Definition.Name
-                        if param.StorageType == 0:  # None
-                            param_value = None
-                        elif param.StorageType == 1:  # Integer
-                            param_value = param.AsInteger()
-                        elif param.StorageType == 2:  # Double
-                            param_value = param.AsDouble()
-                        elif param.StorageType == 3:  # String
-                            param_value = param.AsString()
-                        elif param.StorageType == 4:  # ElementId
-                            param_value = param.AsElementId().IntegerValue
-                        else:
-                            param_value = param.AsValueString()
-                        param_dict[param_name] = param_value
-                    except Exception:
-                        pass
-                # Extract type parameters with caching
-                type_param_dict = {}
-                try:
-                    type_id = elem.GetTypeId()
-                    if type_id and type_id.IntegerValue != -1:
-                        if type_id not in type_param_cache:
-                            type_elem = doc.GetElement(type_id)
-                            tdict = {}
-                            if type_elem:
-                                for tparam in type_elem.Parameters:
-                                    try:
-                                        tparam_name = tparam.Definition.Name
-                                        if tparam.StorageType == 0:
-                                            tparam_value = None
-                                        elif tparam.StorageType == 1:
-                                            tparam_value = tparam.AsInteger()
-                                        elif tparam.StorageType == 2:
-                                            tparam_value = tparam.AsDouble()
-                                        elif tparam.StorageType == 3:
-                                            tparam_value = tparam.AsString()
-                                        elif tparam.StorageType == 4:
-                                            tparam_value = tparam.AsElementId().IntegerValue
-                                        else:
-                                            tparam_value = tparam.AsValueString()
-                                        tdict[tparam_name] = tparam_value
-                                    except Exception:
-                                        pass
-                            type_param_cache[type_id] = tdict
-                        type_param_dict = type_param_cache[type_id]
-                except Exception:
-                    pass
-                fam_type = ''
-                try:
-                    param = elem.LookupParameter('Family and Type')
-                    if param:
-                        fam_type = param.AsValueString()
-                except Exception:
-                    pass
-                param_data[elem.Id.IntegerValue] = {
-                    'family_and_type': fam_type,
-                    'category': elem.Category.Name,
-                    'parameters': param_dict,
-                    'type_parameters': type_param_dict
-                }
-        except Exception:
-            pass
-    return param_data
+    return extract_model_data(doc, categories, [ANALYSIS_PARAMS])[1]
 
 def get_elements_by_category(doc, categories):
     """
     Returns a list of tuples for all elements in the selected categories in the given model document.
     Each tuple: (element_id, family_and_type, category)
     """
-    from Autodesk.Revit.DB import FilteredElementCollector
-    result = []
-    collector = FilteredElementCollector(doc).WhereElementIsNotElementType()
-    for elem in collector:
-        try:
-            if elem.Category and elem.Category.Name in categories:
-                eid = elem.Id.IntegerValue
-                fam_type = ''
-                try:
-                    param = elem.LookupParameter('Family and Type')
-                    if param:
-                        fam_type = param.AsValueString()
-                except Exception:
-                    pass
-                category = elem.Category.Name if elem.Category else ''
-                result.append((eid, fam_type, category))
-        except Exception:
-            pass
-    return result
+    return extract_model_data(doc, categories, [ANALYSIS_ELEMENTS])[2]
 
-def compare_xyz_data(prev_xyz_data, latest_xyz_data):
-    """
-    Compares XYZ data between previous and latest models by element_id.
-    Returns a list of dicts with keys:
-    'previous_element_id', 'current_element_id', 'previous_family_and_type', 'current_family_and_type', 'previous_category', 'current_category', 'compare_result', 'compare_date'
-    """
-    import datetime
-    results = []
-    for prev_id, (fam_type, cat, prev_xyz) in prev_xyz_data.items():
-        if prev_id in latest_xyz_data:
-            lfam_type, lcat, latest_xyz = latest_xyz_data[prev_id]
-            dx = latest_xyz[0] - prev_xyz[0]
-            dy = latest_xyz[1] - prev_xyz[1]
-            dz = latest_xyz[2] - prev_xyz[2]
-            xy_moved = abs(dx) > 0.001 or abs(dy) > 0.001
-            z_moved = abs(dz) > 0.001
-            if not xy_moved and not z_moved:
-                compare_result = "No movement"
-            elif xy_moved and not z_moved:
-                xy_dist = ((dx ** 2 + dy ** 2) ** 0.5) * 304.8  # Revit units to mm
-                compare_result = "XY coordination move + '{0}mm'".format(int(round(xy_dist)))
-            elif z_moved and not xy_moved:
-                z_dist = abs(dz) * 304.8  # Revit units to mm
-                if dz > 0:
-                    compare_result = "Z coordination move upward + '{0}mm'".format(int(round(z_dist)))
-                else:
-                    compare_result = "Z coordination move downward + '{0}mm'".format(int(round(z_dist)))
-            elif xy_moved and z_moved:
-                xy_dist = ((dx ** 2 + dy ** 2) ** 0.5) * 304.8
-                z_dist = abs(dz) * 304.8
-                if dz > 0:
-                    compare_result = "XY coordination move + '{0}mm', Z coordination move upward + '{1}mm'".format(int(round(xy_dist)), int(round(z_dist)))
-                else:
-                    compare_result = "XY coordination move + '{0}mm', Z coordination move downward + '{1}mm'".format(int(round(xy_dist)), int(round(z_dist)))
-            best_match_id = prev_id
-        else:
-            compare_result = "No match found"
-            best_match_id = ''
-        if compare_result not in ["No movement", "No match found"]:
-            compare_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            results.append({
-                'previous_element_id': prev_id,
-                'current_element_id': best_match_id,
-                'previous_family_and_type': fam_type,
-                'current_family_and_type': fam_type,  # XYZ only compares same element, so use fam_type for both
-                'previous_category': cat,
-                'current_category': cat,
-                'compare_result': compare_result,
-                'compare_date': compare_date
-            })
-    return results
-
-def compare_param_data(prev_param_data, latest_param_data):
+# --- Snapshot cache ---
+# Extracted model data is cached on disk so a model that was already extracted (e.g. last
+# week's LATEST, which is this week's PREVIOUS) does not have to be opened again.
+EXPORT_SNAPSHOTS = True  # Also save both snapshots to the output folder, for model_compare_cli.py
+SNAPSHOT_CACHE_MAX_ENTRIES = 12
+SNAPSHOT_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+SNAPSHOT_CACHE_INDEX = "index.json"
+
+def get_snapshot_cache_dir():
+    import tempfile
+    base = os.environ.get('APPDATA') or tempfile.gettempdir()
+    cache_dir = os.path.join(base, 'PyCharles', 'ModelComparisonCache')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+def load_snapshot_index(cache_dir):
+    path = os.path.join(cache_dir, SNAPSHOT_CACHE_INDEX)
+    try:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                index = json.load(f)
+            index.setdefault('entries', {})
+            index.setdefault('file_hashes', {})
+            return index
+    except Exception as e:
+        print("Error loading snapshot cache index:", e)
+    return {'entries': {}, 'file_hashes': {}}
+
+def save_snapshot_index(cache_dir, index):
+    path = os.path.join(cache_dir, SNAPSHOT_CACHE_INDEX)
+    try:
+        with open(path, 'w') as f:
+            json.dump(index, f)
+    except Exception as e:
+        print("Error saving snapshot cache index:", e)
+
+def get_file_content_hash(model_path, index):
     """
-    Compares parameter data (instance and type) between previous and latest models by element_id and parameter name.
-    Groups results by element id, concatenating compare results with a comma.
-    Returns a list of dicts with keys:
-    'previous_element_id', 'current_element_id', 'previous_family_and_type', 'current_family_and_type', 'previous_category', 'current_category', 'compare_result', 'compare_date'
+    Returns the sha1 of the model file. Hashes are remembered per (path, size, mtime) in the
+    cache index, so an unchanged file is only read once.
     """
-    import datetime
-    from collections import defaultdict
-    grouped = defaultdict(lambda: {
-        'previous_element_id': '',
-        'current_element_id': '',
-        'previous_family_and_type': '',
-        'current_family_and_type': '',
-        'previous_category': '',
-        'current_category': '',
-        'compare_result': [],
-        'compare_date': ''
-    })
-    all_element_ids = set(prev_param_data.keys()) | set(latest_param_data.keys())
-    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    for eid in all_element_ids:
-        prev_info = prev_param_data.get(eid)
-        latest_info = latest_param_data.get(eid)
-        prev_fam_type = prev_info['family_and_type'] if prev_info else ''
-        curr_fam_type = latest_info['family_and_type'] if latest_info else ''
-        prev_cat = prev_info['category'] if prev_info else ''
-        curr_cat = latest_info['category'] if latest_info else ''
-        key = (eid if eid in prev_param_data else '', eid if eid in latest_param_data else '', prev_fam_type, curr_fam_type, prev_cat, curr_cat)
-        group = grouped[key]
-        group['previous_element_id'] = eid if eid in prev_param_data else ''
-        group['current_element_id'] = eid if eid in latest_param_data else ''
-        group['previous_family_and_type'] = prev_fam_type
-        group['current_family_and_type'] = curr_fam_type
-        group['previous_category'] = prev_cat
-        group['current_category'] = curr_cat
-        group['compare_date'] = now
-        # Instance parameters
-        prev_params = prev_info['parameters'] if prev_info else {}
-        latest_params = latest_info['parameters'] if latest_info else {}
-        prev_param_names = set(prev_params.keys())
-        latest_param_names = set(latest_params.keys())
-        # New instance parameters
-        for pname in latest_param_names - prev_param_names:
-            group['compare_result'].append("new parameter add: {}".format(pname))
-        # Deleted instance parameters
-        for pname in prev_param_names - latest_param_names:
-            group['compare_result'].append("parameter delete: {}".format(pname))
-        # Changed instance parameters
-        for pname in prev_param_names & latest_param_names:
-            prev_val = prev_params[pname]
-            latest_val = latest_params[pname]
-            if prev_val != latest_val:
-                group['compare_result'].append("parameter value change: {} ({} -> {})".format(pname, prev_val, latest_val))
-        # Type parameters
-        prev_type_params = prev_info['type_parameters'] if prev_info and 'type_parameters' in prev_info else {}
-        latest_type_params = latest_info['type_parameters'] if latest_info and 'type_parameters' in latest_info else {}
-        prev_type_param_names = set(prev_type_params.keys())
-        latest_type_param_names = set(latest_type_params.keys())
-        # New type parameters
-        for pname in latest_type_param_names - prev_type_param_names:
-            group['compare_result'].append("new type parameter add: {}".format(pname))
-        # Deleted type parameters
-        for pname in prev_type_param_names - latest_type_param_names:
-            group['compare_result'].append("type parameter delete: {}".format(pname))
-        # Changed type parameters
-        for pname in prev_type_param_names & latest_type_param_names:
-            prev_val = prev_type_params[pname]
-            latest_val = latest_type_params[pname]
-            if prev_val != latest_val:
-                group['compare_result'].append("type parameter value change: {} ({} -> {})".format(pname, prev_val, latest_val))
-    # Build final results, only include those with changes
-    results = []
-    for group in grouped.values():
-        if group['compare_result']:
-            group['compare_result'] = ', '.join(group['compare_result'])
-            results.append(group)
-    return results
-
-def compare_element_data(prev_elements_data, latest_elements_data):
+    import hashlib
+    st = os.stat(model_path)
+    stat_key = "{}|{}|{}".format(os.path.normcase(os.path.abspath(model_path)), st.st_size, int(st.st_mtime))
+    content_hash = index['file_hashes'].get(stat_key)
+    if content_hash:
+        return stat_key, content_hash
+    sha = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            sha.update(chunk)
+    content_hash = sha.hexdigest()
+    index['file_hashes'][stat_key] = content_hash
+    return stat_key, content_hash
+
+def get_snapshot_key(model_path, categories, analysis_items, index):
+    import hashlib
+    stat_key, content_hash = get_file_content_hash(model_path, index)
+    key_data = json.dumps([SNAPSHOT_FORMAT_VERSION, stat_key, content_hash, sorted(categories), sorted(analysis_items),
+                           get_parameter_profile_key(), get_scope_key()])
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+def load_cached_snapshot(model_path, categories, analysis_items):
     """
-    Compares element lists between previous and latest models.
-    Returns a list of dicts with keys:
-    'previous_element_id', 'current_element_id', 'previous_family_and_type', 'current_family_and_type', 'previous_category', 'current_category', 'compare_result', 'compare_date'
+    Returns (xyz_data, param_data, elements_data, hashes) from the snapshot cache, or None on a cache miss.
     """
-    import datetime
-    prev_ids = set(e[0] for e in prev_elements_data)
-    latest_ids = set(e[0] for e in latest_elements_data)
-    prev_dict = {e[0]: e for e in prev_elements_data}
-    latest_dict = {e[0]: e for e in latest_elements_data}
-    results = []
-    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    # Deleted elements
-    for eid in prev_ids - latest_ids:
-        prev_e = prev_dict[eid]
-        results.append({
-            'previous_element_id': eid,
-            'current_element_id': '',
-            'previous_family_and_type': prev_e[1],
-            'current_family_and_type': '',
-            'previous_category': prev_e[2],
-            'current_category': '',
-            'compare_result': 'element deleted',
-            'compare_date': now
-        })
-    # New elements
-    for eid in latest_ids - prev_ids:
-        latest_e = latest_dict[eid]
-        results.append({
-            'previous_element_id': '',
-            'current_element_id': eid,
-            'previous_family_and_type': '',
-            'current_family_and_type': latest_e[1],
-            'previous_category': '',
-            'current_category': latest_e[2],
-            'compare_result': 'new element added',
-            'compare_date': now
-        })
-    return results
-
-def combine_comparison_results(xyz_results, param_results, element_results):
+    if is_link_source(model_path):
+        return None  # Loaded links are read in place, not cached
+    try:
+        cache_dir = get_snapshot_cache_dir()
+        index = load_snapshot_index(cache_dir)
+        key = get_snapshot_key(model_path, categories, analysis_items, index)
+        entry = index['entries'].get(key)
+        snapshot_path = os.path.join(cache_dir, entry['file']) if entry else None
+        if not snapshot_path or not os.path.exists(snapshot_path):
+            save_snapshot_index(cache_dir, index)
+            return None
+        data = load_snapshot_file(snapshot_path)
+        entry['last_used'] = time.time()
+        save_snapshot_index(cache_dir, index)
+        return data
+    except Exception as e:
+        print("Error loading snapshot cache:", e)
+        return None
+
+def save_cached_snapshot(model_path, categories, analysis_items, xyz_data, param_data, elements_data, hashes):
     """
-    Combines all comparison results by element id.
-    Appends all results, then groups by element id, concatenating compare results by ','.
-    If any compare result for an element is 'element deleted', just show 'element deleted'.
-    If any compare result for an element is 'new element added', just show 'new element added'.
-    Returns a list of dicts with keys:
-    'previous_element_id', 'current_element_id', 'previous_family_and_type', 'current_family_and_type', 'previous_category', 'current_category', 'compare_result', 'compare_date'
+    Stores extracted data in the snapshot cache and evicts least recently used snapshots
+    beyond SNAPSHOT_CACHE_MAX_ENTRIES / SNAPSHOT_CACHE_MAX_BYTES.
     """
-    from collections import defaultdict
-    all_results = []
-    # Append all results
-    for row in xyz_results:
-        all_results.append(row)
-    for row in param_results:
-        all_results.append(row)
-    for row in element_results:
-        all_results.append(row)
-    # Group by element id (use previous_element_id or current_element_id)
-    grouped = defaultdict(list)
-    for row in all_results:
-        key = row.get('previous_element_id') or row.get('current_element_id')
-        grouped[key].append(row)
-    # Build final results
-    results = []
-    for group_rows in grouped.values():
-        # Merge fields, prefer non-empty, prefer previous_*
-        merged = {
-            'previous_element_id': '',
-            'current_element_id': '',
-            'previous_family_and_type': '',
-            'current_family_and_type': '',
-            'previous_category': '',
-            'current_category': '',
-            'compare_result': '',
-            'compare_date': ''
+    if is_link_source(model_path):
+        return
+    try:
+        cache_dir = get_snapshot_cache_dir()
+        index = load_snapshot_index(cache_dir)
+        key = get_snapshot_key(model_path, categories, analysis_items, index)
+        file_name = key + ".json"
+        snapshot_path = os.path.join(cache_dir, file_name)
+        save_snapshot_file(snapshot_path, xyz_data, param_data, elements_data, hashes)
+        index['entries'][key] = {
+            'file': file_name,
+            'model_path': model_path,
+            'bytes': os.path.getsize(snapshot_path),
+            'last_used': time.time()
         }
-        compare_results = []
-        for row in group_rows:
-            for k in merged:
-                if not merged[k] and row.get(k):
-                    merged[k] = row.get(k)
-            compare_results.append(row.get('compare_result', ''))
-        # If any compare_result is 'element deleted', just show that
-        if 'element deleted' in compare_results:
-            merged['compare_result'] = 'element deleted'
-        # If any compare_result is 'new element added', just show that (unless deleted)
-        elif 'new element added' in compare_results:
-            merged['compare_result'] = 'new element added'
-        else:
-            merged['compare_result'] = ', '.join([r for r in compare_results if r])
-        results.append(merged)
-    return results
+        evict_snapshots(cache_dir, index)
+        save_snapshot_index(cache_dir, index)
+    except Exception as e:
+        print("Error saving snapshot cache:", e)
+
+def evict_snapshots(cache_dir, index):
+    entries = index['entries']
+    lru = sorted(entries.items(), key=lambda kv: kv[1].get('last_used', 0))
+    total_bytes = sum(e.get('bytes', 0) for _, e in lru)
+    while lru and (len(lru) > SNAPSHOT_CACHE_MAX_ENTRIES or total_bytes > SNAPSHOT_CACHE_MAX_BYTES):
+        key, entry = lru.pop(0)
+        total_bytes -= entry.get('bytes', 0)
+        del entries[key]
+        try:
+            os.remove(os.path.join(cache_dir, entry['file']))
+        except Exception:
+            pass
+    # Drop remembered hashes of files that no longer back any snapshot
+    live = set()
+    for entry in entries.values():
+        live.add(os.path.normcase(os.path.abspath(entry.get('model_path', ''))))
+    for stat_key in list(index['file_hashes'].keys()):
+        if stat_key.rsplit('|', 2)[0] not in live:
+            del index['file_hashes'][stat_key]
+
+# --- Quick estimate (sketches) ---
+# Building the model sketches (see model_compare_core.ModelSketch). Sketches are saved beside the .rvt.
+SKETCH_FORMAT_VERSION = 1
+SKETCH_FILE_SUFFIX = '.pycharles_sketch.json'
+
+def build_model_sketch(doc, categories, k=SKETCH_SIZE, transform=None):
+    """One cheap pass over the model: no parameters are read."""
+    type_params = {}
+    hasher = ContentHasher(type_params)
+    sketch = ModelSketch(k)
+    for category in categories:
+        sketch.categories.setdefault(category, [0, [], []])
+    for eid, fam_type, category, xyz, _, _ in iter_element_data(doc, categories, [ANALYSIS_XYZ], type_params, transform):
+        sketch.add(eid, category, hasher.element_hash(fam_type, category, xyz, None, None))
+    return sketch
+
+def get_sketch_path(model_path):
+    return os.path.splitext(model_path)[0] + SKETCH_FILE_SUFFIX
+
+def _model_stat_key(model_path):
+    st = os.stat(model_path)
+    return [st.st_size, int(st.st_mtime)]
+
+def load_model_sketch(model_path, categories):
+    """Returns the sketch saved beside the model if it is current and covers the categories, otherwise None."""
+    sketch_path = get_sketch_path(model_path)
+    if not os.path.exists(sketch_path):
+        return None
+    try:
+        with open(sketch_path, 'r') as f:
+            data = json.load(f)
+        if data.get('version') != SKETCH_FORMAT_VERSION or data.get('model') != _model_stat_key(model_path):
+            return None
+        if data.get('k') != SKETCH_SIZE:
+            return None
+        sketch = ModelSketch.from_json(data)
+        if not set(categories) <= set(sketch.categories):
+            return None
+        return sketch
+    except Exception as e:
+        print("Could not read sketch {}: {}".format(sketch_path, e))
+        return None
+
+def save_model_sketch(model_path, sketch):
+    sketch_path = get_sketch_path(model_path)
+    data = sketch.to_json()
+    data['version'] = SKETCH_FORMAT_VERSION
+    data['model'] = _model_stat_key(model_path)
+    try:
+        with open(sketch_path, 'w') as f:
+            json.dump(data, f)
+    except (IOError, OSError) as e:
+        print("Could not save sketch beside the model ({}): {}".format(sketch_path, e))
+
+def get_model_sketch(app, model_path, categories):
+    """Returns the model sketch, from the file beside the model or by opening the model."""
+    if is_link_source(model_path):
+        return build_model_sketch(model_path.doc, categories, transform=get_source_transform(model_path)), False
+    # Sketches beside the model cover the whole model; a scoped estimate builds its own
+    if COMPARISON_SCOPE is None:
+        sketch = load_model_sketch(model_path, categories)
+        if sketch is not None:
+            return sketch, True
+    doc = open_comparison_model(app, model_path, categories)
+    try:
+        sketch = build_model_sketch(doc, categories)
+    finally:
+        release_comparison_model(doc)
+    if COMPARISON_SCOPE is None:
+        save_model_sketch(model_path, sketch)
+    return sketch, False
+
+# --- Streaming comparison ---
+# Spilling the opened models (see model_compare_core.stream_compare). In 'auto' mode models of more than
+# STREAMING_ELEMENT_THRESHOLD elements are compared in streaming mode.
+COMPARISON_MODE = 'auto'  # 'memory', 'streaming' or 'auto'
+STREAMING_ELEMENT_THRESHOLD = 300000
+
+def count_elements(doc, categories):
+    category_ids = resolve_category_ids(doc, categories)
+    if not category_ids:
+        return 0
+    if COMPARISON_SCOPE is not None and COMPARISON_SCOPE.kind == SCOPE_ELEMENTS:
+        return len(COMPARISON_SCOPE.element_ids)
+    return get_category_collector(doc, category_ids).GetElementCount()
 
+def use_streaming_for_count(element_count):
+    if COMPARISON_MODE == 'streaming':
+        return True
+    if COMPARISON_MODE == 'memory':
+        return False
+    return element_count > STREAMING_ELEMENT_THRESHOLD
+
+def use_streaming_mode(doc, categories):
+    if COMPARISON_MODE != 'auto':
+        return COMPARISON_MODE == 'streaming'  # No need to count the elements
+    return use_streaming_for_count(count_elements(doc, categories))
+
+def spill_model_data(doc, categories, analysis_items, spill_path, chunk_size=SPILL_CHUNK_SIZE, transform=None):
+    """
+    Extracts the model like extract_model_data, but writes one JSON line per element to spill_path,
+    sorted by element id (see spill_element_data).
+    """
+    type_params = {}
+    element_data = iter_element_data(doc, categories, analysis_items, type_params, transform)
+    return spill_element_data(element_data, type_params, spill_path, chunk_size)
 
 def ensure_shared_parameters(doc, param_names, categories):
     """
@@ -564,6 +911,446 @@ def ensure_shared_parameters(doc, param_names, categories):
     print("Shared parameter(s) ensured and bound to selected categories.")
 
 
+STAGE_EXPORT_SNAPSHOTS = 'export snapshots'
+
+def write_back_results(doc, combined_results, categories, model_path, folder):
+    """
+    Writes the compare_results and compare_date parameters of the combined result rows to the elements
+    of the latest model, then saves it in the output folder with the current date in its name.
+    Returns the path of the saved model.
+    """
+    from Autodesk.Revit.DB import SaveAsOptions, WorksharingSaveAsOptions
+    # --- Ensure project parameters exist before writing ---
+    ensure_shared_parameters(doc, ["compare_results", "compare_date"], categories)
+    # --- Add compare_results and compare_date parameters to elements in latest model ---
+    t = Transaction(doc, "Add comparison results")
+    try:
+        t.Start()
+        added_count = 0
+        for row in combined_results:
+            eid = row.get('current_element_id')
+            if not eid:
+                continue
+            elem = doc.GetElement(ElementId(int(eid)))
+            if not elem:
+                continue
+            # Add or set 'compare_results' parameter
+            param = elem.LookupParameter('compare_results')
+            if param:
+                try:
+                    param.Set(str(row.get('compare_result', '')))
+                except Exception:
+                    pass
+            # Add or set 'compare_date' parameter
+            date_param = elem.LookupParameter('compare_date')
+            if date_param:
+                try:
+                    date_val = str(row.get('compare_date', ''))
+                    date_param.Set(date_val)
+                except Exception:
+                    pass
+            added_count += 1
+        t.Commit()
+        print('Added/updated compare_results and compare_date parameters for {} elements.'.format(added_count))
+    except Exception as e:
+        if t.HasStarted() and not t.HasEnded():
+            t.RollBack()
+        raise e
+    # --- Save the model with new name including current date ---
+    save_name = os.path.splitext(os.path.basename(model_path))[0] + "_compared_" + datetime.datetime.now().strftime("%Y%m%d") + ".rvt"
+    save_path = os.path.join(folder, save_name)
+    save_options = SaveAsOptions()
+    save_options.OverwriteExistingFile = True
+    if doc.IsWorkshared:
+        # A detached workshared model can only be saved as a new central model
+        worksharing_options = WorksharingSaveAsOptions()
+        worksharing_options.SaveAsCentral = True
+        save_options.SetWorksharingOptions(worksharing_options)
+    doc.SaveAs(save_path, save_options)
+    print('Model saved as: {}'.format(save_path))
+    return save_path
+
+
+# --- Loaded links ---
+# The PREVIOUS and/or LATEST model can be a Revit link loaded in the active model (e.g. a federated
+# review model). Its document is read in place, so no model is opened; element locations are mapped
+# into the host with the link's GetTotalTransform() and then like the host's own elements. Link
+# documents are read-only, so results are not written back to a LATEST link.
+MODEL_FILE_CHOICE = "<Select a model file...>"
+
+class LinkSource(object):
+    """A loaded RevitLinkInstance used as the PREVIOUS or LATEST model."""
+
+    def __init__(self, link_instance):
+        self.instance = link_instance
+        self.doc = link_instance.GetLinkDocument()
+        self.name = link_instance.Name
+
+    def get_transform(self, host_doc):
+        return get_model_transform(host_doc).Multiply(self.instance.GetTotalTransform())
+
+def is_link_source(model):
+    return isinstance(model, LinkSource)
+
+def get_source_name(model):
+    return "link {}".format(model.name) if is_link_source(model) else model
+
+def get_source_transform(model):
+    """The transform of a loaded link, or None for a model file (see iter_element_data)."""
+    return model.get_transform(revit.doc) if is_link_source(model) else None
+
+def get_loaded_links(doc):
+    from Autodesk.Revit.DB import FilteredElementCollector
+    return [LinkSource(link) for link in FilteredElementCollector(doc).OfClass(RevitLinkInstance)
+            if link.GetLinkDocument() is not None]
+
+def show_model_source_selection(title, links):
+    form = Form()
+    form.Text = title
+    form.Width = 500
+    form.Height = 350
+    label = Label()
+    label.Text = "Compare a model file or a loaded link:"
+    label.Top = 10
+    label.Left = 10
+    label.Width = 450
+    form.Controls.Add(label)
+    lb = ListBox()
+    lb.Width = 450
+    lb.Height = 200
+    lb.Top = 40
+    lb.Left = 10
+    lb.Items.Add(MODEL_FILE_CHOICE)
+    for link in links:
+        lb.Items.Add(link.name)
+    lb.SelectedIndex = 0
+    form.Controls.Add(lb)
+    ok_button = Button()
+    ok_button.Text = "OK"
+    ok_button.Top = 260
+    ok_button.Left = 370
+    ok_button.Width = 80
+    ok_button.DialogResult = DialogResult.OK
+    form.Controls.Add(ok_button)
+    form.AcceptButton = ok_button
+    if form.ShowDialog() == DialogResult.OK and lb.SelectedIndex >= 0:
+        return lb.SelectedIndex
+    return None
+
+def select_model_source(title, folder, links):
+    """Returns a model file path or a LinkSource, or None if cancelled."""
+    if links:
+        index = show_model_source_selection(title, links)
+        if index is None:
+            return None
+        if index > 0:
+            return links[index - 1]
+    return select_model(title, folder)
+
+# --- Opening models ---
+# Models are opened detached, with all worksets and without audit (see model_open). Opening only the
+# worksets learned to hold the selected categories (WORKSETS_CATEGORIES) would be faster, but elements
+# added to a workset learned as empty would be reported as deleted or added, and the saved model would
+# be incomplete. The compared model is saved as a new central model.
+# Opened models stay open in the session's document pool, so a rerun with other categories or analysis
+# items does not open them again. The latest model is kept under the path it was saved as.
+OPEN_PROFILE = OpenProfile(detach=DETACH_PRESERVE, worksets=WORKSETS_ALL, audit=False, unload_links=False)
+
+def open_comparison_model(app, model_path, categories, label=None):
+    if is_link_source(model_path):
+        print('Use loaded link {} (no model open)'.format(model_path.name))
+        return model_path.doc
+    category_ids = get_builtin_category_ids(categories)
+    if len(category_ids) < len(categories):
+        # Categories without a BuiltInCategory are only resolved in the opened model: open all worksets
+        category_ids = None
+    return get_document_pool().acquire(app, model_path, OPEN_PROFILE, category_ids, label)
+
+def release_comparison_model(doc, pipeline=None):
+    """Returns a model to the document pool; after the write-back it is kept as the saved model."""
+    if doc.IsLinked:
+        return  # A loaded link stays loaded in the active model
+    saved_path = pipeline.results.get(STAGE_WRITE_BACK) if pipeline is not None else None
+    get_document_pool().release(doc, saved_path)
+
+def extract_opened_model(doc, model_path, categories, analysis_items, label, spill_path=None):
+    """
+    Extracts an opened model (or loaded link, see LinkSource), or loads its cached snapshot. With a
+    spill_path the model is spilled for streaming mode instead, and the spill path is returned.
+    """
+    t0 = time.time()
+    transform = get_source_transform(model_path)
+    if spill_path:
+        spill_path = spill_model_data(doc, categories, analysis_items, spill_path, transform=transform)
+        print('Spill {} (streaming mode): {:.2f}s'.format(label, time.time() - t0))
+        return spill_path
+    snapshot = load_cached_snapshot(model_path, categories, analysis_items)
+    if snapshot is not None:
+        print('Load {} from snapshot cache: {:.2f}s'.format(label, time.time() - t0))
+        return snapshot
+    model_data = extract_model_data(doc, categories, analysis_items, transform)
+    print('Extract {}: {:.2f}s'.format(label, time.time() - t0))
+    save_cached_snapshot(model_path, categories, analysis_items, *model_data)
+    return model_data
+
+def export_snapshots(folder, prev_model_data, latest_model_data):
+    save_snapshot_file(os.path.join(folder, "model_comparison_previous_snapshot.json"), *prev_model_data)
+    save_snapshot_file(os.path.join(folder, "model_comparison_latest_snapshot.json"), *latest_model_data)
+    print("Snapshots exported to: {}".format(folder))
+
+def compare_and_write_back(pipeline, doc_latest, latest_model, categories, analysis_items, folder, streaming, compare_date):
+    """
+    Adds the stages after extraction to a pipeline that has both extract stages, and runs them: the result
+    CSVs are written to folder and the results are written back to doc_latest, which is saved in folder
+    (unless the latest model is a loaded link).
+    """
+    if streaming:
+        add_stream_stages(pipeline, analysis_items, folder)
+    else:
+        add_compare_stages(pipeline, analysis_items, folder, compare_date)
+        if EXPORT_SNAPSHOTS:
+            pipeline.add_stage(STAGE_EXPORT_SNAPSHOTS, lambda prev, latest: export_snapshots(folder, prev, latest),
+                               [STAGE_EXTRACT_PREVIOUS, STAGE_EXTRACT_LATEST])
+    pipeline.get(STAGE_EXTRACT_LATEST)
+    print('Model data extracted for selected analysis items.')
+    if STAGE_EXPORT_SNAPSHOTS in pipeline.stages:
+        pipeline.get(STAGE_EXPORT_SNAPSHOTS)
+    if is_link_source(latest_model):
+        pipeline.get(STAGE_EXPORT)
+        print("The LATEST model is a loaded link: results are not written back to it.")
+        return pipeline
+    pipeline.add_stage(STAGE_WRITE_BACK,
+                       lambda combined_results: write_back_results(doc_latest, combined_results, categories, latest_model, folder),
+                       [STAGE_EXPORT])
+    pipeline.get(STAGE_WRITE_BACK)
+    return pipeline
+
+# --- Version chain ---
+# Chain mode compares every consecutive pair of the models in a folder (e.g. a series of weekly issues).
+# Each model is opened once: its extracted data is the LATEST side of one pair and is kept as the
+# PREVIOUS side of the next pair. The results of each pair go to their own subfolder.
+CHAIN_ORDER = 'date'  # 'date' (file modified time) or 'name'
+BACKUP_FILE_PATTERN = re.compile(r'\.\d{4}\.rvt$', re.IGNORECASE)  # Revit backups, e.g. Model.0001.rvt
+
+MODE_PAIR = 'pair'
+MODE_CHAIN = 'chain'
+MODE_SESSION = 'session'
+
+def ask_comparison_mode():
+    """Returns MODE_PAIR, MODE_CHAIN or MODE_SESSION, or None if cancelled."""
+    dialog = TaskDialog("Model Comparison")
+    dialog.MainInstruction = "What do you want to compare?"
+    dialog.AddCommandLink(TaskDialogCommandLinkId.CommandLink1, "Two models",
+                          "Select one LATEST and one PREVIOUS model.")
+    dialog.AddCommandLink(TaskDialogCommandLinkId.CommandLink2, "Version chain",
+                          "Compare every consecutive pair of models in the folder, oldest first.")
+    dialog.AddCommandLink(TaskDialogCommandLinkId.CommandLink3, "Session changes",
+                          "Track the changes made to the active model, and compare them with its state when tracking started.")
+    dialog.CommonButtons = TaskDialogCommonButtons.Cancel
+    return {TaskDialogResult.CommandLink1: MODE_PAIR,
+            TaskDialogResult.CommandLink2: MODE_CHAIN,
+            TaskDialogResult.CommandLink3: MODE_SESSION}.get(dialog.Show())
+
+def list_chain_models(folder):
+    """Returns the models in folder in chain order. Backups and compared copies are skipped."""
+    models = []
+    for name in os.listdir(folder):
+        if not name.lower().endswith('.rvt') or BACKUP_FILE_PATTERN.search(name) or '_compared_' in name:
+            continue
+        models.append(os.path.join(folder, name))
+    if CHAIN_ORDER == 'name':
+        return sorted(models, key=lambda path: os.path.basename(path).lower())
+    return sorted(models, key=lambda path: (os.path.getmtime(path), os.path.basename(path).lower()))
+
+def get_chain_pair_folder(folder, pair_index, prev_model, latest_model):
+    def model_name(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    pair_folder = os.path.join(folder, "model_comparison_{:02d}_{}_vs_{}".format(pair_index, model_name(prev_model), model_name(latest_model)))
+    if not os.path.isdir(pair_folder):
+        os.makedirs(pair_folder)
+    return pair_folder
+
+def run_chain(app, models, categories, analysis_items, folder, compare_date):
+    """
+    Compares every consecutive pair of models (oldest first), opening each model once.
+    The first model is not opened at all when a cached snapshot exists. Streaming mode is decided on the
+    first model (on the element count of its cached snapshot, or of the opened model) and kept for the
+    whole chain; a cached first model that needs streaming is opened and spilled instead.
+    """
+    streaming = None
+    spill_dir = None
+    prev_model = prev_data = None
+    try:
+        for index, model_path in enumerate(models):
+            print('\n--- Chain model {} of {}: {} ---'.format(index + 1, len(models), os.path.basename(model_path)))
+            if index == 0 and COMPARISON_MODE != 'streaming':
+                t0 = time.time()
+                prev_data = load_cached_snapshot(model_path, categories, analysis_items)
+                if prev_data is not None:
+                    element_count = prev_data[3].element_count()
+                    streaming = use_streaming_for_count(element_count)
+                    if not streaming:
+                        print('Load model data from snapshot cache: {:.2f}s'.format(time.time() - t0))
+                        prev_model = model_path
+                        continue
+                    print('Snapshot cache: {} elements, the chain runs in streaming mode.'.format(element_count))
+                    prev_data = None
+            doc = open_comparison_model(app, model_path, categories)
+            pipeline = ComparisonPipeline()
+            try:
+                if streaming is None:
+                    streaming = use_streaming_mode(doc, categories)
+                spill_path = None
+                if streaming:
+                    if not spill_dir:
+                        import tempfile
+                        spill_dir = tempfile.mkdtemp(prefix='PyCharles_ModelComparison_')
+                    spill_path = os.path.join(spill_dir, 'model{}.jsonl'.format(index))
+                pipeline.add_stage(STAGE_EXTRACT_LATEST,
+                                   lambda: extract_opened_model(doc, model_path, categories, analysis_items, 'model data', spill_path))
+                if prev_data is None:
+                    # First model: it is only the PREVIOUS side of the first pair
+                    latest_data = pipeline.get(STAGE_EXTRACT_LATEST)
+                else:
+                    pair_folder = get_chain_pair_folder(folder, index, prev_model, model_path)
+                    pipeline.set_result(STAGE_EXTRACT_PREVIOUS, prev_data)
+                    compare_and_write_back(pipeline, doc, model_path, categories, analysis_items, pair_folder, streaming, compare_date)
+                    latest_data = pipeline.get(STAGE_EXTRACT_LATEST)
+                    pipeline.print_timings()
+                    print("Pair {} results exported to: {}".format(index, pair_folder))
+            finally:
+                release_comparison_model(doc, pipeline)
+            if streaming and prev_data:
+                remove_spill_file(prev_data)
+            prev_model, prev_data = model_path, latest_data
+    finally:
+        if spill_dir:
+            import shutil
+            shutil.rmtree(spill_dir, ignore_errors=True)
+    return len(models) - 1
+
+# --- Session changes ---
+# Tracking the active model logs the ids of the elements added, modified and deleted (see change_tracker)
+# after a baseline snapshot is taken: the opened file state from the snapshot cache if the model has no
+# unsaved changes, else the extracted current state. Comparing then reads only the logged elements (and the
+# instances of modified types) from the model and diffs them against the baseline. Results are not
+# written back, since that would change the tracked model.
+SESSION_COMPARE = 'compare'
+SESSION_NEW_BASELINE = 'new baseline'
+SESSION_STOP = 'stop'
+
+def get_session_baseline_path(doc):
+    import hashlib
+    folder = os.path.join(get_snapshot_cache_dir(), 'SessionBaselines')
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    name = hashlib.sha1((doc.PathName or doc.Title).encode('utf-8')).hexdigest()
+    return os.path.join(folder, name + '.json')
+
+def ask_session_action(log):
+    """Returns SESSION_COMPARE, SESSION_NEW_BASELINE or SESSION_STOP, or None if cancelled."""
+    dialog = TaskDialog("Model Comparison")
+    dialog.MainInstruction = "The active model is tracked."
+    dialog.MainContent = log.describe()
+    dialog.AddCommandLink(TaskDialogCommandLinkId.CommandLink1, "Compare the session changes")
+    dialog.AddCommandLink(TaskDialogCommandLinkId.CommandLink2, "Take a new baseline",
+                          "Compare later changes with the current state.")
+    dialog.AddCommandLink(TaskDialogCommandLinkId.CommandLink3, "Stop tracking")
+    dialog.CommonButtons = TaskDialogCommonButtons.Cancel
+    return {TaskDialogResult.CommandLink1: SESSION_COMPARE,
+            TaskDialogResult.CommandLink2: SESSION_NEW_BASELINE,
+            TaskDialogResult.CommandLink3: SESSION_STOP}.get(dialog.Show())
+
+def set_parameter_profile(profile_name):
+    global PARAMETER_PROFILE
+    parameter_profiles, _ = load_parameter_profiles(get_parameter_profiles_path())
+    PARAMETER_PROFILE = next((p for p in parameter_profiles if p.name == profile_name), None)
+
+def select_session_settings():
+    """Returns the baseline settings {categories, analysis_items, profile} chosen by the user, or None."""
+    categories = show_category_selection(get_all_model_categories())
+    if not categories:
+        print("No categories selected.")
+        return None
+    profiles_path = get_parameter_profiles_path()
+    parameter_profiles, last_profile = load_parameter_profiles(profiles_path)
+    analysis_items, profile_name = show_analysis_item_selection([p.name for p in parameter_profiles], last_profile)
+    # The quick estimate does not apply: only the changed elements are compared
+    analysis_items = [item for item in analysis_items if item != ANALYSIS_ESTIMATE]
+    if not analysis_items:
+        print("No analysis items selected.")
+        return None
+    if profile_name != last_profile:
+        save_parameter_profiles(profiles_path, parameter_profiles, profile_name)
+    return {'categories': categories, 'analysis_items': analysis_items, 'profile': profile_name}
+
+def start_session_tracking(tracker, doc, settings):
+    """Takes the baseline snapshot of the document and starts tracking its changes."""
+    set_parameter_profile(settings['profile'])
+    categories = settings['categories']
+    analysis_items = settings['analysis_items']
+    t0 = time.time()
+    model_data = None
+    if not doc.IsModified and doc.PathName and os.path.exists(doc.PathName):
+        model_data = load_cached_snapshot(doc.PathName, categories, analysis_items)
+    if model_data is not None:
+        print('Baseline: the opened file state, from the snapshot cache: {:.2f}s'.format(time.time() - t0))
+    else:
+        model_data = extract_model_data(doc, categories, analysis_items)
+        print('Baseline: the current state, extracted: {:.2f}s'.format(time.time() - t0))
+    baseline = dict(settings)
+    baseline['path'] = get_session_baseline_path(doc)
+    save_snapshot_file(baseline['path'], *model_data)
+    tracker.start(doc, baseline)
+    print("Tracking the changes of {}. Run Model Comparison again to compare them.".format(doc.Title))
+
+def compare_session_changes(doc, log, folder):
+    """Compares the logged elements of the document with its baseline snapshot; the CSVs go to folder."""
+    global COMPARISON_SCOPE
+    start_time = time.time()
+    baseline = log.baseline
+    categories = baseline['categories']
+    analysis_items = baseline['analysis_items']
+    set_parameter_profile(baseline['profile'])
+    print("Session changes of {}: {}".format(doc.Title, log.describe()))
+    element_ids = log.changed_ids()
+    type_instances = get_type_instance_ids(doc, sorted(log.modified)) if log.modified else []
+    if type_instances is None:
+        print("Many element types were modified: all elements are compared.")
+        element_ids = None
+    else:
+        element_ids |= set(type_instances)
+        if not element_ids:
+            print("No changes since the baseline.")
+            return
+        COMPARISON_SCOPE = ComparisonScope(SCOPE_ELEMENTS, "changed in this session", element_ids)
+    pipeline = ComparisonPipeline()
+    pipeline.add_stage(STAGE_EXTRACT_PREVIOUS, lambda: load_snapshot_file(baseline['path']))
+    pipeline.add_stage(STAGE_EXTRACT_LATEST, lambda: extract_model_data(doc, categories, analysis_items))
+    add_compare_stages(pipeline, analysis_items, folder, get_compare_date(), element_ids)
+    pipeline.get(STAGE_EXPORT)
+    pipeline.print_timings()
+    print("--- Session comparison: {:.2f}s ---".format(time.time() - start_time))
+    print("Results exported to: {} (not written back to the tracked model).".format(folder))
+
+def run_session_changes(doc, folder):
+    tracker = get_change_tracker()
+    log = tracker.get_log(doc)
+    if log is None:
+        settings = select_session_settings()
+        if settings:
+            start_session_tracking(tracker, doc, settings)
+        return
+    action = ask_session_action(log)
+    if action == SESSION_COMPARE:
+        compare_session_changes(doc, log, folder)
+    elif action == SESSION_NEW_BASELINE:
+        start_session_tracking(tracker, doc, log.baseline)
+    elif action == SESSION_STOP:
+        tracker.stop(doc)
+        print("Stopped tracking the changes of {}.".format(doc.Title))
+
+
 # --- Main Workflow ---
 if __name__ == "__main__":
     start_time = time.time()
@@ -571,502 +1358,170 @@ if __name__ == "__main__":
     if not folder:
         print("No folder selected.")
         script.exit()
-    latest_model = select_model("Select the LATEST Revit model", folder)
-    if not latest_model:
-        print("No latest model selected.")
+    comparison_mode = ask_comparison_mode()
+    if comparison_mode is None:
         script.exit()
-    previous_model = select_model("Select the PREVIOUS Revit model", folder)
-    if not previous_model:
-        print("No previous model selected.")
+    if comparison_mode == MODE_SESSION:
+        run_session_changes(revit.doc, folder)
         script.exit()
+    chain_mode = comparison_mode == MODE_CHAIN
+    if chain_mode:
+        chain_models = list_chain_models(folder)
+        if len(chain_models) < 2:
+            print("Chain mode needs at least two Revit models in the folder.")
+            script.exit()
+        print("Version chain ({} order):".format(CHAIN_ORDER))
+        for model_path in chain_models:
+            print("  {}".format(os.path.basename(model_path)))
+    else:
+        # Each side is a model file or, if the active model has loaded links, one of the links
+        loaded_links = get_loaded_links(revit.doc)
+        latest_model = select_model_source("Select the LATEST Revit model", folder, loaded_links)
+        if not latest_model:
+            print("No latest model selected.")
+            script.exit()
+        previous_model = select_model_source("Select the PREVIOUS Revit model", folder, loaded_links)
+        if not previous_model:
+            print("No previous model selected.")
+            script.exit()
+        print("PREVIOUS: {}\nLATEST: {}".format(get_source_name(previous_model), get_source_name(latest_model)))
     # List all model categories for selection
     categories = get_all_model_categories()
     selected_categories = show_category_selection(categories)
     if not selected_categories:
         print("No categories selected.")
         script.exit()
-    analysis_items = show_analysis_item_selection()
+    profiles_path = get_parameter_profiles_path()
+    parameter_profiles, last_profile = load_parameter_profiles(profiles_path)
+    analysis_items, profile_name = show_analysis_item_selection([p.name for p in parameter_profiles], last_profile)
     if not analysis_items:
         print("No analysis items selected.")
         script.exit()
+    PARAMETER_PROFILE = next((p for p in parameter_profiles if p.name == profile_name), None)
+    if PARAMETER_PROFILE is not None:
+        if profile_name != last_profile:
+            save_parameter_profiles(profiles_path, parameter_profiles, profile_name)
+        print("Parameter profile: {} (edit profiles in {})".format(PARAMETER_PROFILE.name, profiles_path))
+    selected_ids = [eid.IntegerValue for eid in revit.uidoc.Selection.GetElementIds()]
+    scope_choice = show_scope_selection(revit.doc, selected_ids)
+    if not scope_choice:
+        print("No comparison scope selected.")
+        script.exit()
+    scope_kind, scope_value = scope_choice
+    if scope_kind != SCOPE_ALL:
+        if not scope_value.strip():
+            print("No {} given for the comparison scope.".format(scope_kind.lower()))
+            script.exit()
+        try:
+            COMPARISON_SCOPE = ComparisonScope(scope_kind, scope_value)
+        except ValueError as e:
+            print("Invalid comparison scope: {}".format(e))
+            script.exit()
+        print("Comparison scope: {}".format(COMPARISON_SCOPE.describe()))
 
     print('--- Timing: Start model extraction ---')
     extract_start = time.time()
-    # --- Open previous and latest model in sequence and extract data ---
-    from Autodesk.Revit.DB import ModelPathUtils, OpenOptions
     app = revit.doc.Application
-    model_path_obj_prev = ModelPathUtils.ConvertUserVisiblePathToModelPath(previous_model)
-    model_path_obj_latest = ModelPathUtils.ConvertUserVisiblePathToModelPath(latest_model)
-    opts_prev = OpenOptions()
-    opts_prev.DetachFromCentralOption = 0
-    opts_latest = OpenOptions()
-    opts_latest.DetachFromCentralOption = 0
-
-    # Extract from previous model
-    doc_prev = app.OpenDocumentFile(model_path_obj_prev, opts_prev)
-    try:
-        if "XYZ deviation" in analysis_items:
-            t0 = time.time()
-            prev_xyz_data = extract_xyz_by_category(doc_prev, selected_categories)
-            print('Extract prev XYZ: {:.2f}s'.format(time.time() - t0))
-        if "Parameter value change" in analysis_items:
-            t0 = time.time()
-            prev_param_data = extract_parameters_by_category(doc_prev, selected_categories)
-            print('Extract prev params: {:.2f}s'.format(time.time() - t0))
-        if "Newly/deleted elements" in analysis_items:
-            t0 = time.time()
-            prev_elements_data = get_elements_by_category(doc_prev, selected_categories)
-            print('Extract prev elements: {:.2f}s'.format(time.time() - t0))
-    finally:
-        doc_prev.Close(False)
-
-    # Initialize comparison result variables
-    xyz_comparison_results = []
-    param_comparison_results = []
-    element_comparison_results = []
-    # Extract from latest model
-    doc_latest = app.OpenDocumentFile(model_path_obj_latest, opts_latest)
-    try:
-        if "XYZ deviation" in analysis_items:
-            t0 = time.time()
-            latest_xyz_data = extract_xyz_by_category(doc_latest, selected_categories)
-            print('Extract latest XYZ: {:.2f}s'.format(time.time() - t0))
-        if "Parameter value change" in analysis_items:
-            t0 = time.time()
-            latest_param_data = extract_parameters_by_category(doc_latest, selected_categories)
-            print('Extract latest params: {:.2f}s'.format(time.time() - t0))
-        if "Newly/deleted elements" in analysis_items:
-            t0 = time.time()
-            latest_elements_data = get_elements_by_category(doc_latest, selected_categories)
-            print('Extract latest elements: {:.2f}s'.format(time.time() - t0))
-        print('Model data extracted for selected analysis items.')
+    compare_date = get_compare_date()
+    if chain_mode:
+        if ANALYSIS_ESTIMATE in analysis_items:
+            # Sketches are compared per pair of models; a chain run already opens every model once
+            print("The quick estimate is not run in chain mode.")
+            analysis_items = [item for item in analysis_items if item != ANALYSIS_ESTIMATE]
+        if not analysis_items:
+            script.exit()
+        pair_count = run_chain(app, chain_models, selected_categories, analysis_items, folder, compare_date)
+        print('--- Extraction total: {:.2f}s ---'.format(time.time() - extract_start))
+        print("--- Total script time: {:.2f}s ---".format(time.time() - start_time))
+        print("Chain comparison complete: {} pairs compared.".format(pair_count))
+        script.exit()
 
-        # --- After all individual comparisons, combine results and export ---
-        if any(item in analysis_items for item in ["XYZ deviation", "Parameter value change", "Newly/deleted elements"]):
+    # --- Open previous and latest model in sequence and extract data ---
+    # --- Quick estimate from sketches (saved beside the models, so later estimates do not reopen them) ---
+    if ANALYSIS_ESTIMATE in analysis_items:
+        t0 = time.time()
+        prev_sketch, prev_from_file = get_model_sketch(app, previous_model, selected_categories)
+        latest_sketch, latest_from_file = get_model_sketch(app, latest_model, selected_categories)
+        estimates = estimate_changes(prev_sketch, latest_sketch, selected_categories)
+        print('Quick estimate: {:.2f}s (previous sketch {}, latest sketch {})'.format(
+            time.time() - t0, 'loaded' if prev_from_file else 'built', 'loaded' if latest_from_file else 'built'))
+        print_estimate(estimates, SKETCH_SIZE)
+        csv_path_estimate = os.path.join(folder, "model_comparison_quick_estimate.csv")
+        write_estimate_csv(csv_path_estimate, estimates)
+        print("Quick estimate exported to: {}".format(csv_path_estimate))
+        analysis_items = [item for item in analysis_items if item != ANALYSIS_ESTIMATE]
+        if not analysis_items:
+            print("--- Total script time: {:.2f}s ---".format(time.time() - start_time))
+            script.exit()
+
+    # --- Comparison pipeline: extract -> diff -> combine -> aggregate -> export -> write-back ---
+    # Every stage runs once; its result is shared by the stages that require it.
+    pipeline = ComparisonPipeline()
+    run_state = {'streaming': None, 'spill_dir': None}  # Streaming mode is decided on the previous model
+
+    def get_spill_path(file_name):
+        if not run_state['spill_dir']:
+            import tempfile
+            run_state['spill_dir'] = tempfile.mkdtemp(prefix='PyCharles_ModelComparison_')
+        return os.path.join(run_state['spill_dir'], file_name)
+
+    def extract_previous():
+        # Skip opening the previous model when a cached snapshot exists, unless it is too large to load
+        t0 = time.time()
+        if COMPARISON_MODE != 'streaming':
+            prev_snapshot = load_cached_snapshot(previous_model, selected_categories, analysis_items)
+            if prev_snapshot is not None:
+                element_count = prev_snapshot[3].element_count()
+                run_state['streaming'] = use_streaming_for_count(element_count)
+                if not run_state['streaming']:
+                    print('Load prev model data from snapshot cache: {:.2f}s'.format(time.time() - t0))
+                    return prev_snapshot
+                print('Snapshot cache: {} elements, the comparison runs in streaming mode.'.format(element_count))
+                prev_snapshot = None
+        doc_prev = open_comparison_model(app, previous_model, selected_categories, 'previous model')
+        try:
+            if run_state['streaming'] is None:
+                run_state['streaming'] = use_streaming_mode(doc_prev, selected_categories)
             t0 = time.time()
-            # Only run comparisons if data was extracted
-            if "XYZ deviation" in analysis_items:
-                xyz_comparison_results = compare_xyz_data(prev_xyz_data, latest_xyz_data)
-            if "Parameter value change" in analysis_items:
-                param_comparison_results = compare_param_data(prev_param_data, latest_param_data)
-            if "Newly/deleted elements" in analysis_items:
-                element_comparison_results = compare_element_data(prev_elements_data, latest_elements_data)
-            combined_results = combine_comparison_results(xyz_comparison_results, param_comparison_results, element_comparison_results)
-            print('Combine results: {:.2f}s'.format(time.time() - t0))
-            csv_path_combined = os.path.join(folder, "model_comparison_combined_results.csv")
-            if combined_results:
-                fieldnames = [
-                    'previous_element_id',
-                    'current_element_id',
-                    'previous_family_and_type',
-                    'current_family_and_type',
-                    'previous_category',
-                    'current_category',
-                    'compare_result',
-                    'compare_date'
-                ]
-                with open(csv_path_combined, 'w') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-                    writer.writeheader()
-                    for row in combined_results:
-                        writer.writerow(row)
-                print("Combined model comparison results exported to: {}".format(csv_path_combined))
-            else:
-                print("No combined model comparison results to export.")
-
-            # --- Ensure project parameters exist before writing ---
-            ensure_shared_parameters(doc_latest, ["compare_results", "compare_date"], selected_categories)
-            # --- Add compare_results and compare_date parameters to elements in latest model ---
-            from Autodesk.Revit.DB import Transaction, BuiltInParameter, StorageType, SaveAsOptions
-            t = Transaction(doc_latest, "Add comparison results")
-            try:
-                t.Start()
-                added_count = 0
-                for row in combined_results:
-                    eid = row.get('current_element_id')
-                    if not eid:
-                        continue
-                    elem = doc_latest.GetElement(ElementId(int(eid)))
-                    if not elem:
-                        continue
-                    # Add or set 'compare_results' parameter
-                    param = elem.LookupParameter('compare_results')
-                    if param:
-                        try:
-                            param.Set(str(row.get('compare_result', '')))
-                        except Exception:
-                            pass
-                    # Add or set 'compare_date' parameter
-                    date_param = elem.LookupParameter('compare_date')
-                    if date_param:
-                        try:
-                            date_val = str(row.get('compare_date', ''))
-                            date_param.Set(date_val)
-                        except Exception:
-                            pass
-                    added_count += 1
-                t.Commit()
-                print('Added/updated compare_results and compare_date parameters for {} elements.'.format(added_count))
-            except Exception as e:
-                if t.HasStarted() and not t.HasEnded():
-                    t.RollBack()
-                raise e
-            # --- Save the model with new name including current date ---
-            import datetime
-            save_name = os.path.splitext(os.path.basename(latest_model))[0] + "_compared_" + datetime.datetime.now().strftime("%Y%m%d") + ".rvt"
-            save_path = os.path.join(folder, save_name)
-            save_options = SaveAsOptions()
-            save_options.OverwriteExistingFile = True
-            doc_latest.SaveAs(save_path, save_options)
-            print('Model saved as: {}'.format(save_path))
+            if run_state['streaming']:
+                prev_spill = spill_model_data(doc_prev, selected_categories, analysis_items, get_spill_path('previous.jsonl'),
+                                              transform=get_source_transform(previous_model))
+                print('Spill prev model data (streaming mode): {:.2f}s'.format(time.time() - t0))
+                return prev_spill
+            prev_model_data = extract_model_data(doc_prev, selected_categories, analysis_items, get_source_transform(previous_model))
+            print('Extract prev model data: {:.2f}s'.format(time.time() - t0))
+        finally:
+            release_comparison_model(doc_prev)
+        save_cached_snapshot(previous_model, selected_categories, analysis_items, *prev_model_data)
+        return prev_model_data
 
+    pipeline.add_stage(STAGE_EXTRACT_PREVIOUS, extract_previous)
+    pipeline.add_stage(STAGE_EXTRACT_LATEST, lambda: extract_opened_model(
+        doc_latest, latest_model, selected_categories, analysis_items, 'latest model data',
+        get_spill_path('latest.jsonl') if run_state['streaming'] else None))
+    previous_version = None
+    if NATIVE_CHANGE_DETECTION and COMPARISON_SCOPE is None and not is_link_source(previous_model) \
+            and not is_link_source(latest_model):
+        previous_version = get_file_version_guid(previous_model)
+    doc_latest = None
+    try:
+        if previous_version is not None:
+            # The latest model reports what changed since the previous version, so it is opened first
+            doc_latest = open_comparison_model(app, latest_model, selected_categories, 'latest model')
+            COMPARISON_SCOPE = find_native_change_scope(doc_latest, previous_version)
+        # Otherwise the previous model is extracted and closed before the latest model is opened
+        pipeline.get(STAGE_EXTRACT_PREVIOUS)
+        if doc_latest is None:
+            doc_latest = open_comparison_model(app, latest_model, selected_categories, 'latest model')
+        compare_and_write_back(pipeline, doc_latest, latest_model, selected_categories, analysis_items, folder,
+                               run_state['streaming'], compare_date)
     finally:
-        doc_latest.Close(False)
+        if doc_latest is not None:
+            release_comparison_model(doc_latest, pipeline)
+        if run_state['spill_dir']:
+            import shutil
+            shutil.rmtree(run_state['spill_dir'], ignore_errors=True)
     print('--- Extraction total: {:.2f}s ---'.format(time.time() - extract_start))
-
-    # --- Compare XYZ data if applicable ---
-    if "XYZ deviation" in analysis_items:
-        t0 = time.time()
-        xyz_comparison_results = compare_xyz_data(prev_xyz_data, latest_xyz_data)
-        elapsed = time.time() - t0
-        print('Compare XYZ: {:.2f}s'.format(elapsed))
-        # Export results to CSV
-        import csv
-        csv_path = os.path.join(folder, "xyz_comparison_results.csv")
-        if xyz_comparison_results:
-            fieldnames = [
-                'previous_element_id',
-                'current_element_id',
-                'previous_family_and_type',
-                'current_family_and_type',
-                'previous_category',
-                'current_category',
-                'compare_result',
-                'compare_date'
-            ]
-            with open(csv_path, 'w') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-                writer.writeheader()
-                for row in xyz_comparison_results:
-                    writer.writerow(row)
-            print("XYZ comparison results exported to: {}".format(csv_path))
-        else:
-            print("No XYZ comparison results to export.")
-        print('--- XYZ comparison and export time: {:.2f}s ---'.format(elapsed))
-    # --- Compare parameter data if applicable ---
-    if "Parameter value change" in analysis_items:
-        t0 = time.time()
-        param_comparison_results = compare_param_data(prev_param_data, latest_param_data)
-        elapsed = time.time() - t0
-        print('Compare params: {:.2f}s'.format(elapsed))
-        csv_path_param = os.path.join(folder, "param_comparison_results.csv")
-        if param_comparison_results:
-            fieldnames = [
-                'previous_element_id',
-                'current_element_id',
-                'previous_family_and_type',
-                'current_family_and_type',
-                'previous_category',
-                'current_category',
-                'compare_result',
-                'compare_date'
-            ]
-            with open(csv_path_param, 'w') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-                writer.writeheader()
-                for row in param_comparison_results:
-                    writer.writerow(row)
-            print("Parameter comparison results exported to: {}".format(csv_path_param))
-        else:
-            print("No parameter comparison results to export.")
-        print('--- Parameter comparison and export time: {:.2f}s ---'.format(elapsed))
-    # --- Compare element data if applicable ---
-    if "Newly/deleted elements" in analysis_items:
-        t0 = time.time()
-        element_comparison_results = compare_element_data(prev_elements_data, latest_elements_data)
-        elapsed = time.time() - t0
-        print('Compare elements: {:.2f}s'.format(elapsed))
-        csv_path_elem = os.path.join(folder, "element_comparison_results.csv")
-        if element_comparison_results:
-            fieldnames = [
-                'previous_element_id',
-                'current_element_id',
-                'previous_family_and_type',
-                'current_family_and_type',
-                'previous_category',
-                'current_category',
-                'compare_result',
-                'compare_date'
-            ]
-            with open(csv_path_elem, 'w') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-                writer.writeheader()
-                for row in element_comparison_results:
-                    writer.writerow(row)
-            print("Element comparison results exported to: {}".format(csv_path_elem))
-        else:
-            print("No element comparison results to export.")
-        print('--- Element comparison and export time: {:.2f}s ---'.format(elapsed))
+    pipeline.print_timings()
     print("--- Total script time: {:.2f}s ---".format(time.time() - start_time))
     print("Comparison complete.")
-
-    # --- Summary printout ---
-    def extract_summary_stats(combined_results):
-        xy_move_count = 0
-        z_move_count = 0
-        new_param_count = 0
-        new_param_list = set()
-        del_param_count = 0
-        del_param_list = set()
-        param_value_change_count = 0
-        param_value_change_list = set()
-        new_elem_count = 0
-        del_elem_count = 0
-        for row in combined_results:
-            result = row.get('compare_result', '')
-            # 1. XY coordination move
-            if "XY coordination move" in result:
-                xy_move_count += 1
-            # 2. Z coordination move
-            if "Z coordination move" in result:
-                z_move_count += 1
-            # 3. new parameter add
-            if "new parameter add:" in result:
-                for part in result.split(','):
-                    if "new parameter add:" in part:
-                        pname = part.split(":",1)[1].strip()
-                        new_param_list.add(pname)
-                        new_param_count += 1
-            # 4. parameter delete
-            if "parameter delete:" in result:
-                for part in result.split(','):
-                    if "parameter delete:" in part:
-                        pname = part.split(":",1)[1].strip()
-                        del_param_list.add(pname)
-                        del_param_count += 1
-            # 5. parameter value change
-            if "parameter value change:" in result:
-                for part in result.split(','):
-                    if "parameter value change:" in part:
-                        pname = part.split(":",1)[1].split("(")[0].strip()
-                        param_value_change_list.add(pname)
-                        param_value_change_count += 1
-            # 6. new element added
-            if result == "new element added":
-                new_elem_count += 1
-            # 7. element deleted
-            if result == "element deleted":
-                del_elem_count += 1
-        return {
-            'xy_move_count': xy_move_count,
-            'z_move_count': z_move_count,
-            'new_param_count': len(new_param_list),
-            'new_param_list': sorted(new_param_list),
-            'del_param_count': len(del_param_list),
-            'del_param_list': sorted(del_param_list),
-            'param_value_change_count': len(param_value_change_list),
-            'param_value_change_list': sorted(param_value_change_list),
-            'new_elem_count': new_elem_count,
-            'del_elem_count': del_elem_count
-        }
-
-    summary = extract_summary_stats(combined_results)
-    print("\n--- Model Comparison Summary ---")
-    print("1. Number of XY coordination move: {}".format(summary['xy_move_count']))
-    print("2. Number of Z coordination move: {}".format(summary['z_move_count']))
-    print("3. Number of new parameter added: {}".format(summary['new_param_count']))
-    if summary['new_param_list']:
-        print("   List of new parameters added:")
-        for pname in summary['new_param_list']:
-            print("     - {}".format(pname))
-    print("4. Number of parameter deleted: {}".format(summary['del_param_count']))
-    if summary['del_param_list']:
-        print("   List of deleted parameters:")
-        for pname in summary['del_param_list']:
-            print("     - {}".format(pname))
-    print("5. Number of parameter value change: {}".format(summary['param_value_change_count']))
-    if summary['param_value_change_list']:
-        print("   List of parameter value changes:")
-        for pname in summary['param_value_change_list']:
-            print("     - {}".format(pname))
-    print("6. Number of new element added: {}".format(summary['new_elem_count']))
-    print("7. Number of element deleted: {}".format(summary['del_elem_count']))
-
-    # --- Summary printout ---
-    def extract_summary_stats_by_category(combined_results, folder):
-        summary_by_cat = {}
-        for row in combined_results:
-            cat = row.get('current_category') or row.get('previous_category') or 'Unknown'
-            if cat not in summary_by_cat:
-                summary_by_cat[cat] = {
-                    'xy_move_count': 0,
-                    'z_move_count': 0,
-                    'new_param_list': set(),
-                    'del_param_list': set(),
-                    'param_value_change_list': set(),
-                    'new_type_param_list': set(),
-                    'del_type_param_list': set(),
-                    'type_param_value_change_list': set(),
-                    'new_elem_count': 0,
-                    'del_elem_count': 0
-                }
-            result = row.get('compare_result', '')
-            # 1. XY coordination move
-            if "XY coordination move" in result:
-                summary_by_cat[cat]['xy_move_count'] += 1
-            # 2. Z coordination move
-            if "Z coordination move" in result:
-                summary_by_cat[cat]['z_move_count'] += 1
-            # 3. new parameter add
-            if "new parameter add:" in result:
-                for part in result.split(','):
-                    if "new parameter add:" in part:
-                        pname = part.split(":",1)[1].strip()
-                        summary_by_cat[cat]['new_param_list'].add(pname)
-            # 4. parameter delete
-            if "parameter delete:" in result:
-                for part in result.split(','):
-                    if "parameter delete:" in part:
-                        pname = part.split(":",1)[1].strip()
-                        summary_by_cat[cat]['del_param_list'].add(pname)
-            # 5. parameter value change
-            if "parameter value change:" in result:
-                for part in result.split(','):
-                    if "parameter value change:" in part:
-                        pname = part.split(":",1)[1].split("(")[0].strip()
-                        summary_by_cat[cat]['param_value_change_list'].add(pname)
-            # 6. new type parameter add
-            if "new type parameter add:" in result:
-                for part in result.split(','):
-                    if "new type parameter add:" in part:
-                        pname = part.split(":",1)[1].strip()
-                        summary_by_cat[cat]['new_type_param_list'].add(pname)
-            # 7. type parameter delete
-            if "type parameter delete:" in result:
-                for part in result.split(','):
-                    if "type parameter delete:" in part:
-                        pname = part.split(":",1)[1].strip()
-                        summary_by_cat[cat]['del_type_param_list'].add(pname)
-            # 8. type parameter value change
-            if "type parameter value change:" in result:
-                for part in result.split(','):
-                    if "type parameter value change:" in part:
-                        pname = part.split(":",1)[1].split("(")[0].strip()
-                        summary_by_cat[cat]['type_param_value_change_list'].add(pname)
-            # 9. new element added
-            if result == "new element added":
-                summary_by_cat[cat]['new_elem_count'] += 1
-            # 10. element deleted
-            if result == "element deleted":
-                summary_by_cat[cat]['del_elem_count'] += 1
-        # Convert sets to sorted lists and add counts
-        for cat, stats in summary_by_cat.items():
-            stats['new_param_count'] = len(stats['new_param_list'])
-            stats['new_param_list'] = sorted(stats['new_param_list'])
-            stats['del_param_count'] = len(stats['del_param_list'])
-            stats['del_param_list'] = sorted(stats['del_param_list'])
-            stats['param_value_change_count'] = len(stats['param_value_change_list'])
-            stats['param_value_change_list'] = sorted(stats['param_value_change_list'])
-            stats['new_type_param_count'] = len(stats['new_type_param_list'])
-            stats['new_type_param_list'] = sorted(stats['new_type_param_list'])
-            stats['del_type_param_count'] = len(stats['del_type_param_list'])
-            stats['del_type_param_list'] = sorted(stats['del_type_param_list'])
-            stats['type_param_value_change_count'] = len(stats['type_param_value_change_list'])
-            stats['type_param_value_change_list'] = sorted(stats['type_param_value_change_list'])
-        # Export to CSV
-        csv_path_summary_cat = os.path.join(folder, "model_comparison_summary_by_category.csv")
-        with open(csv_path_summary_cat, 'w') as csvfile:
-            fieldnames = [
-                'category',
-                'xy_move_count',
-                'z_move_count',
-                'new_param_count',
-                'new_param_list',
-                'del_param_count',
-                'del_param_list',
-                'param_value_change_count',
-                'param_value_change_list',
-                'new_type_param_count',
-                'new_type_param_list',
-                'del_type_param_count',
-                'del_type_param_list',
-                'type_param_value_change_count',
-                'type_param_value_change_list',
-                'new_elem_count',
-                'del_elem_count'
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-            writer.writeheader()
-            for cat, stats in summary_by_cat.items():
-                row = stats.copy()
-                row['category'] = cat
-                row['new_param_list'] = ', '.join(row['new_param_list'])
-                row['del_param_list'] = ', '.join(row['del_param_list'])
-                row['param_value_change_list'] = ', '.join(row['param_value_change_list'])
-                row['new_type_param_list'] = ', '.join(row['new_type_param_list'])
-                row['del_type_param_list'] = ', '.join(row['del_type_param_list'])
-                row['type_param_value_change_list'] = ', '.join(row['type_param_value_change_list'])
-                writer.writerow(row)
-        print("Summary by category exported to: {}".format(csv_path_summary_cat))
-        return summary_by_cat
-
-    summary_by_cat = extract_summary_stats_by_category(combined_results, folder)
-    print("\n--- Model Comparison Summary by Category ---")
-    for cat, summary in summary_by_cat.items():
-        print("\nCategory: {}".format(cat))
-        print("  1. Number of XY coordination move: {}".format(summary['xy_move_count']))
-        print("  2. Number of Z coordination move: {}".format(summary['z_move_count']))
-        print("  3. Number of new parameter added: {}".format(summary['new_param_count']))
-        if summary['new_param_list']:
-            print("     List of new parameters added:")
-            for pname in summary['new_param_list']:
-                print("       - {}".format(pname))
-        print("  4. Number of parameter deleted: {}".format(summary['del_param_count']))
-        if summary['del_param_list']:
-            print("     List of deleted parameters:")
-            for pname in summary['del_param_list']:
-                print("       - {}".format(pname))
-        print("  5. Number of parameter value change: {}".format(summary['param_value_change_count']))
-        if summary['param_value_change_list']:
-            print("     List of parameter value changes:")
-            for pname in summary['param_value_change_list']:
-                print("       - {}".format(pname))
-        print("  6. Number of new element added: {}".format(summary['new_elem_count']))
-        print("  7. Number of element deleted: {}".format(summary['del_elem_count']))
-
-    # --- Export summary_by_cat to CSV ---
-    csv_path_summary_cat = os.path.join(folder, "model_comparison_summary_by_category.csv")
-    with open(csv_path_summary_cat, 'w') as csvfile:
-        fieldnames = [
-            'category',
-            'xy_move_count',
-            'z_move_count',
-            'new_param_count',
-            'new_param_list',
-            'del_param_count',
-            'del_param_list',
-            'param_value_change_count',
-            'param_value_change_list',
-            'new_type_param_count',
-            'new_type_param_list',
-            'del_type_param_count',
-            'del_type_param_list',
-            'type_param_value_change_count',
-            'type_param_value_change_list',
-            'new_elem_count',
-            'del_elem_count'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, lineterminator='\n')
-        writer.writeheader()
-        for cat, stats in summary_by_cat.items():
-            row = stats.copy()
-            row['category'] = cat
-            row['new_param_list'] = ', '.join(row['new_param_list'])
-            row['del_param_list'] = ', '.join(row['del_param_list'])
-            row['param_value_change_list'] = ', '.join(row['param_value_change_list'])
-            row['new_type_param_list'] = ', '.join(row['new_type_param_list'])
-            row['del_type_param_list'] = ', '.join(row['del_type_param_list'])
-            row['type_param_value_change_list'] = ', '.join(row['type_param_value_change_list'])
-            writer.writerow(row)
-    print("Summary by category exported to: {}".format(csv_path_summary_cat))
-
@@ -12,9 +12,12 @@ import System.Drawing
 from pyrevit import revit, script
 from datetime import datetime
 from Autodesk.Revit.DB import ParameterFilterElement, ElementParameterFilter, FilteredElementCollector, BuiltInCategory, ElementId
+from model_open import OpenProfile, get_document_pool, DETACH_NONE, WORKSETS_ALL
 
 CSV_FILENAME = "model_comparison_summary_by_category.csv"
 SELECTION_RECORD = "last_selection.json"
+# The model is saved in place and printed, so it is opened attached, with all worksets and links; only the audit is skipped
+OPEN_PROFILE = OpenProfile(detach=DETACH_NONE, worksets=WORKSETS_ALL, audit=False, unload_links=False)
 
 # 1. Select folder and model
 def select_folder():
@@ -465,15 +468,23 @@ def main():
     if not model_path:
         print("No model selected.")
         return
-    from Autodesk.Revit.DB import ModelPathUtils, OpenOptions, Color, BuiltInCategory
     app = revit.doc.Application
-    model_path_obj = ModelPathUtils.ConvertUserVisiblePathToModelPath(model_path)
-    opts = OpenOptions()
-    opts.DetachFromCentralOption = 0
-    doc = app.OpenDocumentFile(model_path_obj, opts)
+    # The model stays open in the session's document pool, so the next run does not open it again
+    pool = get_document_pool()
+    doc = pool.acquire(app, model_path, OPEN_PROFILE)
     if doc is None:
         print("Failed to open or set the Revit model. Please ensure you are running inside Revit and the model path is valid.")
         return
+    saved = False
+    try:
+        saved = process_model(doc, folder, model_path)
+    finally:
+        # Saved: keep it under its new file stamp; unsaved changes: the pool closes it
+        pool.release(doc, model_path if saved else None)
+
+def process_model(doc, folder, model_path):
+    """Creates the filters, prints and saves the model. Returns True if the model was saved."""
+    from Autodesk.Revit.DB import Color, BuiltInCategory
     last = load_selection_record(model_path)
     csv_path = select_csv_file(folder) if not last.get('csv_path') else last['csv_path']
     if not csv_path or not os.path.exists(csv_path):
@@ -596,6 +607,7 @@ def main():
     # After all modifications, save the model
     doc.Save()
     print("Model saved after modifications.")
+    return True
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
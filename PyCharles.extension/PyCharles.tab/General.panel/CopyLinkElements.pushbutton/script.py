@@ -6,6 +6,7 @@ from System.Collections.Generic import List
 import csv
 import os
 from Autodesk.Revit.DB import FamilyInstance
+from element_names import ElementNameCache
 
 __doc__ = "Copy a selected element from a linked model and paste it into the current model using shared coordinates."
 __title__ = "Copy Link Elements"
@@ -44,16 +45,17 @@ try:
     linked_elem_refs = uidoc.Selection.PickObjects(Selection.ObjectType.LinkedElement, LinkedElementSelectionFilter(), "Select elements in the linked model.")
     linked_elem_ids = [ref.LinkedElementId for ref in linked_elem_refs]
     linked_elems = [link_doc.GetElement(eid) for eid in linked_elem_ids]
+    # Family/type and category names, looked up once per type and category of each document
+    link_names = ElementNameCache()
+    host_names = ElementNameCache()
 
     # --- New: Ask user to select categories to copy ---
     # Gather all categories from selected elements
     selected_categories = set()
     for elem in linked_elems:
-        try:
-            if elem.Category:
-                selected_categories.add(elem.Category.Name)
-        except Exception:
-            pass
+        category_name = link_names.get_category_name(elem)
+        if category_name:
+            selected_categories.add(category_name)
     if not selected_categories:
         TaskDialog.Show("Error", "No categories found in selected elements.")
         script.exit()
@@ -116,7 +118,7 @@ try:
         TaskDialog.Show("Cancelled", "No categories selected.")
         script.exit()
     # Filter linked_elems by chosen categories
-    linked_elems = [elem for elem in linked_elems if elem.Category and elem.Category.Name in chosen_categories]
+    linked_elems = [elem for elem in linked_elems if link_names.get_category_name(elem) in chosen_categories]
     if not linked_elems:
         TaskDialog.Show("Error", "No elements match the selected categories.")
         script.exit()
@@ -163,19 +165,8 @@ try:
             orig_xyz = (round(world_mid_pt.X, 6), round(world_mid_pt.Y, 6), round(world_mid_pt.Z, 6))
         else:
             orig_xyz = ("no location api", "no location api", "no location api")
-        orig_family_type = ''
-        orig_category = ''
-        try:
-            param = elem.LookupParameter('Family and Type')
-            if param:   
-                orig_family_type = param.AsValueString()
-        except Exception:
-            pass
-        try:
-            if elem.Category:
-                orig_category = elem.Category.Name
-        except Exception:
-            pass
+        orig_family_type = link_names.get_family_and_type(elem)
+        orig_category = link_names.get_category_name(elem)
         original_info.append((elem_id, orig_category, orig_family_type, orig_xyz))
     original_info.sort(key=lambda x: x[0].IntegerValue)
     # Build and sort copied info
@@ -197,19 +188,8 @@ try:
             copied_xyz = (round(mid_pt.X, 6), round(mid_pt.Y, 6), round(mid_pt.Z, 6))
         else:
             copied_xyz = ("no location api", "no location api", "no location api")
-        copied_family_type = ''
-        copied_category = ''
-        try:
-            param = new_elem.LookupParameter('Family and Type')
-            if param:
-                copied_family_type = param.AsValueString()
-        except Exception:
-            pass
-        try:
-            if new_elem.Category:
-                copied_category = new_elem.Category.Name
-        except Exception:
-            pass
+        copied_family_type = host_names.get_family_and_type(new_elem)
+        copied_category = host_names.get_category_name(new_elem)
         copied_info.append((copied_id, copied_category, copied_family_type, copied_xyz))
     copied_info.sort(key=lambda x: x[0].IntegerValue)
     # Combine by row order
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Tracking the changes of an open document during a Revit session. While a document is tracked, every
+# DocumentChanged event adds its element ids to the document's ChangeLog. Comparing the session changes
+# then only has to read the logged elements from the document and diff them against a baseline snapshot,
+# instead of extracting the whole model twice.
+#
+# Tracking is opt-in per document and the tracker is kept in pyRevit's session environment variables,
+# like the document pool (see model_open.get_document_pool). The event handler runs in the script engine
+# that started tracking, so that script must keep its engine (__persistentengine__ = True).
+import os
+import time
+
+TRACKER_ENVVAR = 'PYCHARLES_CHANGE_TRACKER'
+
+def get_document_key(doc):
+    return os.path.normcase(doc.PathName) if doc.PathName else doc.Title
+
+class ChangeLog(object):
+    """
+    Element ids (integers) added, modified and deleted in one document since its baseline. Each id is in at
+    most one set: an element added and then deleted is dropped, a modified element that is deleted only
+    counts as deleted, and changes to an added element keep it added.
+    baseline: what the changes are compared against, e.g. the path of a snapshot file and its settings.
+    """
+
+    def __init__(self, doc, baseline=None):
+        self.doc = doc
+        self.baseline = baseline
+        self.started = time.time()
+        self.added = set()
+        self.modified = set()
+        self.deleted = set()
+        self.event_count = 0
+
+    def record(self, added_ids, modified_ids, deleted_ids):
+        self.event_count += 1
+        added = self.added
+        modified = self.modified
+        for eid in added_ids:
+            added.add(eid)
+        for eid in modified_ids:
+            if eid not in added:
+                modified.add(eid)
+        for eid in deleted_ids:
+            if eid in added:
+                added.discard(eid)
+            else:
+                modified.discard(eid)
+                self.deleted.add(eid)
+
+    def changed_ids(self):
+        return self.added | self.modified | self.deleted
+
+    def is_document(self, doc):
+        """True if the log belongs to this open document (not a closed one with the same path)."""
+        try:
+            return self.doc.IsValidObject and self.doc.Equals(doc)
+        except Exception:
+            return False
+
+    def describe(self):
+        return "{} added, {} modified, {} deleted in {} changes since {}".format(
+            len(self.added), len(self.modified), len(self.deleted), self.event_count,
+            time.strftime('%H:%M:%S', time.localtime(self.started)))
+
+class ChangeTracker(object):
+    """Change logs of the tracked documents, filled by the application's DocumentChanged event."""
+
+    def __init__(self):
+        self.logs = {}  # {document key: ChangeLog}
+        self.app = None
+
+    def start(self, doc, baseline=None):
+        """Starts (or restarts) tracking the document and returns its empty ChangeLog."""
+        if self.app is None:
+            self.app = doc.Application
+            self.app.DocumentChanged += self.on_document_changed
+        log = self.logs[get_document_key(doc)] = ChangeLog(doc, baseline)
+        return log
+
+    def stop(self, doc):
+        self.logs.pop(get_document_key(doc), None)
+        if not self.logs and self.app is not None:
+            self.app.DocumentChanged -= self.on_document_changed
+            self.app = None
+
+    def get_log(self, doc):
+        """Returns the ChangeLog of the document, or None if it is not tracked."""
+        log = self.logs.get(get_document_key(doc))
+        if log is not None and not log.is_document(doc):
+            self.stop(doc)  # The tracked document was closed
+            return None
+        return log
+
+    def on_document_changed(self, sender, args):
+        doc = args.GetDocument()
+        log = self.logs.get(get_document_key(doc))
+        if log is None:
+            return
+        log.record([eid.IntegerValue for eid in args.GetAddedElementIds()],
+                   [eid.IntegerValue for eid in args.GetModifiedElementIds()],
+                   [eid.IntegerValue for eid in args.GetDeletedElementIds()])
+
+_session_tracker = None
+
+def get_change_tracker():
+    """
+    Returns the change tracker of the Revit session, kept in pyRevit's session environment variables.
+    """
+    global _session_tracker
+    try:
+        from pyrevit import script
+        tracker = script.get_envvar(TRACKER_ENVVAR)
+        if tracker is None:
+            tracker = ChangeTracker()
+            script.set_envvar(TRACKER_ENVVAR, tracker)
+        return tracker
+    except ImportError:
+        if _session_tracker is None:
+            _session_tracker = ChangeTracker()
+        return _session_tracker
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Family/type and category names of many elements. Each name is a string keyed .NET round trip
+# (LookupParameter('Family and Type'), Category.Name), but all instances of a type share their
+# family and type names and all elements of a category share its name. An ElementNameCache looks
+# them up once per type id and once per category id.
+#
+#   names = ElementNameCache()
+#   names.get_family_and_type(elem)  # 'Family: Type'
+#   names.get_category_name(elem)
+#
+# A cache belongs to one document (it is keyed by element ids).
+
+def read_family_and_type(elem):
+    """
+    Returns the 'Family and Type' display value of the element, or '' if it has none.
+    """
+    try:
+        param = elem.LookupParameter('Family and Type')
+        if param:
+            return param.AsValueString()
+    except Exception:
+        pass
+    return ''
+
+def read_family_and_type_names(elem):
+    """
+    Returns (family name, type name) of the element: from its symbol for family instances,
+    else its FamilyName and Name.
+    """
+    fam_name = ''
+    type_name = ''
+    try:
+        if hasattr(elem, 'Symbol') and elem.Symbol:
+            fam_name = elem.Symbol.Family.Name
+            type_name = elem.Symbol.Name
+        elif hasattr(elem, 'FamilyName'):
+            fam_name = elem.FamilyName
+        if hasattr(elem, 'Name'):
+            type_name = elem.Name
+    except Exception:
+        pass
+    return fam_name, type_name
+
+def get_type_id(elem):
+    """
+    Returns the integer type id of the element, or -1 for untyped elements.
+    """
+    try:
+        type_id = elem.GetTypeId()
+        if type_id:
+            return type_id.IntegerValue
+    except Exception:
+        pass
+    return -1
+
+class ElementNameCache(object):
+    """
+    Names of one document's elements by type id and category id. Untyped elements (type id -1)
+    are read each time. Methods taking type_id look it up when it is not given.
+    """
+
+    def __init__(self):
+        self._family_and_type = {}
+        self._type_names = {}
+        self._category_names = {}
+
+    def get_family_and_type(self, elem, type_id=None):
+        if type_id is None:
+            type_id = get_type_id(elem)
+        if type_id < 0:
+            return read_family_and_type(elem)
+        if type_id not in self._family_and_type:
+            self._family_and_type[type_id] = read_family_and_type(elem)
+        return self._family_and_type[type_id]
+
+    def get_family_and_type_names(self, elem, type_id=None):
+        """
+        Returns (family name, type name), see read_family_and_type_names. Only family instances are cached
+        by type: other typed elements, e.g. levels and grids, have names of their own.
+        """
+        if not hasattr(elem, 'Symbol'):
+            return read_family_and_type_names(elem)
+        if type_id is None:
+            type_id = get_type_id(elem)
+        if type_id < 0:
+            return read_family_and_type_names(elem)
+        names = self._type_names.get(type_id)
+        if names is None:
+            names = self._type_names[type_id] = read_family_and_type_names(elem)
+        return names
+
+    def get_category_name(self, elem):
+        """
+        Returns the category name of the element, or '' if it has no category.
+        """
+        try:
+            category = elem.Category
+            if category is None:
+                return ''
+            category_id = category.Id.IntegerValue
+            name = self._category_names.get(category_id)
+            if name is None:
+                name = self._category_names[category_id] = category.Name
+            return name
+        except Exception:
+            return ''
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Compares two model snapshots outside Revit, e.g. on a build server:
+#
+#   python model_compare_cli.py PREVIOUS_SNAPSHOT LATEST_SNAPSHOT -o OUTPUT_FOLDER
+#
+# Snapshots are the JSON files the ModelComparison button writes to its output folder
+# (model_comparison_previous_snapshot.json / model_comparison_latest_snapshot.json) or to its snapshot cache.
+# Writes the per-analysis, combined, change records and summary by category CSVs, and prints the summary.
+import argparse
+import os
+import sys
+import time
+
+import model_compare_core
+from model_compare_core import (
+    ANALYSIS_XYZ, ANALYSIS_PARAMS, ANALYSIS_ELEMENTS, STAGE_EXTRACT_PREVIOUS, STAGE_EXTRACT_LATEST, STAGE_EXPORT,
+    ComparisonPipeline, add_compare_stages, load_snapshot_file, snapshot_analysis_items, get_compare_date
+)
+
+ITEM_NAMES = {
+    'xyz': ANALYSIS_XYZ,
+    'params': ANALYSIS_PARAMS,
+    'elements': ANALYSIS_ELEMENTS
+}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compare two ModelComparison snapshot files without Revit.")
+    parser.add_argument('previous', help="snapshot of the PREVIOUS model")
+    parser.add_argument('latest', help="snapshot of the LATEST model")
+    parser.add_argument('-o', '--output', default='.', help="folder for the result CSVs (default: current folder)")
+    parser.add_argument('--items', default=None,
+                        help="comma separated analysis items: xyz, params, elements (default: all items both snapshots contain)")
+    parser.add_argument('--workers', type=int, default=None, help="parameter diff workers (default: one per processor core)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    start_time = time.time()
+    if args.workers is not None:
+        model_compare_core.DIFF_WORKERS = args.workers
+    pipeline = ComparisonPipeline()
+    pipeline.add_stage(STAGE_EXTRACT_PREVIOUS, lambda: load_snapshot_file(args.previous))
+    pipeline.add_stage(STAGE_EXTRACT_LATEST, lambda: load_snapshot_file(args.latest))
+    prev_model_data, latest_model_data = pipeline.run(STAGE_EXTRACT_PREVIOUS, STAGE_EXTRACT_LATEST)
+    available = [item for item in snapshot_analysis_items(prev_model_data) if item in snapshot_analysis_items(latest_model_data)]
+    if args.items:
+        try:
+            analysis_items = [ITEM_NAMES[name.strip()] for name in args.items.split(',') if name.strip()]
+        except KeyError as e:
+            print("Unknown analysis item: {} (use {})".format(e, ', '.join(sorted(ITEM_NAMES))))
+            return 2
+        missing = [item for item in analysis_items if item not in available]
+        if missing:
+            print("Analysis items not contained in both snapshots: {}".format(', '.join(missing)))
+            return 2
+    else:
+        analysis_items = available
+    if not analysis_items:
+        print("The snapshots have no analysis items in common.")
+        return 2
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    add_compare_stages(pipeline, analysis_items, args.output, get_compare_date())
+    pipeline.get(STAGE_EXPORT)
+    pipeline.print_timings()
+    print("--- Total time: {:.2f}s ---".format(time.time() - start_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1816 @@
+# -*- coding: utf-8 -*-
+# Model comparison core: extracted data stores, content hashes, snapshot files, the diff, change records,
+# summaries, sketches and the streaming merge-join. It does not use the Revit API, so it runs inside
+# Revit (IronPython or CPython) for the ModelComparison button and on plain CPython for
+# model_compare_cli.py.
+import csv
+import os
+import sys
+import json
+import hashlib
+import bisect
+import heapq
+import datetime
+import time
+import re
+import fnmatch
+from array import array
+try:
+    import numpy as np  # Available on pyRevit's CPython engine; IronPython falls back to the plain loop
+except ImportError:
+    np = None
+
+ANALYSIS_XYZ = "XYZ deviation"
+ANALYSIS_PARAMS = "Parameter value change"
+ANALYSIS_ELEMENTS = "Newly/deleted elements"
+ANALYSIS_ESTIMATE = "Quick estimate (sketch)"
+
+# --- Compact parameter store ---
+# Parameter data of large models is kept in a compact form: parameter names and values are
+# interned, each category has a schema mapping parameter names to column indexes, each element
+# keeps a tuple of values in schema order, and element ids live in an array.
+try:
+    array('q')
+    ELEMENT_ID_TYPECODE = 'q'
+except ValueError:
+    ELEMENT_ID_TYPECODE = 'l'  # IronPython 2.7 has no 'q' typecode
+
+_MISSING = object()  # Column not present on an element
+
+class ParamSchema(object):
+    """Maps the parameter names of one category to column indexes."""
+    __slots__ = ('names', 'columns')
+
+    def __init__(self):
+        self.names = []
+        self.columns = {}
+
+    def column(self, name):
+        col = self.columns.get(name)
+        if col is None:
+            col = len(self.names)
+            self.columns[name] = col
+            self.names.append(name)
+        return col
+
+class ParamRecord(object):
+    """
+    Parameter record of one element. Supports the same keys as the dict records
+    ('family_and_type', 'category', 'parameters', 'type_parameters', 'type_id') so it can be passed to the
+    compare functions unchanged.
+    """
+    __slots__ = ('family_and_type', 'category', 'schema', 'values', 'type_parameters', 'type_id')
+    KEYS = ('family_and_type', 'category', 'parameters', 'type_parameters', 'type_id')
+
+    def __init__(self, family_and_type, category, schema, values, type_parameters, type_id=None):
+        self.family_and_type = family_and_type
+        self.category = category
+        self.schema = schema
+        self.values = values
+        self.type_parameters = type_parameters
+        self.type_id = type_id
+
+    def parameters(self):
+        names = self.schema.names
+        return dict((names[i], v) for i, v in enumerate(self.values) if v is not _MISSING)
+
+    def __getitem__(self, key):
+        if key == 'parameters':
+            return self.parameters()
+        if key in ParamRecord.KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ParamRecord.KEYS
+
+    def get(self, key, default=None):
+        return self[key] if key in ParamRecord.KEYS else default
+
+class CompactParamStore(object):
+    """
+    Drop-in replacement for the {element_id: {family_and_type, category, parameters, type_parameters, type_id}}
+    dict returned by the parameter extraction.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._schemas = {}
+        self._type_params = {}
+        self._ids = array(ELEMENT_ID_TYPECODE)
+        self._records = []
+        self._sorted = True
+
+    def intern(self, value):
+        if value is None:
+            return value
+        # Keyed by type as well, so that 1, 1.0 and True stay distinct values
+        return self._values.setdefault((type(value), value), value)
+
+    def intern_dict(self, values):
+        return dict((self.intern(k), self.intern(v)) for k, v in values.items())
+
+    def add_type(self, type_key, type_parameters):
+        """Stores the (shared) type parameter dict of a type and returns it."""
+        tdict = self._type_params.get(type_key)
+        if tdict is None:
+            tdict = self._type_params[type_key] = self.intern_dict(type_parameters)
+        return tdict
+
+    def types(self):
+        """Returns {type_key: {param_name: param_value}} of all stored types."""
+        return self._type_params
+
+    def add(self, eid, family_and_type, category, parameters, type_parameters, type_id=None):
+        category = self.intern(category)
+        schema = self._schemas.get(category)
+        if schema is None:
+            schema = self._schemas[category] = ParamSchema()
+        values = []
+        for name, value in parameters.items():
+            col = schema.column(self.intern(name))
+            if col >= len(values):
+                values.extend([_MISSING] * (col + 1 - len(values)))
+            values[col] = self.intern(value)
+        if self._ids and eid <= self._ids[-1]:
+            self._sorted = False
+        self._ids.append(eid)
+        self._records.append(ParamRecord(self.intern(family_and_type), category, schema, tuple(values), type_parameters, type_id))
+
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        self._ids = array(ELEMENT_ID_TYPECODE, [self._ids[i] for i in order])
+        self._records = [self._records[i] for i in order]
+        self._sorted = True
+
+    def _find(self, eid):
+        self._ensure_sorted()
+        i = bisect.bisect_left(self._ids, eid)
+        if i < len(self._ids) and self._ids[i] == eid:
+            return i
+        return -1
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, eid):
+        return self._find(eid) >= 0
+
+    def __getitem__(self, eid):
+        i = self._find(eid)
+        if i < 0:
+            raise KeyError(eid)
+        return self._records[i]
+
+    def get(self, eid, default=None):
+        i = self._find(eid)
+        return self._records[i] if i >= 0 else default
+
+    def keys(self):
+        self._ensure_sorted()
+        return self._ids
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        self._ensure_sorted()
+        return zip(self._ids, self._records)
+
+class CompactXyzStore(object):
+    """
+    Drop-in replacement for the {element_id: (family_and_type, category, (x, y, z))} dict returned by the
+    XYZ extraction. Ids and coordinates are kept in flat arrays, so the numpy XYZ engine can use them
+    without copying. Only used when numpy is available (see new_xyz_store); the plain loop is faster on dicts.
+    """
+
+    def __init__(self):
+        self._labels = {}
+        self._ids = array(ELEMENT_ID_TYPECODE)
+        self._coords = array('d')
+        self._entries = []  # (family_and_type, category), shared between elements
+        self._sorted = True
+
+    def __setitem__(self, eid, entry):
+        family_and_type, category, xyz = entry
+        label = (family_and_type, category)
+        if self._ids and eid <= self._ids[-1]:
+            self._sorted = False
+        self._ids.append(eid)
+        self._coords.extend(xyz)
+        self._entries.append(self._labels.setdefault(label, label))
+
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        coords = self._coords
+        self._ids = array(ELEMENT_ID_TYPECODE, [self._ids[i] for i in order])
+        self._coords = array('d', [coords[3 * i + k] for i in order for k in range(3)])
+        self._entries = [self._entries[i] for i in order]
+        self._sorted = True
+
+    def _find(self, eid):
+        self._ensure_sorted()
+        i = bisect.bisect_left(self._ids, eid)
+        if i < len(self._ids) and self._ids[i] == eid:
+            return i
+        return -1
+
+    def _entry(self, i):
+        fam_type, category = self._entries[i]
+        return fam_type, category, tuple(self._coords[3 * i:3 * i + 3])
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, eid):
+        return self._find(eid) >= 0
+
+    def __getitem__(self, eid):
+        i = self._find(eid)
+        if i < 0:
+            raise KeyError(eid)
+        return self._entry(i)
+
+    def get(self, eid, default=None):
+        i = self._find(eid)
+        return self._entry(i) if i >= 0 else default
+
+    def keys(self):
+        self._ensure_sorted()
+        return self._ids
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        self._ensure_sorted()
+        for i, eid in enumerate(self._ids):
+            yield eid, self._entry(i)
+
+    def columns(self):
+        """Returns (ids, coords, labels): sorted ids, flat x, y, z coordinates and (family_and_type, category) per id."""
+        self._ensure_sorted()
+        return self._ids, self._coords, self._entries
+
+def new_xyz_store():
+    return CompactXyzStore() if np is not None and XYZ_ENGINE != 'python' else {}
+
+# --- Content hashes ---
+# Each element gets a stable content hash over its quantized location, family/type and instance plus
+# type parameter values. Hashes roll up into one root per category, so the diff can skip unchanged
+# categories entirely and only drill into elements whose hashes differ.
+XYZ_TOLERANCE = 0.001  # Revit units (feet); smaller moves are not reported
+PARAM_DOUBLE_TOLERANCE = 1e-6  # Parameter doubles closer than this are treated as equal
+
+def _hash_token(value, tolerance=PARAM_DOUBLE_TOLERANCE):
+    if value is None:
+        return u'N'
+    if isinstance(value, float):
+        return u'f%d' % int(round(value / tolerance))
+    if isinstance(value, int):
+        return u'i%d' % value
+    return u's%s' % (value,)
+
+def _hash_parts(parts):
+    digest = hashlib.md5(u'\x1e'.join(parts).encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)  # 60 bits, fits in a signed 64-bit integer
+
+def hash_param_dict(params):
+    return _hash_parts([u'%s\x1f%s' % (name, _hash_token(params[name])) for name in sorted(params)])
+
+class ContentHasher(object):
+    """Computes element content hashes; type parameter hashes are computed once per type."""
+
+    def __init__(self, type_params):
+        self.type_params = type_params
+        self._type_hashes = {}
+
+    def element_hash(self, family_and_type, category, xyz, params, type_key):
+        parts = [family_and_type or u'', category]
+        if xyz is None:
+            parts.append(u'N')
+        else:
+            parts.extend(_hash_token(v, XYZ_TOLERANCE) for v in xyz)
+        parts.append(u'N' if params is None else u'%x' % hash_param_dict(params))
+        if type_key is None:
+            parts.append(u'N')
+        else:
+            type_hash = self._type_hashes.get(type_key)
+            if type_hash is None:
+                type_hash = self._type_hashes[type_key] = u'%x' % hash_param_dict(self.type_params.get(type_key) or {})
+            parts.append(type_hash)
+        return _hash_parts(parts)
+
+class ModelHashes(object):
+    """Per-element content hashes grouped by category, with one root hash per category."""
+
+    def __init__(self):
+        self.categories = {}  # {category: {element_id: element_hash}}
+        self._roots = {}
+
+    def add(self, eid, category, element_hash):
+        self.categories.setdefault(category, {})[eid] = element_hash
+        self._roots.pop(category, None)
+
+    def root(self, category):
+        root = self._roots.get(category)
+        if root is None:
+            hashes = self.categories.get(category, {})
+            root = self._roots[category] = _hash_parts([u'%d:%x' % (eid, hashes[eid]) for eid in sorted(hashes)])
+        return root
+
+    def changed_ids(self, other, element_ids=None):
+        """
+        Returns the set of element ids whose content differs between self (previous) and other (latest),
+        including elements present on one side only. Categories with equal roots are skipped.
+        element_ids optionally limits the check to those elements.
+        """
+        if element_ids is not None:
+            mine = self._find(element_ids)
+            theirs = other._find(element_ids)
+            return set(eid for eid in element_ids if mine.get(eid) != theirs.get(eid))
+        changed = set()
+        for category in set(self.categories) | set(other.categories):
+            mine = self.categories.get(category, {})
+            theirs = other.categories.get(category, {})
+            if self.root(category) == other.root(category):
+                continue
+            for eid, element_hash in mine.items():
+                if theirs.get(eid) != element_hash:
+                    changed.add(eid)
+            for eid in theirs:
+                if eid not in mine:
+                    changed.add(eid)
+        return changed
+
+    def _find(self, element_ids):
+        """Returns {element_id: element_hash} of the given element ids."""
+        found = {}
+        for hashes in self.categories.values():
+            for eid in element_ids:
+                element_hash = hashes.get(eid)
+                if element_hash is not None:
+                    found[eid] = element_hash
+        return found
+
+    def element_count(self):
+        return sum(len(hashes) for hashes in self.categories.values())
+
+    def to_json(self):
+        return [[category, list(hashes.items())] for category, hashes in self.categories.items()]
+
+    @staticmethod
+    def from_json(data):
+        model_hashes = ModelHashes()
+        for category, items in data:
+            model_hashes.categories[category] = dict((eid, element_hash) for eid, element_hash in items)
+        return model_hashes
+
+# --- Snapshot files ---
+# Extracted model data is saved as JSON snapshots (see snapshot_to_json); the snapshot cache of the
+# ModelComparison button and the command line comparison (model_compare_cli.py) both read and write them.
+SNAPSHOT_FORMAT_VERSION = 5
+
+def snapshot_to_json(xyz_data, param_data, elements_data, hashes):
+    snapshot = {'xyz': None, 'params': None, 'type_params': None, 'elements': None, 'hashes': hashes.to_json()}
+    if xyz_data is not None:
+        snapshot['xyz'] = [[eid, fam_type, cat, list(xyz)] for eid, (fam_type, cat, xyz) in xyz_data.items()]
+    if param_data is not None:
+        # Type parameter dicts are shared between instances of a type; store each one once
+        snapshot['params'] = [[eid, info['family_and_type'], info['category'], info['parameters'], info['type_id']]
+                              for eid, info in param_data.items()]
+        snapshot['type_params'] = [[type_key, tdict] for type_key, tdict in param_data.types().items()]
+    if elements_data is not None:
+        snapshot['elements'] = [[eid, fam_type, cat, list(xyz) if xyz else None] for eid, fam_type, cat, xyz in elements_data]
+    return snapshot
+
+def snapshot_from_json(snapshot):
+    xyz_data = param_data = elements_data = None
+    hashes = ModelHashes.from_json(snapshot['hashes'])
+    if snapshot.get('xyz') is not None:
+        xyz_data = new_xyz_store()
+        for eid, fam_type, cat, xyz in snapshot['xyz']:
+            xyz_data[eid] = (fam_type, cat, tuple(xyz))
+    if snapshot.get('params') is not None:
+        param_data = CompactParamStore()
+        for type_key, tdict in snapshot['type_params']:
+            param_data.add_type(type_key, tdict)
+        types = param_data.types()
+        for eid, fam_type, cat, params, type_key in snapshot['params']:
+            param_data.add(eid, fam_type, cat, params, types.get(type_key, {}), type_key)
+    if snapshot.get('elements') is not None:
+        elements_data = [(eid, fam_type, cat, tuple(xyz) if xyz else None) for eid, fam_type, cat, xyz in snapshot['elements']]
+    return xyz_data, param_data, elements_data, hashes
+
+def save_snapshot_file(snapshot_path, xyz_data, param_data, elements_data, hashes):
+    snapshot = snapshot_to_json(xyz_data, param_data, elements_data, hashes)
+    snapshot['version'] = SNAPSHOT_FORMAT_VERSION
+    with open(snapshot_path, 'w') as f:
+        json.dump(snapshot, f)
+
+def load_snapshot_file(snapshot_path):
+    """
+    Returns (xyz_data, param_data, elements_data, hashes) from a snapshot file.
+    Raises ValueError if the file was written by another snapshot format version.
+    """
+    with open(snapshot_path, 'r') as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError("{} has snapshot format version {}, expected {}".format(
+            snapshot_path, snapshot.get('version'), SNAPSHOT_FORMAT_VERSION))
+    return snapshot_from_json(snapshot)
+
+def snapshot_analysis_items(model_data):
+    """Returns the analysis items the extracted model data (xyz_data, param_data, elements_data, hashes) can serve."""
+    xyz_data, param_data, elements_data, _ = model_data
+    return [item for item, data in ((ANALYSIS_XYZ, xyz_data), (ANALYSIS_PARAMS, param_data), (ANALYSIS_ELEMENTS, elements_data))
+            if data is not None]
+
+# --- Parameter profiles ---
+# A parameter profile decides which parameters are read during extraction, so unwanted parameters are
+# never read from Revit. Profiles are saved in a JSON file the user can edit:
+#   {"last": "<name>", "profiles": [{"name": ..., "include": [...], "include_patterns": [...],
+#                                    "exclude": [...], "exclude_patterns": [...], "exclude_volatile": true}]}
+# Patterns are wildcards (e.g. "IFC*"). Without include names or patterns all parameters are included.
+# Volatile parameters change without a model change (or are written by ModelComparison itself).
+VOLATILE_PARAMETERS = ['compare_results', 'compare_date', 'Edited by']
+DEFAULT_PARAMETER_PROFILE = "All parameters (volatile excluded)"
+
+class ParameterProfile(object):
+
+    def __init__(self, name, include=None, include_patterns=None, exclude=None, exclude_patterns=None, exclude_volatile=True):
+        self.name = name
+        self.include = list(include or [])
+        self.include_patterns = list(include_patterns or [])
+        self.exclude = list(exclude or [])
+        self.exclude_patterns = list(exclude_patterns or [])
+        self.exclude_volatile = exclude_volatile
+        excluded = set(self.exclude)
+        if exclude_volatile:
+            excluded.update(VOLATILE_PARAMETERS)
+        self._excluded = excluded
+        self._include_re = self._compile(self.include_patterns)
+        self._exclude_re = self._compile(self.exclude_patterns)
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join('(?:{})'.format(fnmatch.translate(p)) for p in patterns))
+
+    def allows(self, name):
+        if name in self._excluded or (self._exclude_re is not None and self._exclude_re.match(name)):
+            return False
+        if not self.include and self._include_re is None:
+            return True
+        return name in self.include or (self._include_re is not None and self._include_re.match(name) is not None)
+
+    def key(self):
+        """Identifies what the profile extracts, e.g. for snapshot cache keys."""
+        return [sorted(self.include), sorted(self.include_patterns), sorted(self._excluded), sorted(self.exclude_patterns)]
+
+    def to_json(self):
+        return {'name': self.name, 'include': self.include, 'include_patterns': self.include_patterns,
+                'exclude': self.exclude, 'exclude_patterns': self.exclude_patterns, 'exclude_volatile': self.exclude_volatile}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['name'], data.get('include'), data.get('include_patterns'), data.get('exclude'),
+                   data.get('exclude_patterns'), data.get('exclude_volatile', True))
+
+def get_default_parameter_profiles():
+    return [ParameterProfile(DEFAULT_PARAMETER_PROFILE),
+            ParameterProfile("All parameters", exclude_volatile=False)]
+
+def load_parameter_profiles(path):
+    """
+    Returns (profiles, last_profile_name) from a profile file. A missing file is created with the default profiles.
+    """
+    if not os.path.exists(path):
+        profiles = get_default_parameter_profiles()
+        save_parameter_profiles(path, profiles, DEFAULT_PARAMETER_PROFILE)
+        return profiles, DEFAULT_PARAMETER_PROFILE
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        profiles = [ParameterProfile.from_json(p) for p in data.get('profiles', [])]
+    except (IOError, OSError, ValueError, KeyError) as e:
+        print("Error loading parameter profiles {}: {}".format(path, e))
+        return get_default_parameter_profiles(), DEFAULT_PARAMETER_PROFILE
+    if not profiles:
+        profiles = get_default_parameter_profiles()
+    return profiles, data.get('last', profiles[0].name)
+
+def save_parameter_profiles(path, profiles, last_profile_name):
+    try:
+        with open(path, 'w') as f:
+            json.dump({'last': last_profile_name, 'profiles': [p.to_json() for p in profiles]}, f, indent=2)
+    except (IOError, OSError) as e:
+        print("Error saving parameter profiles {}: {}".format(path, e))
+
+COMPARE_FIELDNAMES = [
+    'previous_element_id',
+    'current_element_id',
+    'previous_family_and_type',
+    'current_family_and_type',
+    'previous_category',
+    'current_category',
+    'compare_result',
+    'compare_date'
+]
+
+CHANGE_RECORD_FIELDNAMES = [
+    'previous_element_id',
+    'current_element_id',
+    'previous_family_and_type',
+    'current_family_and_type',
+    'previous_category',
+    'current_category',
+    'change_kind',
+    'parameter',
+    'old_value',
+    'new_value',
+    'distance_mm',
+    'affected_instances',
+    'compare_date'
+]
+
+EXPORT_CHANGE_RECORDS_CSV = True  # Also export one row per change (long format)
+
+# Change kinds
+CHANGE_XY_MOVE = 'XY coordination move'
+CHANGE_Z_MOVE = 'Z coordination move'
+CHANGE_PARAM_ADD = 'new parameter add'
+CHANGE_PARAM_DELETE = 'parameter delete'
+CHANGE_PARAM_VALUE = 'parameter value change'
+CHANGE_TYPE_PARAM_ADD = 'new type parameter add'
+CHANGE_TYPE_PARAM_DELETE = 'type parameter delete'
+CHANGE_TYPE_PARAM_VALUE = 'type parameter value change'
+CHANGE_ELEMENT_ADDED = 'new element added'
+CHANGE_ELEMENT_DELETED = 'element deleted'
+CHANGE_ELEMENT_RECREATED = 're-created'  # Deleted element matched to a new element at (nearly) the same location
+CHANGE_TYPE = 'type change'  # Instance of a type whose type parameters changed (see TypeChange)
+
+class ChangeRecord(object):
+    """
+    One change of one element. distance is in mm for moves (signed for Z moves: positive is upward);
+    parameter, old_value and new_value are set for parameter changes; type_change is set for CHANGE_TYPE records.
+    """
+    __slots__ = ('previous_element_id', 'current_element_id', 'previous_family_and_type', 'current_family_and_type',
+                 'previous_category', 'current_category', 'kind', 'parameter', 'old_value', 'new_value', 'distance',
+                 'type_change')
+
+    def __init__(self, previous_element_id, current_element_id, previous_family_and_type, current_family_and_type,
+                 previous_category, current_category, kind, parameter=None, old_value=None, new_value=None, distance=None,
+                 type_change=None):
+        self.previous_element_id = previous_element_id
+        self.current_element_id = current_element_id
+        self.previous_family_and_type = previous_family_and_type
+        self.current_family_and_type = current_family_and_type
+        self.previous_category = previous_category
+        self.current_category = current_category
+        self.kind = kind
+        self.parameter = parameter
+        self.old_value = old_value
+        self.new_value = new_value
+        self.distance = distance
+        self.type_change = type_change
+
+    def __reduce__(self):
+        # Compact pickling for records sent back from diff worker processes
+        return (ChangeRecord, tuple(getattr(self, name) for name in ChangeRecord.__slots__))
+
+    @property
+    def element_id(self):
+        return self.previous_element_id or self.current_element_id
+
+    @property
+    def category(self):
+        return self.current_category or self.previous_category or 'Unknown'
+
+    def describe(self):
+        """Renders the change as the compare result text written to the CSVs and the model."""
+        if self.kind == CHANGE_TYPE:
+            return self.type_change.describe()
+        if self.kind == CHANGE_XY_MOVE:
+            return "XY coordination move + '{0}mm'".format(int(round(self.distance)))
+        if self.kind == CHANGE_Z_MOVE:
+            direction = 'upward' if self.distance > 0 else 'downward'
+            return "Z coordination move {0} + '{1}mm'".format(direction, int(round(abs(self.distance))))
+        if self.kind == CHANGE_ELEMENT_RECREATED:
+            return "re-created (moved {0}mm)".format(int(round(self.distance)))
+        if self.kind in (CHANGE_PARAM_VALUE, CHANGE_TYPE_PARAM_VALUE):
+            return "{}: {} ({} -> {})".format(self.kind, self.parameter, self.old_value, self.new_value)
+        if self.parameter is not None:
+            return "{}: {}".format(self.kind, self.parameter)
+        return self.kind
+
+    def to_row(self, compare_date, affected_instances=''):
+        return {
+            'previous_element_id': self.previous_element_id,
+            'current_element_id': self.current_element_id,
+            'previous_family_and_type': self.previous_family_and_type,
+            'current_family_and_type': self.current_family_and_type,
+            'previous_category': self.previous_category,
+            'current_category': self.current_category,
+            'change_kind': self.kind,
+            'parameter': '' if self.parameter is None else self.parameter,
+            'old_value': '' if self.old_value is None else self.old_value,
+            'new_value': '' if self.new_value is None else self.new_value,
+            'distance_mm': '' if self.distance is None else int(round(self.distance)),
+            'affected_instances': affected_instances,
+            'compare_date': compare_date
+        }
+
+def get_compare_date():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def diff_xyz(eid, prev_entry, latest_entry):
+    """
+    prev_entry / latest_entry: (family_and_type, category, (x, y, z)) or None.
+    Returns the move records of the element (XY and/or Z move).
+    """
+    if prev_entry is None or latest_entry is None:
+        return []
+    fam_type, cat, prev_xyz = prev_entry
+    latest_xyz = latest_entry[2]
+    dx = latest_xyz[0] - prev_xyz[0]
+    dy = latest_xyz[1] - prev_xyz[1]
+    dz = latest_xyz[2] - prev_xyz[2]
+    records = []
+    # XYZ only compares same element, so use fam_type for both
+    if abs(dx) > XYZ_TOLERANCE or abs(dy) > XYZ_TOLERANCE:
+        xy_dist = ((dx ** 2 + dy ** 2) ** 0.5) * 304.8  # Revit units to mm
+        records.append(ChangeRecord(eid, eid, fam_type, fam_type, cat, cat, CHANGE_XY_MOVE, distance=xy_dist))
+    if abs(dz) > XYZ_TOLERANCE:
+        records.append(ChangeRecord(eid, eid, fam_type, fam_type, cat, cat, CHANGE_Z_MOVE, distance=dz * 304.8))
+    return records
+
+def diff_param_dicts(prev_params, latest_params, make_record, type_level=False):
+    """
+    Compares two {param_name: param_value} dicts.
+    make_record(kind, parameter, old_value, new_value) builds the change records.
+    """
+    records = []
+    add_kind = CHANGE_TYPE_PARAM_ADD if type_level else CHANGE_PARAM_ADD
+    delete_kind = CHANGE_TYPE_PARAM_DELETE if type_level else CHANGE_PARAM_DELETE
+    value_kind = CHANGE_TYPE_PARAM_VALUE if type_level else CHANGE_PARAM_VALUE
+    prev_param_names = set(prev_params.keys())
+    latest_param_names = set(latest_params.keys())
+    # New parameters
+    for pname in latest_param_names - prev_param_names:
+        records.append(make_record(add_kind, pname, None, latest_params[pname]))
+    # Deleted parameters
+    for pname in prev_param_names - latest_param_names:
+        records.append(make_record(delete_kind, pname, prev_params[pname], None))
+    # Changed parameters
+    for pname in prev_param_names & latest_param_names:
+        prev_val = prev_params[pname]
+        latest_val = latest_params[pname]
+        if isinstance(prev_val, float) and isinstance(latest_val, float):
+            if abs(prev_val - latest_val) > PARAM_DOUBLE_TOLERANCE:
+                records.append(make_record(value_kind, pname, prev_val, latest_val))
+        elif prev_val != latest_val:
+            records.append(make_record(value_kind, pname, prev_val, latest_val))
+    return records
+
+class TypeChange(object):
+    """
+    Type parameter changes of one element type. The type is diffed once and the same TypeChange is
+    referenced by a CHANGE_TYPE record on each affected instance.
+    """
+    __slots__ = ('type_id', 'changes', 'records', 'instance_count', '_description')
+
+    def __init__(self, type_id, changes):
+        self.type_id = type_id
+        self.changes = changes  # [(kind, parameter, old_value, new_value), ...]
+        self.records = None
+        self.instance_count = 0
+        self._description = None
+
+    def __reduce__(self):
+        return (TypeChange, (self.type_id, self.changes))
+
+    def instance_record(self, eid, prev_info, latest_info):
+        """Returns the CHANGE_TYPE record of one instance. It is counted by add_instance (see count_type_instances)."""
+        return ChangeRecord(eid, eid, prev_info['family_and_type'], latest_info['family_and_type'],
+                            prev_info['category'], latest_info['category'], CHANGE_TYPE, type_change=self)
+
+    def add_instance(self, record):
+        """Counts the CHANGE_TYPE record of one instance as affected."""
+        if self.records is None:
+            # Type-level records take family/type and category from the first instance
+            fam_type = record.current_family_and_type
+            cat = record.current_category
+            self.records = [ChangeRecord(self.type_id, self.type_id, fam_type, fam_type, cat, cat, kind,
+                                         parameter=pname, old_value=old_value, new_value=new_value)
+                            for kind, pname, old_value, new_value in self.changes]
+        self.instance_count += 1
+
+    def describe(self):
+        if self._description is None:
+            self._description = ', '.join(record.describe() for record in self.records)
+        return self._description
+
+def diff_types(prev_types, latest_types):
+    """
+    Diffs the type parameters of every type present in both models once.
+    prev_types / latest_types: {type_key: {param_name: param_value}}
+    Returns {type_key: TypeChange} for the types whose parameters changed.
+    """
+    type_changes = {}
+    for type_key, prev_type_params in prev_types.items():
+        latest_type_params = latest_types.get(type_key)
+        if latest_type_params is None:
+            continue
+        changes = diff_param_dicts(prev_type_params, latest_type_params, lambda *change: change, type_level=True)
+        if changes:
+            type_changes[type_key] = TypeChange(type_key, changes)
+    return type_changes
+
+def count_type_instances(records, type_changes=None):
+    """
+    Counts the CHANGE_TYPE records as affected instances of their types, in record order.
+    Records that come back from another process carry copies of the TypeChange; they are pointed
+    back to the one in type_changes.
+    """
+    for record in records:
+        if record.kind == CHANGE_TYPE:
+            if type_changes:
+                record.type_change = type_changes.get(record.type_change.type_id, record.type_change)
+            record.type_change.add_instance(record)
+
+def diff_params(eid, prev_info, latest_info, type_changes=None):
+    """
+    prev_info / latest_info: parameter records ({family_and_type, category, parameters, type_parameters, type_id}) or None.
+    type_changes: {type_key: TypeChange} from diff_types(). When the element keeps its type, type parameter
+    changes are taken from there by reference instead of being diffed again for every instance.
+    Returns the instance and type parameter change records of the element.
+    """
+    identity = (
+        eid if prev_info else '',
+        eid if latest_info else '',
+        prev_info['family_and_type'] if prev_info else '',
+        latest_info['family_and_type'] if latest_info else '',
+        prev_info['category'] if prev_info else '',
+        latest_info['category'] if latest_info else ''
+    )
+
+    def make_record(kind, parameter, old_value, new_value):
+        return ChangeRecord(*identity, kind=kind, parameter=parameter, old_value=old_value, new_value=new_value)
+
+    prev_params = prev_info['parameters'] if prev_info else {}
+    latest_params = latest_info['parameters'] if latest_info else {}
+    records = diff_param_dicts(prev_params, latest_params, make_record)
+    prev_type_id = prev_info.get('type_id') if prev_info else None
+    latest_type_id = latest_info.get('type_id') if latest_info else None
+    if type_changes is not None and prev_type_id is not None and prev_type_id == latest_type_id:
+        type_change = type_changes.get(prev_type_id)
+        if type_change:
+            records.append(type_change.instance_record(eid, prev_info, latest_info))
+        return records
+    prev_type_params = prev_info['type_parameters'] if prev_info and 'type_parameters' in prev_info else {}
+    latest_type_params = latest_info['type_parameters'] if latest_info and 'type_parameters' in latest_info else {}
+    if prev_type_params is not latest_type_params:
+        records.extend(diff_param_dicts(prev_type_params, latest_type_params, make_record, type_level=True))
+    return records
+
+def diff_element(eid, prev_entry, latest_entry):
+    """
+    prev_entry / latest_entry: (element_id, family_and_type, category, xyz) or None.
+    Returns a deleted or new element record, if any.
+    """
+    if prev_entry is not None and latest_entry is None:
+        return [ChangeRecord(eid, '', prev_entry[1], '', prev_entry[2], '', CHANGE_ELEMENT_DELETED)]
+    if prev_entry is None and latest_entry is not None:
+        return [ChangeRecord('', eid, '', latest_entry[1], '', latest_entry[2], CHANGE_ELEMENT_ADDED)]
+    return []
+
+# --- Re-created element matching ---
+# Deleted and new elements of the same category within RECREATED_MATCH_TOLERANCE_MM of each other are
+# reported as one re-created element. New elements are indexed in a uniform 3D grid with the tolerance
+# as cell size, so each deleted element only checks the 27 cells around it.
+MATCH_RECREATED_ELEMENTS = True
+RECREATED_MATCH_TOLERANCE_MM = 100.0
+
+def _grid_cell(xyz, cell_size):
+    return (int(xyz[0] // cell_size), int(xyz[1] // cell_size), int(xyz[2] // cell_size))
+
+def match_recreated_elements(deleted_entries, added_entries, tolerance_mm=RECREATED_MATCH_TOLERANCE_MM):
+    """
+    deleted_entries / added_entries: [(element_id, family_and_type, category, xyz), ...]; xyz may be None.
+    Pairs each deleted element with the nearest unpaired new element of the same category within
+    tolerance_mm. Deleted elements are matched in element id order, so the result is deterministic.
+    Returns a list of (deleted_entry, added_entry, distance_mm).
+    """
+    cell_size = tolerance_mm / 304.8  # mm to Revit units
+    grid = {}  # {(category, i, j, k): [added_entry, ...]}
+    for entry in sorted(added_entries, key=lambda e: e[0]):
+        if entry[3]:
+            grid.setdefault((entry[2],) + _grid_cell(entry[3], cell_size), []).append(entry)
+    paired = set()
+    pairs = []
+    for entry in sorted(deleted_entries, key=lambda e: e[0]):
+        xyz = entry[3]
+        if not xyz:
+            continue
+        ci, cj, ck = _grid_cell(xyz, cell_size)
+        best = best_dist = None
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for dk in (-1, 0, 1):
+                    for candidate in grid.get((entry[2], ci + di, cj + dj, ck + dk), ()):
+                        if candidate[0] in paired:
+                            continue
+                        cxyz = candidate[3]
+                        dist = ((cxyz[0] - xyz[0]) ** 2 + (cxyz[1] - xyz[1]) ** 2 + (cxyz[2] - xyz[2]) ** 2) ** 0.5
+                        if dist <= cell_size and (best is None or (dist, candidate[0]) < (best_dist, best[0])):
+                            best, best_dist = candidate, dist
+        if best is not None:
+            paired.add(best[0])
+            pairs.append((entry, best, best_dist * 304.8))
+    return pairs
+
+def recreated_record(deleted_entry, added_entry, distance_mm):
+    return ChangeRecord(deleted_entry[0], added_entry[0], deleted_entry[1], added_entry[1], deleted_entry[2], added_entry[2],
+                        CHANGE_ELEMENT_RECREATED, distance=distance_mm)
+
+XYZ_ENGINE = 'auto'  # 'python', 'numpy' or 'auto' (numpy when it can be imported)
+XYZ_NUMPY_MIN_ELEMENTS = 1000  # Below this the array setup costs more than the plain loop
+
+def use_numpy_xyz_engine(element_count):
+    if np is None or XYZ_ENGINE == 'python':
+        return False
+    return XYZ_ENGINE == 'numpy' or element_count >= XYZ_NUMPY_MIN_ELEMENTS
+
+def compare_xyz_data(prev_xyz_data, latest_xyz_data, element_ids=None):
+    """
+    Compares XYZ data between previous and latest models by element_id.
+    element_ids optionally limits the comparison to those elements (e.g. ModelHashes.changed_ids).
+    Returns a list of ChangeRecord (XY / Z moves).
+    """
+    if isinstance(prev_xyz_data, CompactXyzStore) and isinstance(latest_xyz_data, CompactXyzStore):
+        if use_numpy_xyz_engine(len(prev_xyz_data) if element_ids is None else len(element_ids)):
+            return compare_xyz_data_numpy(prev_xyz_data, latest_xyz_data, element_ids)
+    records = []
+    if element_ids is None:
+        element_ids = prev_xyz_data.keys()
+    # In id order, like the numpy engine, so the rows do not depend on the engine or on set order
+    for prev_id in sorted(element_ids):
+        prev_entry = prev_xyz_data.get(prev_id)
+        if prev_entry is not None:
+            records.extend(diff_xyz(prev_id, prev_entry, latest_xyz_data.get(prev_id)))
+    return records
+
+def _numpy_view(arr):
+    if not arr:
+        return np.zeros(0, dtype=arr.typecode)
+    return np.frombuffer(arr, dtype=arr.typecode)
+
+def compare_xyz_data_numpy(prev_xyz_data, latest_xyz_data, element_ids=None):
+    """
+    Vectorized compare_xyz_data for two CompactXyzStore: aligns the ids of both models, then computes
+    the deltas, tolerance masks and mm distances in bulk. Records are only built for the moved elements,
+    with the same values as diff_xyz.
+    """
+    prev_ids, prev_coords, prev_labels = prev_xyz_data.columns()
+    latest_ids, latest_coords, _ = latest_xyz_data.columns()
+    prev_ids = _numpy_view(prev_ids)
+    _, prev_index, latest_index = np.intersect1d(prev_ids, _numpy_view(latest_ids), assume_unique=True, return_indices=True)
+    if element_ids is not None:
+        wanted = np.fromiter(element_ids, dtype=prev_ids.dtype, count=len(element_ids))
+        keep = np.isin(prev_ids[prev_index], wanted)
+        prev_index = prev_index[keep]
+        latest_index = latest_index[keep]
+    delta = _numpy_view(latest_coords).reshape(-1, 3)[latest_index] - _numpy_view(prev_coords).reshape(-1, 3)[prev_index]
+    xy_moved = (np.abs(delta[:, 0]) > XYZ_TOLERANCE) | (np.abs(delta[:, 1]) > XYZ_TOLERANCE)
+    z_moved = np.abs(delta[:, 2]) > XYZ_TOLERANCE
+    moved = np.flatnonzero(xy_moved | z_moved)
+    xy_mm = (np.sqrt(delta[moved, 0] ** 2 + delta[moved, 1] ** 2) * 304.8).tolist()  # Revit units to mm
+    z_mm = (delta[moved, 2] * 304.8).tolist()
+    xy_flags = xy_moved[moved].tolist()
+    z_flags = z_moved[moved].tolist()
+    records = []
+    for i, index in enumerate(prev_index[moved].tolist()):
+        eid = prev_ids[index].item()
+        fam_type, cat = prev_labels[index]
+        if xy_flags[i]:
+            records.append(ChangeRecord(eid, eid, fam_type, fam_type, cat, cat, CHANGE_XY_MOVE, distance=xy_mm[i]))
+        if z_flags[i]:
+            records.append(ChangeRecord(eid, eid, fam_type, fam_type, cat, cat, CHANGE_Z_MOVE, distance=z_mm[i]))
+    return records
+
+# --- Parallel diff ---
+# The parameter diff is sharded by element id range. IronPython has no GIL, so there the shards run on
+# threads; on CPython they run in a multiprocessing pool when a Python interpreter can be started (not
+# inside Revit, where sys.executable is Revit itself). Shard results are concatenated in id order, so the
+# output is identical to a serial run.
+DIFF_WORKERS = 0  # 0: one per processor core, 1: always serial
+PARALLEL_DIFF_MIN_ELEMENTS = 20000  # Smaller diffs are not worth the start-up cost
+
+def get_diff_worker_count():
+    if DIFF_WORKERS:
+        return DIFF_WORKERS
+    try:
+        if sys.platform == 'cli':
+            from System import Environment
+            return Environment.ProcessorCount
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except Exception:
+        return 1
+
+def get_parallel_backend():
+    """Returns 'threads' on IronPython, 'processes' on a standalone CPython, or None (run serially)."""
+    if sys.platform == 'cli':
+        return 'threads'
+    if os.path.basename(sys.executable or '').lower().startswith('python'):
+        return 'processes'
+    return None
+
+def split_shards(element_ids, shard_count):
+    """Splits sorted element ids into at most shard_count contiguous id ranges."""
+    size = max(1, (len(element_ids) + shard_count - 1) // shard_count)
+    return [element_ids[i:i + size] for i in range(0, len(element_ids), size)]
+
+def run_shards(func, payloads, backend):
+    """Runs func on each payload in parallel; returns the results in payload order."""
+    if backend == 'processes':
+        import multiprocessing
+        pool = multiprocessing.Pool(len(payloads))
+        try:
+            return pool.map(func, payloads)
+        finally:
+            pool.close()
+            pool.join()
+    import threading
+    results = [None] * len(payloads)
+    errors = []
+
+    def run(index):
+        try:
+            results[index] = func(payloads[index])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(payloads))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def plain_param_subset(param_data, element_ids):
+    """Copies the parameter records of element_ids into plain dicts, to be sent to a worker process."""
+    subset = {}
+    for eid in element_ids:
+        info = param_data.get(eid)
+        if info is not None:
+            subset[eid] = dict((key, info[key]) for key in ParamRecord.KEYS)
+    return subset
+
+def _diff_param_shard(payload):
+    prev_param_data, latest_param_data, element_ids, type_changes = payload
+    records = []
+    for eid in element_ids:
+        records.extend(diff_params(eid, prev_param_data.get(eid), latest_param_data.get(eid), type_changes))
+    return records
+
+def compare_param_data(prev_param_data, latest_param_data, element_ids=None):
+    """
+    Compares parameter data (instance and type) between previous and latest models by element_id and parameter name.
+    Type parameters are diffed once per type (see diff_types) when both stores know the type ids.
+    element_ids optionally limits the comparison to those elements (e.g. ModelHashes.changed_ids).
+    Large diffs are sharded over DIFF_WORKERS (see run_shards).
+    Returns a list of ChangeRecord (parameter add / delete / value change, instance and type level).
+    """
+    type_changes = None
+    if hasattr(prev_param_data, 'types') and hasattr(latest_param_data, 'types'):
+        type_changes = diff_types(prev_param_data.types(), latest_param_data.types())
+    if element_ids is None:
+        element_ids = set(prev_param_data.keys()) | set(latest_param_data.keys())
+    # Sorted, so that serial and sharded runs produce the records in the same order
+    element_ids = sorted(element_ids)
+    workers = get_diff_worker_count()
+    backend = get_parallel_backend()
+    if workers > 1 and backend and len(element_ids) >= PARALLEL_DIFF_MIN_ELEMENTS:
+        shards = split_shards(element_ids, workers)
+        if backend == 'processes':
+            payloads = [(plain_param_subset(prev_param_data, shard), plain_param_subset(latest_param_data, shard), shard, type_changes)
+                        for shard in shards]
+        else:
+            # The threads share the stores: sort them here, _ensure_sorted is not safe to run concurrently
+            for param_data in (prev_param_data, latest_param_data):
+                if hasattr(param_data, '_ensure_sorted'):
+                    param_data._ensure_sorted()
+            payloads = [(prev_param_data, latest_param_data, shard, type_changes) for shard in shards]
+        records = []
+        for shard_records in run_shards(_diff_param_shard, payloads, backend):
+            records.extend(shard_records)
+    else:
+        records = _diff_param_shard((prev_param_data, latest_param_data, element_ids, type_changes))
+    count_type_instances(records, type_changes)
+    return records
+
+def compare_element_data(prev_elements_data, latest_elements_data, element_ids=None):
+    """
+    Compares element lists between previous and latest models.
+    element_ids optionally limits the comparison to those elements (e.g. ModelHashes.changed_ids).
+    Returns a list of ChangeRecord (element deleted / new element added / re-created).
+    """
+    prev_dict = dict((e[0], e) for e in prev_elements_data)
+    latest_dict = dict((e[0], e) for e in latest_elements_data)
+    prev_ids = set(prev_dict)
+    latest_ids = set(latest_dict)
+    if element_ids is not None:
+        prev_ids &= element_ids
+        latest_ids &= element_ids
+    deleted_ids = prev_ids - set(latest_dict)
+    added_ids = latest_ids - set(prev_dict)
+    records = []
+    if MATCH_RECREATED_ELEMENTS:
+        pairs = match_recreated_elements([prev_dict[eid] for eid in deleted_ids], [latest_dict[eid] for eid in added_ids])
+        for deleted_entry, added_entry, distance_mm in pairs:
+            records.append(recreated_record(deleted_entry, added_entry, distance_mm))
+            deleted_ids.discard(deleted_entry[0])
+            added_ids.discard(added_entry[0])
+    # Deleted elements
+    for eid in deleted_ids:
+        records.extend(diff_element(eid, prev_dict[eid], None))
+    # New elements
+    for eid in added_ids:
+        records.extend(diff_element(eid, None, latest_dict[eid]))
+    return records
+
+def group_records_by_element(records):
+    """
+    Groups change records by element id, keeping the order of first appearance.
+    Returns a list of (element_id, [ChangeRecord, ...]).
+    """
+    groups = {}
+    order = []
+    for record in records:
+        eid = record.element_id
+        if eid not in groups:
+            groups[eid] = []
+            order.append(eid)
+        groups[eid].append(record)
+    return [(eid, groups[eid]) for eid in order]
+
+def combine_element_records(element_records):
+    """
+    Combines the change records of one element. If the element was deleted, added or re-created, only that
+    record is kept; otherwise all records are kept.
+    """
+    for kind in (CHANGE_ELEMENT_RECREATED, CHANGE_ELEMENT_DELETED, CHANGE_ELEMENT_ADDED):
+        for record in element_records:
+            if record.kind == kind:
+                return [record]
+    return element_records
+
+def combine_comparison_results(xyz_results, param_results, element_results):
+    """
+    Combines the change records of all analysis items by element id.
+    If an element was deleted (or added), only the 'element deleted' (or 'new element added') record is kept.
+    A re-created element is grouped under its previous id; the records of its new element are dropped.
+    Returns a list of ChangeRecord, grouped by element.
+    """
+    recreated_ids = set(r.current_element_id for r in element_results if r.kind == CHANGE_ELEMENT_RECREATED)
+    combined = []
+    for eid, element_records in group_records_by_element(list(xyz_results) + list(param_results) + list(element_results)):
+        if eid in recreated_ids:
+            continue
+        combined.extend(combine_element_records(element_records))
+    return combined
+
+def render_element_row(element_records, compare_date):
+    """
+    Renders the change records of one element as a result row; compare results are joined by ', '.
+    """
+    row = dict((k, '') for k in COMPARE_FIELDNAMES)
+    for record in element_records:
+        for k in COMPARE_FIELDNAMES[:6]:
+            value = getattr(record, k)
+            if not row[k] and value:
+                row[k] = value
+    row['compare_result'] = ', '.join(record.describe() for record in element_records)
+    row['compare_date'] = compare_date
+    return row
+
+def render_rows(records, compare_date):
+    """
+    Renders change records as one result row per element.
+    Returns a list of dicts with keys:
+    'previous_element_id', 'current_element_id', 'previous_family_and_type', 'current_family_and_type', 'previous_category', 'current_category', 'compare_result', 'compare_date'
+    """
+    return [render_element_row(element_records, compare_date) for _, element_records in group_records_by_element(records)]
+
+def write_results_csv(csv_path, rows):
+    with open(csv_path, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=COMPARE_FIELDNAMES, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+class ChangeRecordWriter(object):
+    """
+    Writes change records in long format: one row per change. Type-level changes are written once per
+    type, with the number of affected instances, when the writer is closed.
+    """
+
+    def __init__(self, csvfile, compare_date):
+        self.writer = csv.DictWriter(csvfile, fieldnames=CHANGE_RECORD_FIELDNAMES, lineterminator='\n')
+        self.writer.writeheader()
+        self.compare_date = compare_date
+        self.type_changes = {}
+
+    def write(self, record):
+        if record.kind == CHANGE_TYPE:
+            self.type_changes[record.type_change.type_id] = record.type_change
+        else:
+            self.writer.writerow(record.to_row(self.compare_date))
+
+    def close(self):
+        for type_id in sorted(self.type_changes):
+            type_change = self.type_changes[type_id]
+            for record in type_change.records:
+                self.writer.writerow(record.to_row(self.compare_date, type_change.instance_count))
+        self.type_changes = {}
+
+def write_change_records_csv(csv_path, records, compare_date):
+    """Writes change records in long format: one row per change (one per type for type-level changes)."""
+    with open(csv_path, 'w') as csvfile:
+        writer = ChangeRecordWriter(csvfile, compare_date)
+        for record in records:
+            writer.write(record)
+        writer.close()
+
+def diff_model_data(prev_model_data, latest_model_data, analysis_items, element_ids=None):
+    """
+    Diffs the extracted data of two models for the chosen analysis items.
+    prev_model_data / latest_model_data: (xyz_data, param_data, elements_data, hashes) as returned by the extraction.
+    Content hashes narrow the diff down to the elements that actually changed.
+    element_ids optionally limits the diff to those elements, e.g. when only they were extracted from one model.
+    Returns {analysis_item: [ChangeRecord, ...]}.
+    """
+    prev_xyz_data, prev_param_data, prev_elements_data, prev_hashes = prev_model_data
+    latest_xyz_data, latest_param_data, latest_elements_data, latest_hashes = latest_model_data
+    changed_ids = prev_hashes.changed_ids(latest_hashes, element_ids)
+    if element_ids is not None:
+        hashed_count = len(element_ids)
+    else:
+        hashed_count = max(prev_hashes.element_count(), latest_hashes.element_count())
+    print('Content hashes: {} of {} elements changed, {} skipped'.format(
+        len(changed_ids), hashed_count, hashed_count - len(changed_ids)))
+    results = {ANALYSIS_XYZ: [], ANALYSIS_PARAMS: [], ANALYSIS_ELEMENTS: []}
+    if ANALYSIS_XYZ in analysis_items:
+        results[ANALYSIS_XYZ] = compare_xyz_data(prev_xyz_data, latest_xyz_data, changed_ids)
+    if ANALYSIS_PARAMS in analysis_items:
+        results[ANALYSIS_PARAMS] = compare_param_data(prev_param_data, latest_param_data, changed_ids)
+    if ANALYSIS_ELEMENTS in analysis_items:
+        results[ANALYSIS_ELEMENTS] = compare_element_data(prev_elements_data, latest_elements_data, changed_ids)
+    return results
+
+def combine_model_results(results):
+    """Combines the per-analysis change records returned by diff_model_data (see combine_comparison_results)."""
+    return combine_comparison_results(results[ANALYSIS_XYZ], results[ANALYSIS_PARAMS], results[ANALYSIS_ELEMENTS])
+
+# Per-analysis result CSVs: (analysis item, file name, label)
+ANALYSIS_RESULT_FILES = [
+    (ANALYSIS_XYZ, "xyz_comparison_results.csv", "XYZ comparison"),
+    (ANALYSIS_PARAMS, "param_comparison_results.csv", "Parameter comparison"),
+    (ANALYSIS_ELEMENTS, "element_comparison_results.csv", "Element comparison")
+]
+
+def export_analysis_results(folder, results, analysis_items, compare_date):
+    """Writes one result CSV per chosen analysis item (one row per element)."""
+    for item, file_name, label in ANALYSIS_RESULT_FILES:
+        if item not in analysis_items:
+            continue
+        if not results[item]:
+            print("No {} results to export.".format(label))
+            continue
+        csv_path = os.path.join(folder, file_name)
+        write_results_csv(csv_path, render_rows(results[item], compare_date))
+        print("{} results exported to: {}".format(label, csv_path))
+
+def export_combined_results(folder, combined_records, compare_date):
+    """
+    Writes the combined results CSV (one row per element) and, if enabled, the change records CSV.
+    Returns the combined result rows.
+    """
+    combined_results = render_rows(combined_records, compare_date)
+    if not combined_results:
+        print("No combined model comparison results to export.")
+        return combined_results
+    csv_path_combined = os.path.join(folder, "model_comparison_combined_results.csv")
+    write_results_csv(csv_path_combined, combined_results)
+    print("Combined model comparison results exported to: {}".format(csv_path_combined))
+    if EXPORT_CHANGE_RECORDS_CSV:
+        csv_path_records = os.path.join(folder, "model_comparison_change_records.csv")
+        write_change_records_csv(csv_path_records, combined_records, compare_date)
+        print("Change records (one row per change) exported to: {}".format(csv_path_records))
+    return combined_results
+
+# --- Summary ---
+SUMMARY_FIELDNAMES = [
+    'category',
+    'xy_move_count',
+    'z_move_count',
+    'new_param_count',
+    'new_param_list',
+    'del_param_count',
+    'del_param_list',
+    'param_value_change_count',
+    'param_value_change_list',
+    'new_type_param_count',
+    'new_type_param_list',
+    'del_type_param_count',
+    'del_type_param_list',
+    'type_param_value_change_count',
+    'type_param_value_change_list',
+    'new_elem_count',
+    'del_elem_count',
+    'recreated_elem_count',
+    'changed_type_count',
+    'changed_type_instance_count'
+]
+
+# Change kind -> (summary count key, summary parameter list key)
+SUMMARY_KEYS = {
+    CHANGE_XY_MOVE: ('xy_move_count', None),
+    CHANGE_Z_MOVE: ('z_move_count', None),
+    CHANGE_PARAM_ADD: (None, 'new_param_list'),
+    CHANGE_PARAM_DELETE: (None, 'del_param_list'),
+    CHANGE_PARAM_VALUE: (None, 'param_value_change_list'),
+    CHANGE_TYPE_PARAM_ADD: (None, 'new_type_param_list'),
+    CHANGE_TYPE_PARAM_DELETE: (None, 'del_type_param_list'),
+    CHANGE_TYPE_PARAM_VALUE: (None, 'type_param_value_change_list'),
+    CHANGE_ELEMENT_ADDED: ('new_elem_count', None),
+    CHANGE_ELEMENT_DELETED: ('del_elem_count', None),
+    CHANGE_ELEMENT_RECREATED: ('recreated_elem_count', None)
+}
+
+class ChangeSummary(object):
+    """
+    Accumulates summary statistics from (combined) change records, in total and per category.
+    Records can be added incrementally, so the summary also works for streamed comparisons.
+    """
+
+    def __init__(self):
+        self.total = self._new_stats()
+        self.categories = {}
+        self.category_order = []
+        self.seen_types = set()  # (category, type_id) already counted
+
+    @staticmethod
+    def _new_stats():
+        stats = {'changed_type_count': 0, 'changed_type_instance_count': 0}
+        for count_key, list_key in SUMMARY_KEYS.values():
+            if count_key:
+                stats[count_key] = 0
+            if list_key:
+                stats[list_key] = set()
+        return stats
+
+    def add(self, record):
+        cat = record.category
+        cat_stats = self.categories.get(cat)
+        if cat_stats is None:
+            cat_stats = self.categories[cat] = self._new_stats()
+            self.category_order.append(cat)
+        if record.kind == CHANGE_TYPE:
+            self._add_type_change(cat, cat_stats, record.type_change)
+            return
+        count_key, list_key = SUMMARY_KEYS[record.kind]
+        for stats in (self.total, cat_stats):
+            if count_key:
+                stats[count_key] += 1
+            else:
+                stats[list_key].add(record.parameter)
+
+    def _add_type_change(self, cat, cat_stats, type_change):
+        for scope, stats in ((None, self.total), (cat, cat_stats)):
+            stats['changed_type_instance_count'] += 1
+            if (scope, type_change.type_id) in self.seen_types:
+                continue
+            self.seen_types.add((scope, type_change.type_id))
+            stats['changed_type_count'] += 1
+            for type_record in type_change.records:
+                stats[SUMMARY_KEYS[type_record.kind][1]].add(type_record.parameter)
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    @staticmethod
+    def _finish(stats):
+        result = {}
+        for key, value in stats.items():
+            if isinstance(value, set):
+                result[key] = sorted(value)
+                result[key.replace('_list', '_count')] = len(value)
+            else:
+                result[key] = value
+        return result
+
+    def totals(self):
+        return self._finish(self.total)
+
+    def by_category(self):
+        return [(cat, self._finish(self.categories[cat])) for cat in self.category_order]
+
+def write_summary_by_category_csv(csv_path, summary_by_cat):
+    with open(csv_path, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=SUMMARY_FIELDNAMES, lineterminator='\n')
+        writer.writeheader()
+        for cat, stats in summary_by_cat:
+            row = dict(stats)
+            row['category'] = cat
+            for key in SUMMARY_FIELDNAMES:
+                if key.endswith('_list'):
+                    row[key] = ', '.join(row[key])
+            writer.writerow(row)
+
+def print_summary(summary):
+    print("\n--- Model Comparison Summary ---")
+    print("1. Number of XY coordination move: {}".format(summary['xy_move_count']))
+    print("2. Number of Z coordination move: {}".format(summary['z_move_count']))
+    print("3. Number of new parameter added: {}".format(summary['new_param_count']))
+    if summary['new_param_list']:
+        print("   List of new parameters added:")
+        for pname in summary['new_param_list']:
+            print("     - {}".format(pname))
+    print("4. Number of parameter deleted: {}".format(summary['del_param_count']))
+    if summary['del_param_list']:
+        print("   List of deleted parameters:")
+        for pname in summary['del_param_list']:
+            print("     - {}".format(pname))
+    print("5. Number of parameter value change: {}".format(summary['param_value_change_count']))
+    if summary['param_value_change_list']:
+        print("   List of parameter value changes:")
+        for pname in summary['param_value_change_list']:
+            print("     - {}".format(pname))
+    print("6. Number of new element added: {}".format(summary['new_elem_count']))
+    print("7. Number of element deleted: {}".format(summary['del_elem_count']))
+    print("8. Number of changed types: {} ({} instances affected)".format(summary['changed_type_count'], summary['changed_type_instance_count']))
+    print("9. Number of re-created elements: {}".format(summary['recreated_elem_count']))
+
+def print_summary_by_category(summary_by_cat):
+    print("\n--- Model Comparison Summary by Category ---")
+    for cat, summary in summary_by_cat:
+        print("\nCategory: {}".format(cat))
+        print("  1. Number of XY coordination move: {}".format(summary['xy_move_count']))
+        print("  2. Number of Z coordination move: {}".format(summary['z_move_count']))
+        print("  3. Number of new parameter added: {}".format(summary['new_param_count']))
+        if summary['new_param_list']:
+            print("     List of new parameters added:")
+            for pname in summary['new_param_list']:
+                print("       - {}".format(pname))
+        print("  4. Number of parameter deleted: {}".format(summary['del_param_count']))
+        if summary['del_param_list']:
+            print("     List of deleted parameters:")
+            for pname in summary['del_param_list']:
+                print("       - {}".format(pname))
+        print("  5. Number of parameter value change: {}".format(summary['param_value_change_count']))
+        if summary['param_value_change_list']:
+            print("     List of parameter value changes:")
+            for pname in summary['param_value_change_list']:
+                print("       - {}".format(pname))
+        print("  6. Number of new element added: {}".format(summary['new_elem_count']))
+        print("  7. Number of element deleted: {}".format(summary['del_elem_count']))
+        print("  8. Number of changed types: {} ({} instances affected)".format(summary['changed_type_count'], summary['changed_type_instance_count']))
+        print("  9. Number of re-created elements: {}".format(summary['recreated_elem_count']))
+
+def export_summary(folder, change_summary):
+    """Prints the summary and the summary by category, and writes the summary by category CSV."""
+    print_summary(change_summary.totals())
+    summary_by_cat = change_summary.by_category()
+    csv_path_summary_cat = os.path.join(folder, "model_comparison_summary_by_category.csv")
+    write_summary_by_category_csv(csv_path_summary_cat, summary_by_cat)
+    print("Summary by category exported to: {}".format(csv_path_summary_cat))
+    print_summary_by_category(summary_by_cat)
+    return csv_path_summary_cat
+
+# --- Comparison pipeline ---
+# A comparison runs as a graph of stages: extract -> diff -> combine -> aggregate -> export -> write-back.
+# Each stage runs at most once; its result is memoized and shared by every stage that requires it, so
+# e.g. the combined records feed the summary, the CSVs and the write-back without being rebuilt.
+STAGE_EXTRACT_PREVIOUS = 'extract previous'
+STAGE_EXTRACT_LATEST = 'extract latest'
+STAGE_DIFF = 'diff'
+STAGE_COMBINE = 'combine'
+STAGE_AGGREGATE = 'aggregate'
+STAGE_EXPORT = 'export'
+STAGE_WRITE_BACK = 'write-back'
+
+class ComparisonPipeline(object):
+    """
+    Runs named stages on demand. A stage is a function of the results of the stages it requires;
+    its own run time (without the stages it requires) is recorded for print_timings.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.results = {}
+        self.timings = []
+
+    def add_stage(self, name, func, requires=()):
+        self.stages[name] = (func, list(requires))
+        return self
+
+    def set_result(self, name, result):
+        """Provides the result of a stage that was computed elsewhere (e.g. data loaded from a snapshot)."""
+        self.results[name] = result
+        return self
+
+    def get(self, name):
+        if name in self.results:
+            return self.results[name]
+        if name not in self.stages:
+            raise KeyError("Unknown pipeline stage: {}".format(name))
+        func, requires = self.stages[name]
+        inputs = [self.get(required) for required in requires]
+        t0 = time.time()
+        result = func(*inputs)
+        self.timings.append((name, time.time() - t0))
+        self.results[name] = result
+        return result
+
+    def run(self, *names):
+        return [self.get(name) for name in names]
+
+    def print_timings(self):
+        print("\n--- Stage timings ---")
+        for name, seconds in self.timings:
+            print("  {}: {:.2f}s".format(name, seconds))
+        print("  total: {:.2f}s".format(sum(seconds for _, seconds in self.timings)))
+
+def add_compare_stages(pipeline, analysis_items, folder, compare_date, element_ids=None):
+    """
+    Adds the diff, combine, aggregate and export stages for extracted model data held in memory.
+    The extract stages must return (xyz_data, param_data, elements_data, hashes).
+    element_ids optionally limits the diff to those elements (see diff_model_data).
+    The export stage writes every CSV once and returns the combined result rows.
+    """
+    def export(results, combined_records, change_summary):
+        export_analysis_results(folder, results, analysis_items, compare_date)
+        combined_results = export_combined_results(folder, combined_records, compare_date)
+        export_summary(folder, change_summary)
+        return combined_results
+
+    pipeline.add_stage(STAGE_DIFF, lambda prev, latest: diff_model_data(prev, latest, analysis_items, element_ids),
+                       [STAGE_EXTRACT_PREVIOUS, STAGE_EXTRACT_LATEST])
+    pipeline.add_stage(STAGE_COMBINE, combine_model_results, [STAGE_DIFF])
+    pipeline.add_stage(STAGE_AGGREGATE, lambda combined_records: ChangeSummary().add_all(combined_records), [STAGE_COMBINE])
+    pipeline.add_stage(STAGE_EXPORT, export, [STAGE_DIFF, STAGE_COMBINE, STAGE_AGGREGATE])
+    return pipeline
+
+# --- Quick estimate (sketches) ---
+# A cheap pass hashes each element twice: its id alone, and its id with family/type and quantized location.
+# Per category only the SKETCH_SIZE smallest hashes of each kind are kept (bottom-k sketches). Comparing
+# the sketches of two models estimates the Jaccard similarity of their id sets (-> added/deleted) and of
+# their content sets (-> modified), without a full comparison.
+SKETCH_SIZE = 256
+
+def _bottom_k_add(heap, value, k):
+    # Max-heap of the k smallest values, stored negated
+    if len(heap) < k:
+        heapq.heappush(heap, -value)
+    elif value < -heap[0]:
+        heapq.heapreplace(heap, -value)
+
+class ModelSketch(object):
+    """Per-category element counts and bottom-k sketches of element id hashes and element content hashes."""
+
+    def __init__(self, k=SKETCH_SIZE):
+        self.k = k
+        self.categories = {}  # {category: [element_count, id_heap, content_heap]}
+
+    def add(self, eid, category, content_hash):
+        entry = self.categories.get(category)
+        if entry is None:
+            entry = self.categories[category] = [0, [], []]
+        entry[0] += 1
+        _bottom_k_add(entry[1], _hash_parts([u'%d' % eid]), self.k)
+        _bottom_k_add(entry[2], _hash_parts([u'%d' % eid, u'%x' % content_hash]), self.k)
+
+    def get(self, category):
+        """Returns (element_count, sorted id hashes, sorted content hashes) of a category."""
+        entry = self.categories.get(category)
+        if entry is None:
+            return 0, [], []
+        return entry[0], sorted(-v for v in entry[1]), sorted(-v for v in entry[2])
+
+    def to_json(self):
+        return {'k': self.k, 'categories': [[cat] + list(self.get(cat)) for cat in self.categories]}
+
+    @staticmethod
+    def from_json(data):
+        sketch = ModelSketch(data['k'])
+        for cat, count, id_hashes, content_hashes in data['categories']:
+            sketch.categories[cat] = [count, [-v for v in id_hashes], [-v for v in content_hashes]]
+            heapq.heapify(sketch.categories[cat][1])
+            heapq.heapify(sketch.categories[cat][2])
+        return sketch
+
+def estimate_jaccard(a_hashes, b_hashes, k):
+    """
+    Estimates the Jaccard similarity of two sets from their sorted bottom-k sketches.
+    Returns (similarity, standard_error); the error is 0 when the sketches hold the complete sets.
+    """
+    union = sorted(set(a_hashes) | set(b_hashes))[:k]
+    if not union:
+        return 1.0, 0.0
+    a_set = set(a_hashes)
+    b_set = set(b_hashes)
+    shared = sum(1 for v in union if v in a_set and v in b_set)
+    similarity = float(shared) / len(union)
+    if len(union) < k:
+        return similarity, 0.0
+    return similarity, (similarity * (1 - similarity) / len(union)) ** 0.5
+
+def _estimate_overlap(a_hashes, b_hashes, a_count, b_count, k):
+    """Estimates |A & B| from the Jaccard similarity; returns (overlap, 95% margin)."""
+    similarity, error = estimate_jaccard(a_hashes, b_hashes, k)
+    total = a_count + b_count
+    overlap = similarity * total / (1 + similarity)
+    margin = 1.96 * error * total / (1 + similarity) ** 2
+    return overlap, margin
+
+def estimate_changes(prev_sketch, latest_sketch, categories):
+    """
+    Returns [(category, stats)] with estimated 'added', 'deleted' and 'modified' element counts and
+    their 95% margins ('added_margin', ...), and the exact 'previous_count' and 'latest_count'.
+    """
+    k = min(prev_sketch.k, latest_sketch.k)
+    result = []
+    for cat in categories:
+        prev_count, prev_ids, prev_content = prev_sketch.get(cat)
+        latest_count, latest_ids, latest_content = latest_sketch.get(cat)
+        if not prev_count and not latest_count:
+            continue
+        common, common_margin = _estimate_overlap(prev_ids[:k], latest_ids[:k], prev_count, latest_count, k)
+        unchanged, unchanged_margin = _estimate_overlap(prev_content[:k], latest_content[:k], prev_count, latest_count, k)
+        result.append((cat, {
+            'previous_count': prev_count,
+            'latest_count': latest_count,
+            'deleted': max(0.0, prev_count - common),
+            'added': max(0.0, latest_count - common),
+            'modified': max(0.0, common - unchanged),
+            'deleted_margin': common_margin,
+            'added_margin': common_margin,
+            'modified_margin': (common_margin ** 2 + unchanged_margin ** 2) ** 0.5
+        }))
+    return result
+
+ESTIMATE_FIELDNAMES = ['category', 'previous_count', 'latest_count', 'added', 'added_margin', 'deleted', 'deleted_margin',
+                       'modified', 'modified_margin']
+
+def write_estimate_csv(csv_path, estimates):
+    with open(csv_path, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=ESTIMATE_FIELDNAMES, lineterminator='\n')
+        writer.writeheader()
+        for cat, stats in estimates:
+            row = dict((key, int(round(value))) for key, value in stats.items())
+            row['category'] = cat
+            writer.writerow(row)
+
+def print_estimate(estimates, k):
+    print("\n--- Quick Estimate (bottom-{} sketches, 95% bounds) ---".format(k))
+    for cat, stats in estimates:
+        print("\nCategory: {} ({} -> {} elements)".format(cat, stats['previous_count'], stats['latest_count']))
+        # Added elements as a share of the latest model, deleted and modified ones of the previous model
+        for key, label, base in (('added', 'added', stats['latest_count']), ('deleted', 'deleted', stats['previous_count']),
+                                 ('modified', 'modified (moved or family/type changed)', stats['previous_count'])):
+            print("  Elements {}: ~{} +/- {} ({:.1f}%)".format(label, int(round(stats[key])), int(round(stats[key + '_margin'])),
+                                                            100.0 * stats[key] / max(base, 1)))
+
+# --- Streaming comparison ---
+# For very large models the data of both models does not fit in memory at once. In streaming mode
+# each model is spilled to a file of JSON lines sorted by element id while it is extracted, and the
+# two files are merge-joined in element id order, writing result rows as they are produced.
+SPILL_CHUNK_SIZE = 50000
+
+class CsvRows(object):
+    """Re-iterable rows of a CSV file, read lazily on each iteration."""
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+
+    def __iter__(self):
+        with open(self.csv_path, 'r') as csvfile:
+            for row in csv.DictReader(csvfile):
+                yield row
+
+def _write_spill_run(records, run_path):
+    records.sort(key=lambda r: r[0])
+    with open(run_path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write('\n')
+
+def _iter_spill_run(run_path):
+    with open(run_path, 'r') as f:
+        for line in f:
+            # Decorate with the element id so runs can be merged by heapq.merge
+            yield int(line[1:line.index(',')]), line
+
+def spill_element_data(element_data, type_params, spill_path, chunk_size=SPILL_CHUNK_SIZE):
+    """
+    Writes element data, as yielded by the extraction ((element_id, family_and_type, category, xyz, parameters,
+    type_key) tuples), to spill_path as one JSON line per element, sorted by element id:
+    [element_id, family_and_type, category, xyz, parameters, type_key, content_hash].
+    Records are sorted in chunks of chunk_size and the sorted runs are merged, so memory stays bounded.
+    type_params ({type_key: {param_name: param_value}}, filled while element_data is consumed) is written to
+    spill_path + '.types'.
+    """
+    hasher = ContentHasher(type_params)
+    run_paths = []
+    records = []
+    for eid, fam_type, category, xyz, params, type_key in element_data:
+        content_hash = hasher.element_hash(fam_type, category, xyz, params, type_key)
+        records.append([eid, fam_type, category, list(xyz) if xyz else None, params, type_key, content_hash])
+        if len(records) >= chunk_size:
+            run_paths.append('{}.run{}'.format(spill_path, len(run_paths)))
+            _write_spill_run(records, run_paths[-1])
+            records = []
+    if records or not run_paths:
+        run_paths.append('{}.run{}'.format(spill_path, len(run_paths)))
+        _write_spill_run(records, run_paths[-1])
+    del records
+    if len(run_paths) == 1:
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+        os.rename(run_paths[0], spill_path)
+    else:
+        with open(spill_path, 'w') as f:
+            for _, line in heapq.merge(*[_iter_spill_run(p) for p in run_paths]):
+                f.write(line)
+        for run_path in run_paths:
+            os.remove(run_path)
+    with open(spill_path + '.types', 'w') as f:
+        json.dump([[k, v] for k, v in type_params.items()], f)
+    return spill_path
+
+def iter_spill_records(spill_path):
+    """
+    Yields (element_id, family_and_type, category, xyz, parameters, type_key, content_hash) from a spill file,
+    in element id order.
+    """
+    with open(spill_path, 'r') as f:
+        for line in f:
+            eid, fam_type, category, xyz, params, type_key, content_hash = json.loads(line)
+            yield eid, fam_type, category, tuple(xyz) if xyz else None, params, type_key, content_hash
+
+def load_spill_types(spill_path):
+    with open(spill_path + '.types', 'r') as f:
+        return dict((k, v) for k, v in json.load(f))
+
+def remove_spill_file(spill_path):
+    for path in (spill_path, spill_path + '.types'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def merge_join(prev_records, latest_records):
+    """
+    Merge-joins two record streams sorted by element id (first item of each record).
+    Yields (element_id, prev_record, latest_record); the record missing on one side is None.
+    """
+    prev_iter = iter(prev_records)
+    latest_iter = iter(latest_records)
+    prev = next(prev_iter, None)
+    latest = next(latest_iter, None)
+    while prev is not None or latest is not None:
+        if latest is None or (prev is not None and prev[0] < latest[0]):
+            yield prev[0], prev, None
+            prev = next(prev_iter, None)
+        elif prev is None or latest[0] < prev[0]:
+            yield latest[0], None, latest
+            latest = next(latest_iter, None)
+        else:
+            yield prev[0], prev, latest
+            prev = next(prev_iter, None)
+            latest = next(latest_iter, None)
+
+def stream_compare(prev_spill, latest_spill, analysis_items, folder):
+    """
+    Merge-joins two spill files and writes the per-analysis and combined result CSVs incrementally.
+    The summary is accumulated from the combined change records as they are produced.
+    Deleted and new elements are held back until the end, so they can be matched as re-created elements.
+    Returns (combined_csv_path, {analysis_item: row_count}, ChangeSummary).
+    """
+    want_xyz = ANALYSIS_XYZ in analysis_items
+    want_params = ANALYSIS_PARAMS in analysis_items
+    want_elements = ANALYSIS_ELEMENTS in analysis_items
+    prev_types = load_spill_types(prev_spill) if want_params else {}
+    latest_types = load_spill_types(latest_spill) if want_params else {}
+    type_changes = diff_types(prev_types, latest_types)
+    compare_date = get_compare_date()
+    summary = ChangeSummary()
+    outputs = [(item, item in analysis_items, file_name) for item, file_name, _ in ANALYSIS_RESULT_FILES]
+    outputs.append((None, True, "model_comparison_combined_results.csv"))
+    files = {}
+    writers = {}
+    counts = dict((item, 0) for item, wanted, _ in outputs if wanted)
+    records_file = records_writer = None
+    try:
+        for item, wanted, file_name in outputs:
+            if not wanted:
+                continue
+            files[item] = open(os.path.join(folder, file_name), 'w')
+            writers[item] = csv.DictWriter(files[item], fieldnames=COMPARE_FIELDNAMES, lineterminator='\n')
+            writers[item].writeheader()
+        if EXPORT_CHANGE_RECORDS_CSV:
+            records_file = open(os.path.join(folder, "model_comparison_change_records.csv"), 'w')
+            records_writer = ChangeRecordWriter(records_file, compare_date)
+
+        def write_element(analysis_records, combined=True):
+            element_records = []
+            for item, records in analysis_records:
+                if records:
+                    writers[item].writerow(render_element_row(records, compare_date))
+                    counts[item] += 1
+                    element_records.extend(records)
+            if element_records and combined:
+                element_records = combine_element_records(element_records)
+                writers[None].writerow(render_element_row(element_records, compare_date))
+                counts[None] += 1
+                summary.add_all(element_records)
+                if records_writer:
+                    for record in element_records:
+                        records_writer.write(record)
+
+        match_recreated = want_elements and MATCH_RECREATED_ELEMENTS
+        pending = []  # (element_id, spill record, is_deleted, analysis_records) of deleted and new elements
+        for eid, prev, latest in merge_join(iter_spill_records(prev_spill), iter_spill_records(latest_spill)):
+            if prev and latest and prev[6] == latest[6]:
+                # Same content hash: nothing to diff
+                continue
+            analysis_records = []
+            if want_xyz and prev and latest and prev[3] and latest[3]:
+                analysis_records.append((ANALYSIS_XYZ, diff_xyz(eid, (prev[1], prev[2], prev[3]), (latest[1], latest[2], latest[3]))))
+            if want_params:
+                prev_info = latest_info = None
+                if prev:
+                    prev_info = {'family_and_type': prev[1], 'category': prev[2], 'parameters': prev[4], 'type_parameters': prev_types.get(prev[5], {}), 'type_id': prev[5]}
+                if latest:
+                    latest_info = {'family_and_type': latest[1], 'category': latest[2], 'parameters': latest[4], 'type_parameters': latest_types.get(latest[5], {}), 'type_id': latest[5]}
+                param_records = diff_params(eid, prev_info, latest_info, type_changes)
+                count_type_instances(param_records)
+                analysis_records.append((ANALYSIS_PARAMS, param_records))
+            if want_elements:
+                analysis_records.append((ANALYSIS_ELEMENTS, diff_element(eid, prev and prev[:4], latest and latest[:4])))
+            if match_recreated and not (prev and latest):
+                pending.append((eid, prev or latest, latest is None, analysis_records))
+            else:
+                write_element(analysis_records)
+        if pending:
+            pairs = match_recreated_elements([p[1][:4] for p in pending if p[2]], [p[1][:4] for p in pending if not p[2]])
+            recreated = dict((deleted_entry[0], recreated_record(deleted_entry, added_entry, distance_mm))
+                             for deleted_entry, added_entry, distance_mm in pairs)
+            recreated_new_ids = set(added_entry[0] for _, added_entry, _ in pairs)
+            for eid, _, is_deleted, analysis_records in pending:
+                if not is_deleted and eid in recreated_new_ids:
+                    # Only reported in the per-analysis CSVs, like combine_comparison_results does
+                    write_element([(item, records) for item, records in analysis_records if item != ANALYSIS_ELEMENTS], combined=False)
+                    continue
+                if is_deleted and eid in recreated:
+                    analysis_records = [(item, [recreated[eid]] if item == ANALYSIS_ELEMENTS else records)
+                                        for item, records in analysis_records]
+                write_element(analysis_records)
+        if records_writer:
+            records_writer.close()
+        return os.path.join(folder, "model_comparison_combined_results.csv"), counts, summary
+    finally:
+        for f in files.values():
+            f.close()
+        if records_file:
+            records_file.close()
+
+def add_stream_stages(pipeline, analysis_items, folder):
+    """
+    Adds the stages for spilled model data (see spill_element_data); the extract stages must return spill paths.
+    The merge-join diffs, combines, aggregates and writes the result CSVs in one pass, so the later stages only
+    unpack its result. The export stage returns the combined result rows, read back from the CSV.
+    """
+    def export(stream_result, change_summary):
+        csv_path_combined, stream_counts, _ = stream_result
+        for item, count in sorted(stream_counts.items(), key=lambda kv: str(kv[0])):
+            print("{}: {} result rows".format(item or "Combined", count))
+        print("Combined model comparison results exported to: {}".format(csv_path_combined))
+        export_summary(folder, change_summary)
+        return CsvRows(csv_path_combined)
+
+    pipeline.add_stage(STAGE_DIFF, lambda prev, latest: stream_compare(prev, latest, analysis_items, folder),
+                       [STAGE_EXTRACT_PREVIOUS, STAGE_EXTRACT_LATEST])
+    pipeline.add_stage(STAGE_AGGREGATE, lambda stream_result: stream_result[2], [STAGE_DIFF])
+    pipeline.add_stage(STAGE_EXPORT, export, [STAGE_DIFF, STAGE_AGGREGATE])
+    return pipeline
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# Opening models in the background for batch work. An open profile decides how much of a model Revit
+# loads: detaching from central, which worksets are opened, auditing and linked models. Opening is
+# usually the largest cost of a run, so every open is timed and logged.
+import os
+import json
+import time
+
+DETACH_NONE = 'none'  # Open the file as it is (a central model is opened as central)
+DETACH_PRESERVE = 'preserve'  # Detach from central and keep the worksets
+DETACH_DISCARD = 'discard'  # Detach from central and discard the worksets: everything is loaded
+WORKSETS_ALL = 'all'
+WORKSETS_CATEGORIES = 'categories'  # Only worksets known to hold the categories: may miss elements (see workset usage below)
+LINKS_CATEGORY = 'RVT Links'  # Workset usage key of link instances
+WORKSET_USAGE_FILE = 'workset_usage.json'
+WORKSET_USAGE_MAX_AGE = 10  # Opens of a project after which a workset's counts are relearned
+
+class OpenProfile(object):
+    """
+    How to open a model:
+    detach: DETACH_NONE, DETACH_PRESERVE or DETACH_DISCARD (only used for workshared models)
+    worksets: WORKSETS_ALL, or WORKSETS_CATEGORIES (faster, but may miss elements added to a workset learned as empty)
+    audit: audit the model while opening (slow)
+    unload_links: keep worksets that only hold link instances closed, so their linked models are not loaded
+    """
+
+    def __init__(self, detach=DETACH_PRESERVE, worksets=WORKSETS_ALL, audit=False, unload_links=True):
+        self.detach = detach
+        self.worksets = worksets
+        self.audit = audit
+        self.unload_links = unload_links
+
+    def links_unloaded(self):
+        return self.unload_links and self.worksets == WORKSETS_CATEGORIES and self.detach != DETACH_DISCARD
+
+    def describe(self):
+        return 'detach {}, {} worksets, audit {}, links {}'.format(
+            self.detach, self.worksets, 'on' if self.audit else 'off', 'unloaded' if self.links_unloaded() else 'loaded')
+
+# --- Workset usage ---
+# Before a model is opened Revit only tells which worksets it has, not what they hold. The categories
+# each workset holds are therefore learned whenever a model is opened and remembered per project; the
+# project is the central model path, so weekly issues detached from the same central share one record.
+# A workset is opened if it is known to hold one of the wanted categories, or if it has not been checked
+# for all of them yet (unknown worksets are always opened).
+# Only open worksets can be counted, so a closed workset's counts would never change even when elements
+# of a wanted category are added to it later. Counts therefore expire: each project record counts the
+# opens, and a workset learned WORKSET_USAGE_MAX_AGE or more opens ago is opened (and relearned) again.
+# Until then such elements are not loaded, and Revit cannot count what a closed workset holds, so
+# WORKSETS_CATEGORIES is only for callers that can afford to miss them; the default opens all worksets.
+def get_workset_usage_path():
+    import tempfile
+    base = os.environ.get('APPDATA') or tempfile.gettempdir()
+    folder = os.path.join(base, 'PyCharles')
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    return os.path.join(folder, WORKSET_USAGE_FILE)
+
+def load_workset_usage():
+    path = get_workset_usage_path()
+    try:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        print("Error loading workset usage:", e)
+    return {}
+
+def save_workset_usage(usage):
+    try:
+        with open(get_workset_usage_path(), 'w') as f:
+            json.dump(usage, f)
+    except Exception as e:
+        print("Error saving workset usage:", e)
+
+def get_project_key(model_path, file_info):
+    central_path = file_info.CentralPath if file_info is not None else None
+    return os.path.normcase(central_path or os.path.dirname(os.path.abspath(model_path)))
+
+def get_project_usage(usage, project_key):
+    """
+    Returns the record of a project in usage: {'opens': number of opens, 'worksets': {workset_name:
+    {'learned': opens when learned, 'counts': {category_name: element_count}}}}.
+    Records of the earlier format (plain counts, without ages) are dropped: their worksets are relearned.
+    """
+    project_usage = usage.get(project_key)
+    if not isinstance(project_usage, dict) or 'worksets' not in project_usage:
+        project_usage = usage[project_key] = {'opens': 0, 'worksets': {}}
+    return project_usage
+
+def select_worksets(workset_names, project_usage, wanted_categories, max_age=WORKSET_USAGE_MAX_AGE):
+    """
+    Returns the names of the worksets to open: those known to hold one of the wanted categories,
+    those not yet checked for all of them, and those whose counts are max_age or more opens old.
+    """
+    opens = project_usage['opens']
+    worksets = project_usage['worksets']
+    selected = []
+    for name in workset_names:
+        record = worksets.get(name)
+        if record is None or opens - record['learned'] >= max_age:
+            selected.append(name)
+            continue
+        counts = record['counts']
+        if any(counts.get(category, 1) > 0 for category in wanted_categories):
+            selected.append(name)
+    return selected
+
+def record_workset_usage(project_usage, workset_counts):
+    """
+    Counts an open of the project and stores the counts of its open worksets:
+    workset_counts: {workset_name: {category_name: element_count}}.
+    """
+    project_usage['opens'] += 1
+    for name, counts in workset_counts.items():
+        # Counts of categories not read this time are dropped with the old record, as they would look fresh
+        project_usage['worksets'][name] = {'learned': project_usage['opens'], 'counts': dict(counts)}
+
+def learn_workset_usage(doc, project_usage, category_ids):
+    """
+    Counts the elements of each category ({category_id (int): category_name}) in each open user workset
+    of doc, and records them in project_usage (see record_workset_usage).
+    """
+    from Autodesk.Revit.DB import (FilteredWorksetCollector, FilteredElementCollector, WorksetKind, ElementWorksetFilter,
+                                   ElementCategoryFilter, ElementId)
+    workset_counts = {}
+    for workset in FilteredWorksetCollector(doc).OfKind(WorksetKind.UserWorkset):
+        if not workset.IsOpen:
+            continue
+        counts = workset_counts[workset.Name] = {}
+        workset_filter = ElementWorksetFilter(workset.Id)
+        for category_id, category_name in category_ids.items():
+            counts[category_name] = FilteredElementCollector(doc).WherePasses(workset_filter) \
+                .WherePasses(ElementCategoryFilter(ElementId(category_id))).WhereElementIsNotElementType().GetElementCount()
+    record_workset_usage(project_usage, workset_counts)
+
+def get_file_info(model_path):
+    from Autodesk.Revit.DB import BasicFileInfo
+    try:
+        return BasicFileInfo.Extract(model_path)
+    except Exception:
+        return None
+
+class OpenPlan(object):
+    """The options to open a model with, and the user worksets they open (None: all worksets, or not workshared)."""
+
+    def __init__(self, model_path, profile, options, worksets, learn=None):
+        self.model_path = model_path
+        self.profile = profile
+        self.options = options
+        self.worksets = worksets
+        self.learn = learn  # (usage, project_usage, category_ids) to update after opening, or None
+        self.note = ''
+
+def plan_open(model_path, profile=None, category_ids=None):
+    """
+    Prepares the OpenOptions for a model. category_ids ({category_id (int): category_name}) are the categories
+    the caller reads; with WORKSETS_CATEGORIES only the worksets holding them are opened.
+    Without category_ids all worksets are opened.
+    """
+    from Autodesk.Revit.DB import (ModelPathUtils, OpenOptions, DetachFromCentralOption, WorksetConfiguration,
+                                   WorksetConfigurationOption, WorksharingUtils, WorksetId, BuiltInCategory)
+    from System.Collections.Generic import List
+    profile = profile or OpenProfile()
+    options = OpenOptions()
+    options.Audit = profile.audit
+    plan = OpenPlan(model_path, profile, options, None)
+    file_info = get_file_info(model_path)
+    if file_info is None or not file_info.IsWorkshared:
+        return plan
+    options.DetachFromCentralOption = {
+        DETACH_NONE: DetachFromCentralOption.DoNotDetach,
+        DETACH_PRESERVE: DetachFromCentralOption.DetachAndPreserveWorksets,
+        DETACH_DISCARD: DetachFromCentralOption.DetachAndDiscardWorksets
+    }[profile.detach]
+    if profile.detach != DETACH_DISCARD and profile.worksets == WORKSETS_CATEGORIES and category_ids:
+        learn_ids = dict(category_ids)
+        learn_ids[int(BuiltInCategory.OST_RvtLinks)] = LINKS_CATEGORY
+        wanted = list(category_ids.values())
+        if not profile.links_unloaded():
+            wanted.append(LINKS_CATEGORY)
+        usage = load_workset_usage()
+        project_usage = get_project_usage(usage, get_project_key(model_path, file_info))
+        model_path_obj = ModelPathUtils.ConvertUserVisiblePathToModelPath(model_path)
+        previews = list(WorksharingUtils.GetUserWorksetInfo(model_path_obj))
+        selected = set(select_worksets([p.Name for p in previews], project_usage, wanted))
+        config = WorksetConfiguration(WorksetConfigurationOption.CloseAllWorksets)
+        config.Open(List[WorksetId]([p.Id for p in previews if p.Name in selected]))
+        options.SetOpenWorksetsConfiguration(config)
+        plan.worksets = selected
+        plan.learn = (usage, project_usage, learn_ids)
+        plan.note = ', {} of {} worksets'.format(len(selected), len(previews))
+    return plan
+
+def open_planned(app, plan, label=None):
+    from Autodesk.Revit.DB import ModelPathUtils
+    t0 = time.time()
+    doc = app.OpenDocumentFile(ModelPathUtils.ConvertUserVisiblePathToModelPath(plan.model_path), plan.options)
+    print('Open {}: {:.2f}s ({}{})'.format(label or os.path.basename(plan.model_path), time.time() - t0,
+                                          plan.profile.describe(), plan.note))
+    if plan.learn:
+        usage, project_usage, learn_ids = plan.learn
+        learn_workset_usage(doc, project_usage, learn_ids)
+        save_workset_usage(usage)
+    return doc
+
+def open_model(app, model_path, profile=None, category_ids=None, label=None):
+    """Opens a model in the background with an open profile (default: OpenProfile()); see plan_open."""
+    return open_planned(app, plan_open(model_path, profile, category_ids), label)
+
+# --- Document pool ---
+# Opened documents are kept open for the rest of the Revit session, so rerunning a button (e.g. with
+# other categories) reuses them instead of opening the models again. Documents are keyed by file path
+# and file stamp (size, modified time): a document whose file changed on disk is closed on the next use.
+# Idle documents are closed, least recently used first, beyond POOL_MAX_DOCUMENTS or while Revit's
+# memory use is above POOL_MAX_MEMORY_BYTES.
+POOL_ENABLED = True
+POOL_MAX_DOCUMENTS = 4
+POOL_MAX_MEMORY_BYTES = 16 * 1024 * 1024 * 1024
+POOL_ENVVAR = 'PYCHARLES_DOCUMENT_POOL'
+
+def get_file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, int(st.st_mtime)]
+
+def get_process_memory():
+    try:
+        from System.Diagnostics import Process
+        return Process.GetCurrentProcess().WorkingSet64
+    except Exception:
+        return None
+
+class PooledDocument(object):
+
+    def __init__(self, doc, path, plan):
+        self.doc = doc
+        self.key = os.path.normcase(os.path.abspath(path))
+        self.stamp = get_file_stamp(path)
+        self.detach = plan.profile.detach
+        self.audit = plan.profile.audit
+        self.worksets = plan.worksets
+        self.in_use = True
+        self.last_used = time.time()
+
+    def matches(self, key, plan):
+        """True if the document can serve an open of the file at key with the plan."""
+        if self.in_use or self.key != key or self.detach != plan.profile.detach:
+            return False
+        if plan.profile.audit and not self.audit:
+            return False
+        if self.worksets is None:
+            return True
+        return plan.worksets is not None and plan.worksets <= self.worksets
+
+    def is_stale(self):
+        return not self.doc.IsValidObject or get_file_stamp(self.key) != self.stamp
+
+class DocumentPool(object):
+    """Documents opened by the buttons, kept open across button presses (see get_document_pool)."""
+
+    def __init__(self):
+        self.entries = []
+
+    def acquire(self, app, model_path, profile=None, category_ids=None, label=None):
+        """Returns an open document of the model, from the pool if possible; release it when done."""
+        label = label or os.path.basename(model_path)
+        self.evict_stale()
+        plan = plan_open(model_path, profile, category_ids)
+        key = os.path.normcase(os.path.abspath(model_path))
+        for entry in self.entries:
+            if entry.matches(key, plan):
+                entry.in_use = True
+                entry.last_used = time.time()
+                print('Reuse {} from the document pool'.format(label))
+                return entry.doc
+        doc = open_planned(app, plan, label)
+        self.entries.append(PooledDocument(doc, model_path, plan))
+        return doc
+
+    def release(self, doc, saved_path=None):
+        """
+        Returns a document to the pool. saved_path: the file the document was saved as (SaveAs), which
+        it is kept under from now on. A document with unsaved changes is closed, since it no longer
+        matches its file.
+        """
+        entry = self._find(doc)
+        if entry is None:
+            doc.Close(False)
+            return
+        entry.in_use = False
+        entry.last_used = time.time()
+        if not POOL_ENABLED or not doc.IsValidObject or doc.IsModified:
+            self._close(entry)
+            return
+        if saved_path:
+            entry.key = os.path.normcase(os.path.abspath(saved_path))
+            entry.stamp = get_file_stamp(saved_path)
+            entry.detach = DETACH_NONE  # The document is now that file itself
+        self.trim()
+
+    def discard(self, doc):
+        entry = self._find(doc)
+        if entry is not None:
+            self._close(entry)
+        else:
+            doc.Close(False)
+
+    def evict_stale(self):
+        for entry in list(self.entries):
+            if not entry.in_use and entry.is_stale():
+                print('Close {}: the file changed on disk'.format(os.path.basename(entry.key)))
+                self._close(entry)
+
+    def trim(self):
+        idle = sorted([e for e in self.entries if not e.in_use], key=lambda e: e.last_used)
+        while idle and len(self.entries) > POOL_MAX_DOCUMENTS:
+            self._close(idle.pop(0))
+        memory = get_process_memory()
+        while idle and memory is not None and memory > POOL_MAX_MEMORY_BYTES:
+            self._close(idle.pop(0))
+            memory = get_process_memory()
+
+    def clear(self):
+        for entry in [e for e in self.entries if not e.in_use]:
+            self._close(entry)
+
+    def _find(self, doc):
+        for entry in self.entries:
+            if entry.doc is doc or entry.doc == doc:
+                return entry
+        return None
+
+    def _close(self, entry):
+        self.entries.remove(entry)
+        try:
+            if entry.doc.IsValidObject:
+                entry.doc.Close(False)
+        except Exception as e:
+            print("Error closing {}: {}".format(os.path.basename(entry.key), e))
+
+_session_pool = None
+
+def get_document_pool():
+    """
+    Returns the document pool of the Revit session. It is kept in pyRevit's session environment
+    variables, which outlive the script engine of a single button press.
+    """
+    global _session_pool
+    try:
+        from pyrevit import script
+        pool = script.get_envvar(POOL_ENVVAR)
+        if pool is None:
+            pool = DocumentPool()
+            script.set_envvar(POOL_ENVVAR, pool)
+        return pool
+    except ImportError:
+        if _session_pool is None:
+            _session_pool = DocumentPool()
+        return _session_pool
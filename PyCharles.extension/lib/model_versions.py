@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Native change detection between versions of one document. From Revit 2023 documents keep a version
+# history: when the PREVIOUS model is an earlier version of the LATEST model (e.g. two saves of one cloud or
+# central model), the LATEST document reports the element ids created, deleted and modified since that
+# version (Document.GetChangedElements). Only those elements then need to be extracted and compared.
+# Whenever Revit cannot tell (older Revit, files that are not versions of one document, too many changes)
+# find_native_changes returns None and the full comparison runs.
+#
+#   changes = find_native_changes(doc_latest, get_file_version_guid(previous_path), expand_types)
+#   if changes is not None:
+#       ... extract and compare changes.element_ids() only
+from model_open import get_file_info
+
+NATIVE_CHANGES_MAX_ELEMENTS = 100000  # More changes than this: the full comparison is about as fast
+
+class NativeChanges(object):
+    """Element ids (integers) created, deleted and modified since the previous version."""
+
+    def __init__(self, created, deleted, modified, type_instances=None):
+        self.created = set(created)
+        self.deleted = set(deleted)
+        self.modified = set(modified)
+        self.type_instances = set(type_instances or [])  # Instances of modified types
+
+    def element_ids(self):
+        return sorted(self.created | self.deleted | self.modified | self.type_instances)
+
+    def describe(self):
+        return "{} created, {} deleted, {} modified, {} instances of modified types".format(
+            len(self.created), len(self.deleted), len(self.modified), len(self.type_instances))
+
+def get_file_version_guid(model_path):
+    """
+    Returns the version GUID saved in the model file (Revit 2023+), or None.
+    """
+    file_info = get_file_info(model_path)
+    try:
+        return file_info.GetDocumentVersion().VersionGUID
+    except Exception:
+        return None
+
+def _integer_ids(element_ids):
+    return [eid.IntegerValue for eid in element_ids]
+
+def find_native_changes(doc, previous_version, expand_types=None, max_elements=NATIVE_CHANGES_MAX_ELEMENTS):
+    """
+    Returns the NativeChanges of doc since the version previous_version (a GUID), or None if the full
+    comparison has to run; the reason is printed.
+    expand_types: optional function (doc, modified ids) returning the ids of the instances of modified
+    element types (their type parameters and names changed), or None if they cannot be found.
+    """
+    if previous_version is None:
+        print("Native change detection: the previous model has no version history (Revit 2023+ files only).")
+        return None
+    if not hasattr(doc, 'GetChangedElements'):
+        print("Native change detection: not available in this Revit version.")
+        return None
+    try:
+        changed = doc.GetChangedElements(previous_version)
+        changes = NativeChanges(_integer_ids(changed.GetCreatedElementIds()), _integer_ids(changed.GetDeletedElementIds()),
+                                _integer_ids(changed.GetModifiedElementIds()))
+    except Exception as e:
+        print("Native change detection: the models are not versions of one document ({}).".format(e))
+        return None
+    if expand_types is not None and changes.modified:
+        type_instances = expand_types(doc, sorted(changes.modified))
+        if type_instances is None:
+            print("Native change detection: too many modified types.")
+            return None
+        changes.type_instances = set(type_instances)
+    element_count = len(changes.element_ids())
+    if element_count > max_elements:
+        print("Native change detection: {} changed elements, more than {}.".format(element_count, max_elements))
+        return None
+    print("Native change detection: {}.".format(changes.describe()))
+    return changes
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Reading all parameters of many elements. Visiting elem.Parameters and catching an exception per value is
+# slow on IronPython, where every exception crossing from .NET is expensive. Elements of the same category
+# and type have the same parameters, so the parameters are learned once per type as a list of
+# (name, lookup key, value reader) fields, and the values of every other element of the type are read
+# through that list with elem.get_Parameter.
+#
+#   readers = ParameterReaderCache(VALUE_READERS)
+#   values = readers.read(elem)  # {param_name: value}
+#
+# A cache belongs to one document (it is keyed by element ids).
+
+# Autodesk.Revit.DB.StorageType values
+STORAGE_NONE = 0
+STORAGE_INTEGER = 1
+STORAGE_DOUBLE = 2
+STORAGE_STRING = 3
+STORAGE_ELEMENT_ID = 4
+INVALID_BUILT_IN_PARAMETER = -1
+
+def read_none(param):
+    return None
+
+def read_integer(param):
+    return param.AsInteger()
+
+def read_double(param):
+    return param.AsDouble()
+
+def read_string(param):
+    return param.AsString()
+
+def read_element_id(param):
+    return param.AsElementId().IntegerValue
+
+def read_value_string(param):
+    return param.AsValueString()
+
+def read_element_id_string(param):
+    return str(param.AsElementId().IntegerValue)
+
+# Storage type -> reader. Unknown storage types are read with AsValueString.
+VALUE_READERS = {
+    STORAGE_NONE: read_none,
+    STORAGE_INTEGER: read_integer,
+    STORAGE_DOUBLE: read_double,
+    STORAGE_STRING: read_string,
+    STORAGE_ELEMENT_ID: read_element_id
+}
+# Values as displayed in Revit (element ids as their number), e.g. for exports people read
+DISPLAY_READERS = {
+    STORAGE_NONE: read_value_string,
+    STORAGE_INTEGER: read_value_string,
+    STORAGE_DOUBLE: read_value_string,
+    STORAGE_STRING: read_value_string,
+    STORAGE_ELEMENT_ID: read_element_id_string
+}
+
+def get_parameter_key(param):
+    """
+    Returns what finds this parameter on another element with elem.get_Parameter:
+    the BuiltInParameter, else the shared parameter GUID, else the definition.
+    """
+    definition = param.Definition
+    built_in = getattr(definition, 'BuiltInParameter', None)
+    if built_in is not None and int(built_in) != INVALID_BUILT_IN_PARAMETER:
+        return built_in
+    if param.IsShared:
+        return param.GUID
+    return definition
+
+class TypeParameterReader(object):
+    """
+    Reads the learned parameters of one type. fields: [(name, key, reader)] in elem.Parameters order,
+    so a later parameter with the same name wins as it does when visiting elem.Parameters.
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def read(self, elem):
+        values = {}
+        get_parameter = elem.get_Parameter
+        for name, key, reader in self.fields:
+            param = get_parameter(key)
+            if param is not None:
+                values[name] = reader(param)
+        return values
+
+class ParameterReaderCache(object):
+    """
+    Type parameter readers of one document, keyed by (category id, type id, parameter count).
+    The parameter count is part of the key because some parameters only exist on some elements of a type
+    (e.g. depending on the host); elements with another count get a reader of their own.
+    readers: storage type -> reader, e.g. VALUE_READERS or DISPLAY_READERS
+    allows: optional function of a parameter name; parameters it rejects are never read
+    Untyped elements, and elements whose reader fails, are read by visiting elem.Parameters.
+    """
+
+    def __init__(self, readers=None, allows=None):
+        self.readers = readers if readers is not None else VALUE_READERS
+        self.allows = allows
+        self._type_readers = {}
+        self.fast_reads = 0
+        self.slow_reads = 0
+
+    def learn(self, elem):
+        fields = []
+        readers = self.readers
+        for param in elem.Parameters:
+            try:
+                name = param.Definition.Name
+                if self.allows is not None and not self.allows(name):
+                    continue
+                fields.append((name, get_parameter_key(param), readers.get(int(param.StorageType), read_value_string)))
+            except Exception:
+                pass
+        return TypeParameterReader(fields)
+
+    def read_all(self, elem):
+        """
+        Reads the parameters by visiting elem.Parameters; parameters that cannot be read are skipped.
+        """
+        self.slow_reads += 1
+        values = {}
+        readers = self.readers
+        for param in elem.Parameters:
+            try:
+                name = param.Definition.Name
+                if self.allows is not None and not self.allows(name):
+                    continue
+                values[name] = readers.get(int(param.StorageType), read_value_string)(param)
+            except Exception:
+                pass
+        return values
+
+    def read(self, elem, category_id=None, type_id=None):
+        """
+        Returns {param_name: value}. category_id and type_id (integer values) are looked up when not given;
+        a type_id of -1 means the element is untyped.
+        """
+        if type_id is None:
+            type_id = elem.GetTypeId().IntegerValue
+        if type_id < 0:
+            return self.read_all(elem)
+        if category_id is None:
+            category_id = elem.Category.Id.IntegerValue if elem.Category else None
+        key = (category_id, type_id, elem.Parameters.Size)
+        reader = self._type_readers.get(key)
+        if reader is None:
+            reader = self._type_readers[key] = self.learn(elem)
+        try:
+            values = reader.read(elem)
+        except Exception:
+            return self.read_all(elem)
+        self.fast_reads += 1
+        return values
+
+    def describe(self):
+        return '{} type readers, {} elements read by type, {} by visiting their parameters'.format(
+            len(self._type_readers), self.fast_reads, self.slow_reads)
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# The extension's lib folder is on sys.path of every pyRevit button; put it on the tests' path too.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'PyCharles.extension', 'lib'))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# The plain and numpy XYZ engines must produce the same records in the same (element id) order.
+import random
+
+import pytest
+
+import model_compare_core
+from model_compare_core import CompactXyzStore, compare_xyz_data
+
+np = pytest.importorskip('numpy')
+
+def make_stores(element_count=300, seed=1):
+    rng = random.Random(seed)
+    ids = list(range(1000, 1000 + element_count * 7, 7))
+    rng.shuffle(ids)  # Stores filled out of id order, as extraction does
+    prev_data = CompactXyzStore()
+    latest_data = CompactXyzStore()
+    for eid in ids:
+        xyz = (rng.uniform(-100, 100), rng.uniform(-100, 100), rng.uniform(0, 30))
+        prev_data[eid] = ('Family: Type {}'.format(eid % 5), 'Walls', xyz)
+        if eid % 11 == 0:
+            continue  # Deleted in the latest model
+        move = rng.random()
+        if move < 0.2:
+            xyz = (xyz[0] + 1.0, xyz[1], xyz[2])
+        elif move < 0.3:
+            xyz = (xyz[0], xyz[1] - 0.5, xyz[2] + 2.0)
+        elif move < 0.4:
+            xyz = (xyz[0], xyz[1], xyz[2] - 3.0)
+        latest_data[eid] = ('Family: Type {}'.format(eid % 5), 'Walls', xyz)
+    return prev_data, latest_data
+
+def record_rows(records):
+    return [(r.previous_element_id, r.current_element_id, r.previous_family_and_type, r.previous_category, r.kind,
+             round(r.distance, 6)) for r in records]
+
+def compare_with_engine(monkeypatch, engine, prev_data, latest_data, element_ids=None):
+    monkeypatch.setattr(model_compare_core, 'XYZ_ENGINE', engine)
+    return record_rows(compare_xyz_data(prev_data, latest_data, element_ids))
+
+def test_engines_agree_on_all_elements(monkeypatch):
+    prev_data, latest_data = make_stores()
+    python_rows = compare_with_engine(monkeypatch, 'python', prev_data, latest_data)
+    assert python_rows
+    assert python_rows == compare_with_engine(monkeypatch, 'numpy', prev_data, latest_data)
+
+def test_engines_agree_on_changed_ids(monkeypatch):
+    prev_data, latest_data = make_stores()
+    changed_ids = set(eid for eid in prev_data.keys() if eid % 3)
+    python_rows = compare_with_engine(monkeypatch, 'python', prev_data, latest_data, changed_ids)
+    assert python_rows
+    assert python_rows == compare_with_engine(monkeypatch, 'numpy', prev_data, latest_data, changed_ids)
+
+def test_records_in_element_id_order(monkeypatch):
+    prev_data, latest_data = make_stores()
+    plain_prev = dict(prev_data.items())
+    plain_latest = dict(latest_data.items())
+    rows = compare_with_engine(monkeypatch, 'python', plain_prev, plain_latest, set(plain_prev))
+    ids = [row[0] for row in rows]
+    assert ids == sorted(ids)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Native change detection without Revit: the stand-in documents fake Document.GetChangedElements.
+import model_versions
+from model_versions import NativeChanges, find_native_changes, get_file_version_guid
+
+# --- Stand-in document ---
+class StandInElementId(object):
+
+    def __init__(self, value):
+        self.IntegerValue = value
+
+class StandInChangedElements(object):
+
+    def __init__(self, created, deleted, modified):
+        self._created = created
+        self._deleted = deleted
+        self._modified = modified
+
+    def GetCreatedElementIds(self):
+        return [StandInElementId(v) for v in self._created]
+
+    def GetDeletedElementIds(self):
+        return [StandInElementId(v) for v in self._deleted]
+
+    def GetModifiedElementIds(self):
+        return [StandInElementId(v) for v in self._modified]
+
+class LegacyStandInDocument(object):
+    """A document of a Revit version without GetChangedElements."""
+
+    def __init__(self, title='Stand-in'):
+        self.Title = title
+
+class StandInDocument(LegacyStandInDocument):
+    """
+    A document with a version history. history: {version GUID: (created ids, deleted ids, modified ids)}
+    since that version. Other versions raise, as Revit does for versions of another document.
+    """
+
+    def __init__(self, history, title='Stand-in'):
+        LegacyStandInDocument.__init__(self, title)
+        self.history = history
+
+    def GetChangedElements(self, version_guid):
+        if version_guid not in self.history:
+            raise ValueError("{} is not a version of {}".format(version_guid, self.Title))
+        return StandInChangedElements(*self.history[version_guid])
+
+class StandInDocumentVersion(object):
+
+    def __init__(self, version_guid):
+        self.VersionGUID = version_guid
+
+class StandInFileInfo(object):
+
+    def __init__(self, version_guid):
+        self.version_guid = version_guid
+
+    def GetDocumentVersion(self):
+        if self.version_guid is None:
+            raise AttributeError("GetDocumentVersion")  # Files saved before Revit 2023
+        return StandInDocumentVersion(self.version_guid)
+
+HISTORY = {'v1': ([10, 11], [5], [7, 200])}
+
+# --- Version GUID ---
+def test_file_version_guid(monkeypatch):
+    monkeypatch.setattr(model_versions, 'get_file_info', lambda model_path: StandInFileInfo('v1'))
+    assert get_file_version_guid('latest.rvt') == 'v1'
+
+def test_file_without_version_guid(monkeypatch):
+    monkeypatch.setattr(model_versions, 'get_file_info', lambda model_path: StandInFileInfo(None))
+    assert get_file_version_guid('old.rvt') is None
+
+def test_unreadable_file_has_no_version_guid(monkeypatch):
+    monkeypatch.setattr(model_versions, 'get_file_info', lambda model_path: None)
+    assert get_file_version_guid('missing.rvt') is None
+
+# --- find_native_changes ---
+def test_no_previous_version():
+    assert find_native_changes(StandInDocument(HISTORY), None) is None
+
+def test_revit_without_changed_elements_api():
+    assert find_native_changes(LegacyStandInDocument(), 'v1') is None
+
+def test_foreign_version_history():
+    assert find_native_changes(StandInDocument(HISTORY), 'other document') is None
+
+def test_unknown_type_instances():
+    assert find_native_changes(StandInDocument(HISTORY), 'v1', lambda doc, modified: None) is None
+
+def test_too_many_changes():
+    assert find_native_changes(StandInDocument(HISTORY), 'v1', max_elements=4) is None
+
+def test_native_changes():
+    changes = find_native_changes(StandInDocument(HISTORY), 'v1')
+    assert isinstance(changes, NativeChanges)
+    assert (changes.created, changes.deleted, changes.modified) == (set([10, 11]), set([5]), set([7, 200]))
+    assert changes.element_ids() == [5, 7, 10, 11, 200]
+
+def test_native_changes_with_type_instances():
+    expanded = []
+
+    def expand_types(doc, modified):
+        expanded.append(modified)
+        return [300, 301, 10]
+
+    changes = find_native_changes(StandInDocument(HISTORY), 'v1', expand_types, max_elements=7)
+    assert expanded == [[7, 200]]
+    assert changes.element_ids() == [5, 7, 10, 11, 200, 300, 301]
+
+def test_no_modified_elements_skips_type_expansion():
+    def expand_types(doc, modified):
+        raise AssertionError("no modified elements to expand")
+
+    changes = find_native_changes(StandInDocument({'v1': ([1], [], [])}), 'v1', expand_types)
+    assert changes.element_ids() == [1]